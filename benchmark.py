@@ -1,53 +1,377 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+import csv
+import json
 import time
+import platform
 import argparse
-import gym_minigrid
+import datetime
+import subprocess
+import numpy as np
 import gym
+import gym_minigrid
+from gym_minigrid.register import env_list
+from gym_minigrid.minigrid import Grid, MiniGridEnv
+from gym_minigrid import wrappers
 from gym_minigrid.wrappers import *
 
+# Actions taken by the step benchmarks, by name of the action mix
+ACTION_MIXES = {
+    'forward': [MiniGridEnv.Actions.forward],
+    'turn': [MiniGridEnv.Actions.left, MiniGridEnv.Actions.right],
+    'navigate': [MiniGridEnv.Actions.left, MiniGridEnv.Actions.right, MiniGridEnv.Actions.forward],
+    'random': list(MiniGridEnv.Actions),
+}
+
+BENCHMARKS = [
+    'reset', 'step', 'gen_obs', 'encode', 'process_vis',
+    'render', 'render_partial', 'wrappers'
+]
+
+def time_calls(fn, num_calls, args):
+    """
+    Time num_calls calls of fn, repeated args.repeat times after
+    args.warmup untimed calls. Returns the latencies of all calls, in
+    seconds, and the duration of each repetition.
+    """
+
+    for _ in range(args.warmup):
+        fn()
+
+    latencies = []
+    durations = []
+    timer = time.perf_counter
+    for _ in range(args.repeat):
+        t_start = timer()
+        for _ in range(num_calls):
+            t0 = timer()
+            fn()
+            latencies.append(timer() - t0)
+        durations.append(timer() - t_start)
+
+    return np.array(latencies), durations
+
+def summarize(env_name, benchmark, params, latencies, durations, num_calls):
+    """
+    Summarize the latencies of a benchmark, in microseconds, along with its
+    throughput in calls per second (median over repetitions)
+    """
+
+    us = latencies * 1e6
+    return {
+        'env': env_name,
+        'benchmark': benchmark,
+        'params': params,
+        'calls': len(latencies),
+        'mean_us': float(us.mean()),
+        'min_us': float(us.min()),
+        'p50_us': float(np.percentile(us, 50)),
+        'p90_us': float(np.percentile(us, 90)),
+        'p99_us': float(np.percentile(us, 99)),
+        'max_us': float(us.max()),
+        'per_sec': float(np.median([num_calls / d for d in durations])),
+    }
+
+def run_steps(env, actions):
+    """
+    Make a function stepping through a sequence of actions, resetting the
+    environment at the end of episodes. The latency of the steps which end
+    episodes includes the reset.
+    """
+
+    state = {'t': 0}
+
+    def step():
+        t = state['t']
+        state['t'] = t + 1
+        _, _, done, _ = env.step(actions[t % len(actions)])
+        if done:
+            env.reset()
+
+    return step
+
+def bench_reset(env_name, args):
+    env = gym.make(env_name)
+    env.seed(0)
+    latencies, durations = time_calls(env.reset, args.num_resets, args)
+    return [summarize(env_name, 'reset', '', latencies, durations, args.num_resets)]
+
+def bench_step(env_name, args):
+    results = []
+    rng = np.random.RandomState(0)
+    for mix in args.action_mixes:
+        env = gym.make(env_name)
+        env.seed(0)
+        env.reset()
+        actions = rng.choice(ACTION_MIXES[mix], size=args.num_frames)
+        latencies, durations = time_calls(run_steps(env, actions), args.num_frames, args)
+        results.append(summarize(env_name, 'step', 'mix=' + mix, latencies, durations, args.num_frames))
+    return results
+
+def bench_gen_obs(env_name, args):
+    env = gym.make(env_name).unwrapped
+    env.seed(0)
+    env.reset()
+    latencies, durations = time_calls(env.gen_obs, args.num_frames, args)
+    return [summarize(env_name, 'gen_obs', '', latencies, durations, args.num_frames)]
+
+def bench_encode(env_name, args):
+    env = gym.make(env_name).unwrapped
+    env.seed(0)
+    env.reset()
+    grid = env.grid
+    latencies, durations = time_calls(grid.encode, args.num_frames, args)
+    return [summarize(env_name, 'encode', '', latencies, durations, args.num_frames)]
+
+def bench_process_vis(env_name, args):
+    """
+    Time process_vis on the agent's view, for list-backed grids, the
+    default, and for array-backed grids
+    """
+
+    results = []
+    env = gym.make(env_name).unwrapped
+    env.seed(0)
+    image = env.reset()['image']
+    sz = image.shape[0]
+    agent_pos = (sz // 2, sz - 1)
+
+    make_grids = {
+        'list': lambda: Grid.decode(image)[0],
+        'array': lambda: Grid.from_array(image),
+    }
+    for storage, make_grid in make_grids.items():
+        # process_vis modifies its grid, so that each call gets its own copy
+        num_grids = args.warmup + args.repeat * args.num_frames
+        grids = [make_grid() for _ in range(num_grids)]
+        grids.reverse()
+
+        def process_vis():
+            grids.pop().process_vis(agent_pos)
+
+        latencies, durations = time_calls(process_vis, args.num_frames, args)
+        params = 'grid=' + storage
+        results.append(summarize(env_name, 'process_vis', params, latencies, durations, args.num_frames))
+    return results
+
+def bench_render(env_name, args):
+    results = []
+    env = gym.make(env_name)
+    env.seed(0)
+    env.reset()
+    for tile_size in args.tile_sizes:
+        render = lambda: env.render('rgb_array', tile_size=tile_size)
+        latencies, durations = time_calls(render, args.num_frames, args)
+        params = 'tile_size=%d' % tile_size
+        results.append(summarize(env_name, 'render', params, latencies, durations, args.num_frames))
+    return results
+
+def bench_render_partial(env_name, args):
+    results = []
+    rng = np.random.RandomState(0)
+    actions = rng.choice(ACTION_MIXES['navigate'], size=args.num_frames)
+    for tile_size in args.tile_sizes:
+        env = gym.make(env_name)
+        env = RGBImgPartialObsWrapper(env, tile_size=tile_size)
+        env.seed(0)
+        env.reset()
+        latencies, durations = time_calls(run_steps(env, actions), args.num_frames, args)
+        params = 'tile_size=%d' % tile_size
+        results.append(summarize(env_name, 'render_partial', params, latencies, durations, args.num_frames))
+    return results
+
+def wrapper_types():
+    """
+    Get the wrappers defined in gym_minigrid.wrappers
+    """
+
+    return [
+        value for name, value in sorted(vars(wrappers).items())
+        if isinstance(value, type) and issubclass(value, gym.Wrapper)
+        and value.__module__ == wrappers.__name__
+    ]
+
+def bench_wrappers(env_name, args):
+    """
+    Time steps through each wrapper with its default arguments, with the
+    navigate action mix. Wrappers which can't wrap the environment are
+    skipped.
+    """
+
+    results = []
+    rng = np.random.RandomState(0)
+    actions = rng.choice(ACTION_MIXES['navigate'], size=args.num_frames)
+    for wrapper_type in wrapper_types():
+        try:
+            env = wrapper_type(gym.make(env_name))
+            env.seed(0)
+            env.reset()
+            latencies, durations = time_calls(run_steps(env, actions), args.num_frames, args)
+        except Exception as e:
+            print('  skipping {}: {!r}'.format(wrapper_type.__name__, e), file=sys.stderr)
+            continue
+        params = 'wrapper=' + wrapper_type.__name__
+        results.append(summarize(env_name, 'wrapper_step', params, latencies, durations, args.num_frames))
+    return results
+
+def machine_info():
+    """
+    Metadata about the machine and software the benchmarks ran with
+    """
+
+    info = {
+        'time': datetime.datetime.now().isoformat(),
+        'hostname': platform.node(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'gym': gym.__version__,
+    }
+
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    info['processor'] = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+
+    try:
+        info['commit'] = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
+    return info
+
+def result_key(result):
+    return (result['env'], result['benchmark'], result['params'])
+
+def compare(old_path, new_path, threshold):
+    """
+    Compare the median latencies of two result files, and return the
+    number of benchmarks which got slower by more than threshold
+    """
+
+    with open(old_path) as f:
+        old = {result_key(r): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {result_key(r): r for r in json.load(f)['results']}
+
+    num_regressions = 0
+    print('{:<36} {:<14} {:<32} {:>10} {:>10} {:>8}'.format(
+        'Environment', 'Benchmark', 'Params', 'Old p50', 'New p50', 'Change'
+    ))
+    for key in sorted(old.keys() & new.keys()):
+        old_p50 = old[key]['p50_us']
+        new_p50 = new[key]['p50_us']
+        change = new_p50 / old_p50 - 1 if old_p50 > 0 else 0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            num_regressions += 1
+        elif change < -threshold:
+            flag = '  improved'
+        print('{:<36} {:<14} {:<32} {:>8.1f}us {:>8.1f}us {:>+7.1%}{}'.format(
+            *key, old_p50, new_p50, change, flag
+        ))
+
+    for key in sorted(old.keys() - new.keys()):
+        print('missing from {}: {}'.format(new_path, ' '.join(key)))
+    for key in sorted(new.keys() - old.keys()):
+        print('missing from {}: {}'.format(old_path, ' '.join(key)))
+
+    print('{} regressions beyond {:.0%}'.format(num_regressions, threshold))
+    return num_regressions
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "--env-name",
-    dest="env_name",
-    help="gym environment to load",
-    default='MiniGrid-LavaGapS7-v0'
+    dest="env_names",
+    action="append",
+    help="gym environment to load, can be repeated (default: MiniGrid-LavaGapS7-v0)",
+    default=[]
+)
+parser.add_argument("--all", action="store_true", help="benchmark every registered environment")
+parser.add_argument(
+    "--benchmarks",
+    default=','.join(BENCHMARKS),
+    help="comma-separated benchmarks to run, among: " + ', '.join(BENCHMARKS)
+)
+parser.add_argument("--num_resets", type=int, default=200, help="timed resets per repetition")
+parser.add_argument("--num_frames", type=int, default=5000, help="timed calls per repetition of other benchmarks")
+parser.add_argument("--warmup", type=int, default=10, help="untimed calls before each benchmark")
+parser.add_argument("--repeat", type=int, default=3, help="repetitions of each benchmark")
+parser.add_argument(
+    "--action_mixes",
+    default=','.join(ACTION_MIXES),
+    help="comma-separated action mixes of the step benchmark, among: " + ', '.join(ACTION_MIXES)
+)
+parser.add_argument("--tile_sizes", default='8,16,32', help="comma-separated tile sizes to render at")
+parser.add_argument("--json", help="file to write results and machine metadata to")
+parser.add_argument("--csv", help="file to write results to")
+parser.add_argument(
+    "--compare",
+    nargs=2,
+    metavar=('OLD', 'NEW'),
+    help="compare two JSON result files instead of running benchmarks"
+)
+parser.add_argument(
+    "--threshold",
+    type=float,
+    default=0.1,
+    help="relative slowdown of median latencies reported as a regression"
 )
-parser.add_argument("--num_resets", default=200)
-parser.add_argument("--num_frames", default=5000)
-args = parser.parse_args()
 
-env = gym.make(args.env_name)
+if __name__ == '__main__':
+    args = parser.parse_args()
 
-# Benchmark env.reset
-t0 = time.time()
-for i in range(args.num_resets):
-    env.reset()
-t1 = time.time()
-dt = t1 - t0
-reset_time = (1000 * dt) / args.num_resets
-
-# Benchmark rendering
-t0 = time.time()
-for i in range(args.num_frames):
-    env.render('rgb_array')
-t1 = time.time()
-dt = t1 - t0
-frames_per_sec = args.num_frames / dt
-
-# Create an environment with an RGB agent observation
-env = gym.make(args.env_name)
-env = RGBImgPartialObsWrapper(env)
-env = ImgObsWrapper(env)
-
-# Benchmark rendering
-t0 = time.time()
-for i in range(args.num_frames):
-    obs, reward, done, info = env.step(0)
-t1 = time.time()
-dt = t1 - t0
-agent_view_fps = args.num_frames / dt
-
-print('Env reset time: {:.1f} ms'.format(reset_time))
-print('Rendering FPS : {:.0f}'.format(frames_per_sec))
-print('Agent view FPS: {:.0f}'.format(agent_view_fps))
+    if args.compare:
+        num_regressions = compare(*args.compare, args.threshold)
+        sys.exit(1 if num_regressions > 0 else 0)
+
+    env_names = env_list if args.all else (args.env_names or ['MiniGrid-LavaGapS7-v0'])
+    benchmarks = args.benchmarks.split(',')
+    for benchmark in benchmarks:
+        if benchmark not in BENCHMARKS:
+            parser.error('unknown benchmark: ' + benchmark)
+    args.action_mixes = args.action_mixes.split(',')
+    for mix in args.action_mixes:
+        if mix not in ACTION_MIXES:
+            parser.error('unknown action mix: ' + mix)
+    args.tile_sizes = [int(s) for s in args.tile_sizes.split(',')]
+
+    results = []
+    for env_name in env_names:
+        print(env_name, file=sys.stderr)
+        for benchmark in benchmarks:
+            try:
+                results += globals()['bench_' + benchmark](env_name, args)
+            except Exception as e:
+                print('  {} failed: {!r}'.format(benchmark, e), file=sys.stderr)
+
+    print('{:<36} {:<14} {:<32} {:>9} {:>9} {:>9} {:>11}'.format(
+        'Environment', 'Benchmark', 'Params', 'p50 (us)', 'p90 (us)', 'p99 (us)', 'Calls/s'
+    ))
+    for r in results:
+        print('{:<36} {:<14} {:<32} {:>9.1f} {:>9.1f} {:>9.1f} {:>11.0f}'.format(
+            r['env'], r['benchmark'], r['params'], r['p50_us'], r['p90_us'], r['p99_us'], r['per_sec']
+        ))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'metadata': machine_info(), 'args': vars(args), 'results': results}, f, indent=2)
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()) if results else [])
+            writer.writeheader()
+            writer.writerows(results)
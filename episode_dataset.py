@@ -0,0 +1,222 @@
+import os
+import json
+import numpy as np
+import gym
+import gym_minigrid
+from gym_minigrid.envs.delayedmatching import render_symbolic_frames
+
+# Version of the shards written by write_shard
+EPISODE_DATASET_FORMAT = 1
+
+
+def run_seeded_episode(env, seed):
+    """
+    Run the episode of an environment seeded with a seed, returning its
+    frames, shape: (nb_frames, y, x, channel), and its label
+    """
+    env.seed(seed)
+    frames = [env.reset()]
+    done = False
+    while not done: # complete an episode
+        # The action is ignored, but gym.make's wrappers require one
+        obs, label, done, _ = env.step(0)
+        frames.append(obs)
+    return np.stack(frames, axis=0), label
+
+
+def run_symbolic_episode(env, seed):
+    """
+    Run the episode of a DelayedMatching environment seeded with a seed,
+    returning the encoded grids and shape parameters of its symbolic
+    frames (see DelayedMatchingEnv.gen_symbolic_frame), and its label
+    """
+    env.unwrapped.symbolic = True
+    env.seed(seed)
+    frames = [env.reset()]
+    done = False
+    while not done: # complete an episode
+        # The action is ignored, but gym.make's wrappers require one
+        obs, label, done, _ = env.step(0)
+        frames.append(obs)
+    grids = np.stack([grid for grid, _ in frames], axis=0)
+    params = np.stack([params for _, params in frames], axis=0)
+    return grids, params, label
+
+
+def write_shard(path, env_id, seeds, symbolic=False):
+    """
+    Write the episodes of an environment for the given seeds into a shard
+    directory. Frames are appended to a raw uint8 file as episodes are
+    generated, so that a shard never has to fit in memory. With symbolic
+    set, the frames of DelayedMatching environments are stored as their
+    encoded grids and shape parameters instead, which the loader renders.
+    """
+    os.makedirs(path, exist_ok=True)
+    env = gym.make(env_id)
+
+    labels = []
+    seq_lens = []
+    frame_shape = None
+    if symbolic:
+        grids = []
+        params = []
+        for seed in seeds:
+            episode_grids, episode_params, label = run_symbolic_episode(env, int(seed))
+            grids.append(episode_grids)
+            params.append(episode_params)
+            labels.append(label)
+            seq_lens.append(len(episode_grids))
+        if len(seeds) > 0:
+            np.save(os.path.join(path, 'grids.npy'), np.concatenate(grids, axis=0))
+            np.save(os.path.join(path, 'params.npy'), np.concatenate(params, axis=0))
+            unwrapped = env.unwrapped
+            frame_shape = (unwrapped.height * unwrapped.tile_size, unwrapped.width * unwrapped.tile_size, 3)
+    else:
+        with open(os.path.join(path, 'frames.u8'), 'wb') as f:
+            for seed in seeds:
+                frames, label = run_seeded_episode(env, int(seed))
+                frame_shape = frames.shape[1:]
+                f.write(frames.tobytes())
+                labels.append(label)
+                seq_lens.append(len(frames))
+    tile_size = env.unwrapped.tile_size
+    env.close()
+
+    offsets = np.zeros(len(seeds) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(seq_lens)
+    np.save(os.path.join(path, 'labels.npy'), np.array(labels, dtype=np.int64))
+    np.save(os.path.join(path, 'seq_lens.npy'), np.array(seq_lens, dtype=np.int64))
+    np.save(os.path.join(path, 'seeds.npy'), np.array(seeds, dtype=np.int64))
+    np.save(os.path.join(path, 'offsets.npy'), offsets)
+
+    meta = {
+        'format': EPISODE_DATASET_FORMAT,
+        'env_id': env_id,
+        'num_episodes': len(seeds),
+        'frame_shape': list(frame_shape) if frame_shape is not None else None,
+        'symbolic': symbolic,
+        'tile_size': tile_size
+    }
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+class EpisodeShard():
+    """
+    Episodes of one shard, whose frames (or symbolic frames) are mapped
+    into memory
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        assert meta['format'] == EPISODE_DATASET_FORMAT, 'unsupported episode dataset format'
+
+        self.env_id = meta['env_id']
+        self.labels = np.load(os.path.join(path, 'labels.npy'))
+        self.seq_lens = np.load(os.path.join(path, 'seq_lens.npy'))
+        self.seeds = np.load(os.path.join(path, 'seeds.npy'))
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.symbolic = meta.get('symbolic', False)
+        self.tile_size = meta.get('tile_size')
+        self.frames = None
+        if meta['num_episodes'] > 0 and self.symbolic:
+            self.grids = np.load(os.path.join(path, 'grids.npy'), mmap_mode='r')
+            self.params = np.load(os.path.join(path, 'params.npy'), mmap_mode='r')
+        elif meta['num_episodes'] > 0:
+            self.frames = np.memmap(
+                os.path.join(path, 'frames.u8'),
+                dtype='uint8',
+                mode='r',
+                shape=(int(self.offsets[-1]),) + tuple(meta['frame_shape'])
+            )
+
+    def __len__(self):
+        return len(self.labels)
+
+    def episode(self, i):
+        return self.frames[self.offsets[i]:self.offsets[i + 1]]
+
+    def symbolic_episode(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.grids[start:end], self.params[start:end]
+
+    @property
+    def nbytes(self):
+        """Size of the stored frames"""
+        if len(self) == 0:
+            return 0
+        if self.symbolic:
+            return self.grids.nbytes + self.params.nbytes
+        return self.frames.nbytes
+
+
+class EpisodeDataset():
+    """
+    Dataset of pre-generated episodes of an environment, stored as a
+    directory of shards written by write_shard. Batches are read in random
+    access from the memory-mapped frames, so that training on the same
+    episodes for several epochs only costs reading them from the page cache
+    instead of rendering them again. Shards of symbolic frames are rendered
+    a whole batch at a time instead (see render_symbolic_frames).
+    """
+
+    def __init__(self, path):
+        names = sorted(
+            name for name in os.listdir(path)
+            if os.path.isfile(os.path.join(path, name, 'meta.json'))
+        )
+        assert len(names) > 0, 'no shard in ' + path
+        self.shards = [EpisodeShard(os.path.join(path, name)) for name in names]
+        self.env_id = self.shards[0].env_id
+        assert all(shard.env_id == self.env_id for shard in self.shards)
+        self.symbolic = self.shards[0].symbolic
+        self.tile_size = self.shards[0].tile_size
+        assert all(shard.symbolic == self.symbolic for shard in self.shards)
+
+        # Shard and index within that shard of each episode of the dataset
+        self.shard_idx = np.concatenate([
+            np.full(len(shard), i, dtype=np.int64) for i, shard in enumerate(self.shards)
+        ])
+        self.episode_idx = np.concatenate([
+            np.arange(len(shard), dtype=np.int64) for shard in self.shards
+        ])
+        self.labels = np.concatenate([shard.labels for shard in self.shards])
+        self.seq_lens = np.concatenate([shard.seq_lens for shard in self.shards])
+        self.seeds = np.concatenate([shard.seeds for shard in self.shards])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def batch(self, indices):
+        """
+        Get the episodes of the given indices, returning their frames
+        concatenated in one array of shape (nb_total_frames, y, x, channel),
+        their labels and their number of frames
+        """
+        shards = [self.shards[self.shard_idx[i]] for i in indices]
+        if self.symbolic:
+            episodes = [shard.symbolic_episode(i) for shard, i in zip(shards, self.episode_idx[indices])]
+            frames = render_symbolic_frames(
+                np.concatenate([grids for grids, _ in episodes], axis=0),
+                np.concatenate([params for _, params in episodes], axis=0),
+                self.tile_size
+            )
+        else:
+            frames = np.concatenate([
+                shard.episode(i) for shard, i in zip(shards, self.episode_idx[indices])
+            ], axis=0)
+        return frames, self.labels[indices], self.seq_lens[indices].tolist()
+
+    def batches(self, batch_size, np_random, nb_epochs=None):
+        """
+        Iterate over batches of episodes, going through the dataset in a new
+        random order at each epoch, for nb_epochs epochs or forever
+        """
+        assert batch_size <= len(self), 'batch size larger than the dataset'
+        epoch = 0
+        while nb_epochs is None or epoch < nb_epochs:
+            order = np_random.permutation(len(self))
+            for start in range(0, len(order) - batch_size + 1, batch_size):
+                yield self.batch(order[start:start + batch_size])
+            epoch += 1
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import argparse
+import multiprocessing as mp
+from episode_dataset import EpisodeDataset, write_shard
+
+def _write_shard(args):
+    path, env_id, seeds, symbolic = args
+    t0 = time.time()
+    write_shard(path, env_id, seeds, symbolic)
+    return len(seeds), time.time() - t0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Pre-generate a dataset of episodes for supervised training (see episode_dataset)'
+    )
+    parser.add_argument("--env", required=True, help="gym environment to generate episodes of")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--num_episodes", type=int, default=100000, help="number of episodes, one per seed")
+    parser.add_argument("--start_seed", type=int, default=0)
+    parser.add_argument("--num_workers", type=int, default=None, help="number of processes, all CPUs by default")
+    parser.add_argument("--shard_size", type=int, default=1000, help="number of episodes per shard")
+    parser.add_argument(
+        "--symbolic",
+        action="store_true",
+        help="store DelayedMatching frames as encoded grids and shape parameters, rendered when loading"
+    )
+    args = parser.parse_args()
+
+    seeds = range(args.start_seed, args.start_seed + args.num_episodes)
+    tasks = [
+        (os.path.join(args.out, 'shard-%05d' % (i // args.shard_size)), args.env, seeds[i:i+args.shard_size], args.symbolic)
+        for i in range(0, len(seeds), args.shard_size)
+    ]
+
+    t0 = time.time()
+    num_episodes = 0
+    with mp.Pool(args.num_workers) as pool:
+        for n, dt in pool.imap_unordered(_write_shard, tasks):
+            num_episodes += n
+            print('{}: {}/{} episodes, {:.0f} episodes/s'.format(
+                args.env,
+                num_episodes,
+                len(seeds),
+                num_episodes / (time.time() - t0)
+            ))
+
+    dataset = EpisodeDataset(args.out)
+    size = sum(shard.nbytes for shard in dataset.shards)
+    print('{} episodes, {} frames, {:.2f} GB'.format(
+        len(dataset),
+        int(dataset.seq_lens.sum()),
+        size / 1e9
+    ))
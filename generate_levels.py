@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import argparse
+import multiprocessing as mp
+from collections import Counter
+import gym
+import gym_minigrid
+from gym_minigrid.register import env_list
+from gym_minigrid.minigrid import MiniGridEnv
+from gym_minigrid.levelbank import LevelBank, generate_chunk
+
+def _generate(args):
+    env_id, seeds = args
+    t0 = time.time()
+    bank, failures = generate_chunk(env_id, seeds)
+    return bank, failures, time.time() - t0
+
+def save_shard(out, env_id, shard_idx, banks):
+    """
+    Save the levels of consecutive chunks of seeds as one bank
+    """
+
+    path = os.path.join(out, env_id, 'shard-%05d' % shard_idx)
+    LevelBank.concatenate(banks).save(path)
+    return path
+
+def generate(pool, env_name, out, start_seed, num_levels, chunk_size, shard_size):
+    """
+    Generate the levels of an environment for num_levels seeds from
+    start_seed, in tasks of chunk_size seeds, writing them into shards of
+    shard_size seeds under out, and return generation statistics
+    """
+
+    seeds = range(start_seed, start_seed + num_levels)
+    tasks = [
+        (env_name, seeds[i:i+chunk_size])
+        for i in range(0, len(seeds), chunk_size)
+    ]
+    chunks_per_shard = max(shard_size // chunk_size, 1)
+
+    t0 = time.time()
+    last_report = t0
+    num_seeds = 0
+    num_generated = 0
+    gen_time = 0
+    failures = Counter()
+    shard = []
+    num_shards = 0
+
+    for i, (bank, chunk_failures, dt) in enumerate(pool.imap(_generate, tasks)):
+        shard.append(bank)
+        failures.update(chunk_failures)
+        num_seeds += len(tasks[i][1])
+        num_generated += len(bank)
+        gen_time += dt
+
+        last = i == len(tasks) - 1
+        if len(shard) == chunks_per_shard or last:
+            if any(len(bank) > 0 for bank in shard):
+                save_shard(out, env_name, num_shards, shard)
+                num_shards += 1
+            shard = []
+
+        now = time.time()
+        if now - last_report >= 5 or last:
+            last_report = now
+            print('{}: {}/{} seeds, {:.0f} levels/s, {} failed'.format(
+                env_name,
+                num_seeds,
+                len(seeds),
+                num_generated / (now - t0),
+                sum(failures.values())
+            ))
+
+    return {
+        'env_name': env_name,
+        'num_seeds': num_seeds,
+        'num_levels': num_generated,
+        'time': time.time() - t0,
+        'gen_time': gen_time,
+        'failures': failures,
+        'num_shards': num_shards
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Pre-generate level banks (see gym_minigrid.levelbank)'
+    )
+    parser.add_argument(
+        "--env-name",
+        dest="env_names",
+        action="append",
+        help="gym environment to generate levels of, can be repeated",
+        default=[]
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="generate levels of every registered environment"
+    )
+    parser.add_argument("--out", default="levels", help="output directory")
+    parser.add_argument("--num_levels", type=int, default=100000, help="number of seeds per environment")
+    parser.add_argument("--start_seed", type=int, default=0)
+    parser.add_argument("--num_workers", type=int, default=None, help="number of processes, all CPUs by default")
+    parser.add_argument("--chunk_size", type=int, default=1000, help="number of seeds per task")
+    parser.add_argument("--shard_size", type=int, default=100000, help="number of seeds per output shard")
+    args = parser.parse_args()
+
+    env_names = env_list if args.all else args.env_names
+    if not env_names:
+        parser.error('no environment given, use --env-name or --all')
+
+    # Only environments resetting through MiniGridEnv.reset() can load levels
+    selected = []
+    for env_name in env_names:
+        env = gym.make(env_name).unwrapped
+        if type(env).reset is MiniGridEnv.reset:
+            selected.append(env_name)
+        else:
+            print('Skipping {}: custom reset()'.format(env_name))
+        env.close()
+
+    stats = []
+    with mp.Pool(args.num_workers) as pool:
+        for env_name in selected:
+            stats.append(generate(
+                pool,
+                env_name,
+                args.out,
+                args.start_seed,
+                args.num_levels,
+                args.chunk_size,
+                args.shard_size
+            ))
+
+    print()
+    print('{:<42} {:>10} {:>12} {:>14} {:>8}'.format(
+        'Environment', 'Levels', 'Levels/s', 'Levels/s/proc', 'Shards'
+    ))
+    for s in stats:
+        print('{:<42} {:>10} {:>12.0f} {:>14.0f} {:>8}'.format(
+            s['env_name'],
+            s['num_levels'],
+            s['num_levels'] / s['time'],
+            s['num_levels'] / s['gen_time'] if s['gen_time'] > 0 else 0,
+            s['num_shards']
+        ))
+
+    # Histogram of the failures of each generator, by exception type
+    print()
+    print('Failures')
+    for s in stats:
+        failures = s['failures']
+        if not failures:
+            print('  {}: none'.format(s['env_name']))
+            continue
+        print('  {}: {:.3%} of seeds'.format(s['env_name'], sum(failures.values()) / s['num_seeds']))
+        for name, count in failures.most_common():
+            print('    {:<24} {:>10} {:>9.3%}'.format(name, count, count / s['num_seeds']))
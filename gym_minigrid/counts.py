@@ -0,0 +1,257 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+def count_bonus(counts):
+    """
+    Exploration bonus for visit counts, 1 / sqrt(count)
+    """
+
+    return 1 / np.sqrt(counts)
+
+class VisitCounts:
+    """
+    Dense visit counts indexed by tuples of integers, e.g. (x, y, direction,
+    action) for the state-action pairs of a grid. Counts can decay by a
+    constant factor at each update. Rather than scaling the whole array,
+    counts are stored divided by a common scale, which is renormalized when
+    it gets small.
+
+    Counts are kept in num_slots separate arrays, each updated by a single
+    writer, and read as the sum over slots. The arrays can be placed in
+    shared memory, so that worker processes each update their own slot
+    (see attach) while all of them read the merged counts.
+    """
+
+    # Scale below which stored counts are renormalized
+    min_scale = 1e-100
+
+    def __init__(self, shape, decay=1.0, num_slots=1, slot=0, shared=False, _shm=None):
+        self.shape = tuple(shape)
+        self.decay = decay
+        self.num_slots = num_slots
+        self.slot = slot
+
+        # Scale of each slot, followed by the counts of each slot
+        size = num_slots * (1 + int(np.prod(self.shape)))
+        if _shm is None and shared:
+            _shm = shared_memory.SharedMemory(create=True, size=size * 8)
+            data = np.ndarray(size, dtype=np.float64, buffer=_shm.buf)
+            data[:] = 0
+        elif _shm is not None:
+            data = np.ndarray(size, dtype=np.float64, buffer=_shm.buf)
+        else:
+            data = np.zeros(size, dtype=np.float64)
+        self._shm = _shm
+
+        self.scales = data[:num_slots]
+        self.slots = data[num_slots:].reshape((num_slots,) + self.shape)
+        if _shm is None or shared:
+            self.scales[:] = 1
+
+    @classmethod
+    def for_env(cls, env, actions=True, **kwargs):
+        """
+        Create counts of the positions and directions of the agent of an
+        environment, and of the actions taken from there if actions is set
+        """
+
+        env = env.unwrapped
+        shape = (env.width, env.height, 4)
+        if actions:
+            shape += (env.action_space.n,)
+        return cls(shape, **kwargs)
+
+    @property
+    def name(self):
+        """Name of the shared memory holding the counts"""
+        return self._shm.name
+
+    @classmethod
+    def attach(cls, name, shape, slot, decay=1.0, num_slots=1):
+        """
+        Open counts created with shared=True in another process, to update
+        the given slot
+        """
+
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shape, decay=decay, num_slots=num_slots, slot=slot, _shm=shm)
+
+    def update(self, *index):
+        """
+        Count one visit of each of the given tuples, as integers or arrays of
+        integers (e.g. for a batch of environments), then decay the counts.
+        Return the merged counts of the tuples after the update.
+        """
+
+        slot = self.slot
+        scale = self.scales[slot] * self.decay
+        if scale < self.min_scale:
+            self.slots[slot] *= scale
+            scale = 1.0
+
+        self.scales[slot] = scale
+        if all(isinstance(i, (int, np.integer)) for i in index):
+            self.slots[(slot,) + index] += 1 / scale
+        else:
+            np.add.at(self.slots[slot], index, 1 / scale)
+
+        return self.get(*index)
+
+    def get(self, *index):
+        """
+        Get the counts of the given tuples, summed over all slots
+        """
+
+        return self.scales @ self.slots[(slice(None),) + index]
+
+    def counts(self):
+        """
+        Get all the counts, summed over all slots
+        """
+
+        return np.tensordot(self.scales, self.slots, axes=1)
+
+    def clear(self):
+        self.slots[self.slot] = 0
+        self.scales[self.slot] = 1
+
+    def close(self):
+        if self._shm is not None:
+            self.scales = None
+            self.slots = None
+            self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+class HashedCounts:
+    """
+    Visit counts of arbitrary 64-bit keys, e.g. full state hashes (see
+    MiniGridEnv.state_hash), in a bounded open-addressing table. A key is
+    looked up in max_probes consecutive slots. When these are all taken by
+    other keys, the least visited of them is evicted. Counts decay as
+    for VisitCounts.
+    """
+
+    min_scale = 1e-100
+
+    def __init__(self, capacity=2**20, decay=1.0, max_probes=16):
+        assert capacity & (capacity - 1) == 0, "capacity must be a power of 2"
+        self.capacity = capacity
+        self.decay = decay
+        self.max_probes = max_probes
+        self.scale = 1.0
+
+        # Key 0 marks empty slots, and is stored as 1
+        self.keys = np.zeros(capacity, dtype=np.uint64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self._probes = np.arange(max_probes, dtype=np.uint64)
+
+    def _find_one(self, key, keep=()):
+        """
+        Get the slot of a key, given as a non-zero int, inserting it if
+        missing. When all the probed slots are taken by other keys, the
+        least visited of them is evicted, preferring slots not in keep.
+        """
+
+        mask = self.capacity - 1
+        evict = None
+        evict_kept = None
+        for p in range(self.max_probes):
+            slot = (key + p) & mask
+            taken = self.keys.item(slot)
+            if taken == key:
+                return slot
+            if taken == 0:
+                evict = slot
+                break
+            if slot in keep:
+                if evict_kept is None or self.values[slot] < self.values[evict_kept]:
+                    evict_kept = slot
+            elif evict is None or self.values[slot] < self.values[evict]:
+                evict = slot
+
+        if evict is None:
+            evict = evict_kept
+
+        self.keys[evict] = key
+        self.values[evict] = 0
+        return evict
+
+    def _lookup(self, keys):
+        """
+        Look keys up, given as non-zero uint64, in the slots following
+        their hash. Return their slots, and whether they were found.
+        """
+
+        mask = np.uint64(self.capacity - 1)
+        candidates = (keys[:, None] + self._probes) & mask
+        found = self.keys[candidates] == keys[:, None]
+        slots = candidates[np.arange(len(keys)), found.argmax(axis=1)]
+        return slots, found.any(axis=1)
+
+    def _add(self, keys, amounts):
+        """
+        Add amounts to the stored values of distinct keys, inserting the
+        missing keys, and return the new values
+        """
+
+        slots, found = self._lookup(keys)
+        values = np.where(found, self.values[slots], 0) + amounts
+        self.values[slots[found]] = values[found]
+
+        # Insert the missing keys one by one, as they may compete for slots.
+        # Values are computed beforehand, so that when the probed slots are
+        # all taken by keys of the batch, the evicted key was counted first.
+        keep = set(slots[found].tolist())
+        for i in np.flatnonzero(~found).tolist():
+            slot = self._find_one(int(keys[i]), keep)
+            self.values[slot] = values[i]
+            keep.add(slot)
+
+        return values
+
+    @staticmethod
+    def _keys(keys):
+        keys = np.asarray(keys, dtype=np.uint64).reshape(-1)
+        return np.where(keys == 0, np.uint64(1), keys)
+
+    def update(self, keys):
+        """
+        Count one visit of each of the given keys, then decay the counts.
+        Return the counts of the keys after the update.
+        """
+
+        scale = self.scale * self.decay
+        if scale < self.min_scale:
+            self.values *= scale
+            scale = 1.0
+        self.scale = scale
+
+        if isinstance(keys, (int, np.integer)):
+            slot = self._find_one(int(keys) or 1)
+            self.values[slot] += 1 / scale
+            return self.values[slot] * scale
+
+        keys, inverse, visits = np.unique(self._keys(keys), return_inverse=True, return_counts=True)
+        values = self._add(keys, visits / scale)
+        return values[inverse] * scale
+
+    def get(self, keys):
+        """
+        Get the counts of the given keys, zero for unknown keys
+        """
+
+        slots, found = self._lookup(self._keys(keys))
+        return np.where(found, self.values[slots] * self.scale, 0)
+
+    def merge(self, other):
+        """
+        Add the counts of another table, e.g. one from a worker process
+        """
+
+        taken = np.flatnonzero(other.keys)
+        self._add(other.keys[taken], other.values[taken] * other.scale / self.scale)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.keys))
@@ -9,6 +9,11 @@ class CrossingEnv(MiniGridEnv):
     Environment with wall or lava obstacles, sparse reward.
     """
 
+    mission_templates = (
+        "avoid the lava and get to the green goal square",
+        "find the opening and get to the green goal square",
+    )
+
     def __init__(self, size=9, num_crossings=1, obstacle_type=Lava, seed=None):
         self.num_crossings = num_crossings
         self.obstacle_type = obstacle_type
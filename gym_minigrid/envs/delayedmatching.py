@@ -8,14 +8,25 @@ class DelayedMatchingEnv(MiniGridEnv):
     The agent has to remember the initial object, and select the location containing the matching object.
     """
 
+    mission_templates = ("Select the matching object",)
+
+    state_attrs = ('cue_pos', 'matching_obj', 'second_obj', 'matching_pos', 'nb_delay_frames')
+
+    # Maximum number of objects in a frame, the two test objects
+    max_frame_objs = 2
+
     def __init__(
         self,
         seed,
         size=8,
         tile_size=32,
-        max_delay=30
+        max_delay=30,
+        symbolic=False,
+        run_length=False
     ):
         self.tile_size = tile_size
+        self.symbolic = symbolic
+        self.run_length = run_length
         self.max_frames_delay = max_delay
         super(DelayedMatchingEnv, self).__init__(
             seed=seed,
@@ -60,6 +71,9 @@ class DelayedMatchingEnv(MiniGridEnv):
         self.mission = 'Select the matching object'
 
     def step(self, action=''):
+        if self.run_length:
+            return self.step_run_length()
+
         label = -1
         done = False
 
@@ -76,7 +90,7 @@ class DelayedMatchingEnv(MiniGridEnv):
             label = self.matching_pos[1] + (self.matching_pos[0]*self.height)
             done = True
 
-        obs = self.gen_obs()['image']
+        obs = self.gen_frame()
 
         self.step_count += 1
         return obs, label, done, {}
@@ -88,9 +102,58 @@ class DelayedMatchingEnv(MiniGridEnv):
         self.step_count = 0
 
         # first observation
-        obs = self.gen_obs()['image']
+        obs = self.gen_frame()
+        if self.run_length:
+            return obs, 1
         return obs
 
+    def step_run_length(self):
+        """
+        Step through the episode by runs of identical frames, returning
+        (frame, repeat count) pairs: the blank frame of the whole delay
+        period, then the test frame, which is seen twice. Expanding the
+        runs gives the frames returned by step() otherwise.
+        """
+        if self.step_count < self.nb_delay_frames:
+            # Remove cue obj
+            self.grid.set(*self.cue_pos, None)
+            repeat = self.nb_delay_frames - self.step_count
+            obs = (self.gen_frame(), repeat)
+            self.step_count += repeat
+            return obs, -1, False, {}
+
+        # Place test objects
+        self.matching_pos = self.place_obj(self.matching_obj)
+        second_pos = self.place_obj(self.second_obj)
+        label = self.matching_pos[1] + (self.matching_pos[0]*self.height)
+
+        obs = (self.gen_frame(), 2)
+        self.step_count += 2
+        return obs, label, True, {}
+
+    def gen_frame(self):
+        """
+        Generate the frame returned by reset() and step(): the rendered
+        image, or its symbolic encoding if symbolic is set
+        """
+        if self.symbolic:
+            return self.gen_symbolic_frame()
+        return self.gen_obs()['image']
+
+    def gen_symbolic_frame(self):
+        """
+        Encode the current frame as the encoded grid, shape: (width, height, 3),
+        and the shape parameters of its objects, shape: (max_frame_objs, MAX_SHAPE_PARAMS),
+        listed in the order of their cells in the grid encoding. The frame is
+        rendered back by render_symbolic_frames.
+        """
+        grid = self.grid.encode()
+        params = np.zeros((self.max_frame_objs, MAX_SHAPE_PARAMS))
+        for k, (i, j) in enumerate(np.argwhere(grid[:, :, 0] != OBJECT_TO_IDX['empty'])):
+            shape_params = self.grid.get(i, j).params()
+            params[k, :len(shape_params)] = shape_params
+        return grid, params
+
     def gen_obs(self):
         """
         Generate the observation. Here, it is the complete grid.
@@ -118,10 +181,8 @@ class DelayedMatchingEnv(MiniGridEnv):
             self.window = gym_minigrid.window.Window('gym_minigrid')
             self.window.show(block=False)
 
-        # Render the whole grid
-        img = self.grid.render(
-            tile_size
-        )
+        # Render the whole grid, redrawing only the cells which changed
+        img = self.grid_renderer(tile_size).render(self.grid).copy()
 
         if mode == 'human':
             self.window.show_img(img)
@@ -130,6 +191,8 @@ class DelayedMatchingEnv(MiniGridEnv):
         return img
 
 class Circle(WorldObj):
+    __slots__ = ('radius', 'cx', 'cy')
+
     def __init__(self, random_fct, color='blue'):
         super(Circle, self).__init__('circle', color)
         scale = random_fct(0.0, 0.6)
@@ -148,10 +211,25 @@ class Circle(WorldObj):
         self.cx = random_fct(self.cx - max_left, self.cx + max_right)
         self.cy = random_fct(self.cy - max_down, self.cy + max_up)
 
+    def params(self):
+        return (self.cx, self.cy, self.radius)
+
+    @classmethod
+    def from_params(cls, color, params):
+        obj = cls.__new__(cls)
+        WorldObj.__init__(obj, 'circle', color)
+        obj.cx, obj.cy, obj.radius = params[:3]
+        return obj
+
+    def render_key(self):
+        return self.encode() + self.params()
+
     def render(self, img):
         fill_coords(img, point_in_circle(self.cx, self.cy, self.radius), COLORS[self.color])
 
 class Triangle(WorldObj):
+    __slots__ = ('scale', 'a', 'b', 'c')
+
     def __init__(self, random_fct, color='blue'):
         super(Triangle, self).__init__('triangle', color)
         self.scale = random_fct(0.0, 0.6)
@@ -185,12 +263,30 @@ class Triangle(WorldObj):
         self.b = (b[0] + translate_x, b[1] + translate_y)
         self.c = (c[0] + translate_x, c[1] + translate_y)
 
+    def params(self):
+        return self.a + self.b + self.c
+
+    @classmethod
+    def from_params(cls, color, params):
+        obj = cls.__new__(cls)
+        WorldObj.__init__(obj, 'triangle', color)
+        obj.scale = None
+        obj.a = tuple(params[0:2])
+        obj.b = tuple(params[2:4])
+        obj.c = tuple(params[4:6])
+        return obj
+
+    def render_key(self):
+        return self.encode() + self.params()
+
     def render(self, img):
         tri_fn = point_in_triangle(self.a, self.b, self.c)
         tri_fn = rotate_fn(tri_fn, cx=0.5, cy=0.5, theta=0.5 * math.pi * 2)
         fill_coords(img, tri_fn, COLORS[self.color])
 
 class Square(WorldObj):
+    __slots__ = ('min_x', 'max_x', 'min_y', 'max_y')
+
     def __init__(self, random_fct, color='blue'):
         super(Square, self).__init__('square', color)
         self.max_x = random_fct(0.55, 0.88)
@@ -199,9 +295,69 @@ class Square(WorldObj):
         side_size = self.max_x - self.min_x
         self.max_y = self.min_y + side_size
 
+    def params(self):
+        return (self.min_x, self.max_x, self.min_y, self.max_y)
+
+    @classmethod
+    def from_params(cls, color, params):
+        obj = cls.__new__(cls)
+        WorldObj.__init__(obj, 'square', color)
+        obj.min_x, obj.max_x, obj.min_y, obj.max_y = params[:4]
+        return obj
+
+    def render_key(self):
+        return self.encode() + self.params()
+
     def render(self, img):
         fill_coords(img, point_in_rect(self.min_x, self.max_x, self.min_y, self.max_y), COLORS[self.color])
 
+# Maximum number of shape parameters of an object
+MAX_SHAPE_PARAMS = 6
+
+SHAPE_CLASSES = {
+    OBJECT_TO_IDX['circle']: Circle,
+    OBJECT_TO_IDX['triangle']: Triangle,
+    OBJECT_TO_IDX['square']: Square
+}
+
+# Images of empty grids, indexed by grid width, height and tile size
+_background_cache = {}
+
+def render_symbolic_frames(grids, params, tile_size=32):
+    """
+    Render a batch of symbolic frames (see DelayedMatchingEnv.gen_symbolic_frame),
+    given as grids of shape (nb_frames, width, height, 3) and shape parameters
+    of shape (nb_frames, max_frame_objs, MAX_SHAPE_PARAMS), into images of
+    shape (nb_frames, height * tile_size, width * tile_size, 3). The empty
+    grid is broadcast to all the frames, then the tile of each object is
+    pasted over it. Tiles come from the tile cache of Grid.render_tile, so
+    that an object seen in several frames is only drawn once.
+    """
+    grids = np.asarray(grids)
+    nb_frames, width, height, _ = grids.shape
+    ts = tile_size
+
+    key = (width, height, ts)
+    if key not in _background_cache:
+        _background_cache[key] = Grid(width, height).render(ts)
+
+    imgs = np.empty((nb_frames, height * ts, width * ts, 3), dtype=np.uint8)
+    imgs[:] = _background_cache[key]
+
+    # Cells of the objects, with the rank of each object in its frame
+    cells = np.argwhere(grids[:, :, :, 0] != OBJECT_TO_IDX['empty'])
+    if len(cells) == 0:
+        return imgs
+    frame_starts = np.searchsorted(cells[:, 0], cells[:, 0])
+    ranks = np.arange(len(cells)) - frame_starts
+
+    for (f, i, j), k in zip(cells.tolist(), ranks.tolist()):
+        type_idx, color_idx, _ = grids[f, i, j]
+        obj = SHAPE_CLASSES[type_idx].from_params(IDX_TO_COLOR[color_idx], params[f, k].tolist())
+        imgs[f, j*ts:(j+1)*ts, i*ts:(i+1)*ts] = Grid.render_tile(obj, tile_size=ts)
+
+    return imgs
+
 class DelayedMatchingS17Random(DelayedMatchingEnv):
     def __init__(self, seed=None):
         super().__init__(seed=seed, size=17)
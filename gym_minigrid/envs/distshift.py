@@ -6,6 +6,8 @@ class DistShiftEnv(MiniGridEnv):
     Distributional shift environment.
     """
 
+    mission_templates = ("get to the green goal square",)
+
     def __init__(
         self,
         width=9,
@@ -6,6 +6,8 @@ class DoorKeyEnv(MiniGridEnv):
     Environment with a door and key, sparse reward
     """
 
+    mission_templates = ("use the key to open the door and then get to the goal",)
+
     def __init__(self, size=8):
         super().__init__(
             grid_size=size,
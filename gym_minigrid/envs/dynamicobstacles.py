@@ -7,6 +7,10 @@ class DynamicObstaclesEnv(MiniGridEnv):
     Single-room square grid environment with moving obstacles
     """
 
+    mission_templates = ("get to the green goal square",)
+
+    state_attrs = ('obstacles',)
+
     def __init__(
             self,
             size=8,
@@ -6,6 +6,8 @@ class EmptyEnv(MiniGridEnv):
     Empty grid environment, no obstacles, sparse reward
     """
 
+    mission_templates = ("get to the green goal square",)
+
     def __init__(
         self,
         size=8,
@@ -7,6 +7,16 @@ class FetchEnv(MiniGridEnv):
     named using English text strings
     """
 
+    mission_templates = (
+        "get a %s %s",
+        "go get a %s %s",
+        "fetch a %s %s",
+        "go fetch a %s %s",
+        "you must fetch a %s %s",
+    )
+
+    state_attrs = ('targetType', 'targetColor')
+
     def __init__(
         self,
         size=8,
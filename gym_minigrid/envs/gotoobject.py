@@ -7,6 +7,10 @@ class GoToObjectEnv(MiniGridEnv):
     named using an English text string
     """
 
+    mission_templates = ("go to the %s %s",)
+
+    state_attrs = ('target_pos', 'target_color')
+
     def __init__(
         self,
         size=6,
@@ -7,6 +7,10 @@ class KeyCorridor(RoomGrid):
     random room.
     """
 
+    mission_templates = ("pick up the %s %s",)
+
+    state_attrs = RoomGrid.state_attrs + ('obj',)
+
     def __init__(
         self,
         num_rows=3,
@@ -14,6 +14,10 @@ class Room:
         self.color = None
         self.locked = False
 
+    def __deepcopy__(self, memo):
+        # Rooms only hold immutable values
+        return copy(self)
+
     def rand_pos(self, env):
         topX, topY = self.top
         sizeX, sizeY = self.size
@@ -28,6 +32,10 @@ class LockedRoom(MiniGridEnv):
     named using an English text string
     """
 
+    mission_templates = ("get the %s key from the %s room, unlock the %s door and go to the goal",)
+
+    state_attrs = ('rooms',)
+
     def __init__(
         self,
         size=19
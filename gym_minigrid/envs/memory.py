@@ -11,6 +11,10 @@ class MemoryEnv(MiniGridEnv):
     object at split.
     """
 
+    mission_templates = ("go to the matching object at the end of the hallway",)
+
+    state_attrs = ('success_pos', 'failure_pos')
+
     def __init__(
         self,
         seed,
@@ -13,11 +13,19 @@ class Room:
         self.entryDoorPos = entryDoorPos
         self.exitDoorPos = exitDoorPos
 
+    def __deepcopy__(self, memo):
+        # Rooms only hold immutable values
+        return copy(self)
+
 class MultiRoomEnv(MiniGridEnv):
     """
     Environment with multiple rooms (subgoals)
     """
 
+    mission_templates = ("traverse the rooms to get to the goal",)
+
+    state_attrs = ('rooms', 'goal_pos')
+
     def __init__(self,
         minNumRooms,
         maxNumRooms,
@@ -8,6 +8,10 @@ class ObstructedMazeEnv(RoomGrid):
     doors may be obstructed by a ball and keys may be hidden in boxes.
     """
 
+    mission_templates = ("pick up the %s ball",)
+
+    state_attrs = RoomGrid.state_attrs + ('obj',)
+
     def __init__(self,
         num_rows,
         num_cols,
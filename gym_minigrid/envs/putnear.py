@@ -7,6 +7,10 @@ class PutNearEnv(MiniGridEnv):
     another object through a natural language string.
     """
 
+    mission_templates = ("put the %s %s near the %s %s",)
+
+    state_attrs = ('move_type', 'moveColor', 'move_pos', 'target_pos', 'target_color')
+
     def __init__(
         self,
         size=6,
@@ -8,6 +8,10 @@ class RedBlueDoorEnv(MiniGridEnv):
     obtain a reward.
     """
 
+    mission_templates = ("open the red door then the blue door",)
+
+    state_attrs = ('red_door', 'blue_door')
+
     def __init__(self, size=8):
         self.size = size
 
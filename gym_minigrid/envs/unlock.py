@@ -7,6 +7,10 @@ class Unlock(RoomGrid):
     Unlock a door
     """
 
+    mission_templates = ("open the door",)
+
+    state_attrs = RoomGrid.state_attrs + ('door',)
+
     def __init__(self, seed=None):
         room_size = 6
         super().__init__(
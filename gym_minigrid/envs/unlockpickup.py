@@ -7,6 +7,10 @@ class UnlockPickup(RoomGrid):
     Unlock a door, then pick up a box in another room
     """
 
+    mission_templates = ("pick up the %s %s",)
+
+    state_attrs = RoomGrid.state_attrs + ('obj',)
+
     def __init__(self, seed=None):
         room_size = 6
         super().__init__(
@@ -0,0 +1,293 @@
+import os
+import json
+import pickle
+import multiprocessing as mp
+from collections import Counter
+import gym
+import numpy as np
+from .minigrid import *
+
+# Version of the files written by LevelBank.save
+LEVEL_BANK_FORMAT = 1
+
+def _pack_rng_state(state):
+    """
+    Pack the state of a PCG64 bit generator into 6 uint64 values
+    """
+
+    assert state['bit_generator'] == 'PCG64', 'only PCG64 states can be stored'
+    mask = (1 << 64) - 1
+    s = state['state']['state']
+    inc = state['state']['inc']
+    return (s & mask, s >> 64, inc & mask, inc >> 64, state['has_uint32'], state['uinteger'])
+
+def _unpack_rng_state(packed):
+    s_lo, s_hi, inc_lo, inc_hi, has_uint32, uinteger = (int(v) for v in packed)
+    return {
+        'bit_generator': 'PCG64',
+        'state': {'state': s_lo | (s_hi << 64), 'inc': inc_lo | (inc_hi << 64)},
+        'has_uint32': has_uint32,
+        'uinteger': uinteger
+    }
+
+def generate_chunk(env_id, seeds):
+    """
+    Generate the levels of an environment for the given seeds, as the first
+    episode after seeding the environment with each seed. Returns a
+    LevelBank of the levels, and a Counter of the names of the exceptions
+    raised by the seeds which failed to generate.
+    """
+
+    env = gym.make(env_id).unwrapped
+    env.level_bank = None
+
+    states = []
+    done_seeds = []
+    failures = Counter()
+    for seed in seeds:
+        seed = int(seed)
+        env.seed(seed)
+        try:
+            env.reset()
+        except Exception as e:
+            failures[type(e).__name__] += 1
+            continue
+        states.append(env.get_state())
+        done_seeds.append(seed)
+    env.close()
+
+    return LevelBank.from_states(env_id, done_seeds, states), failures
+
+def _generate_chunk(args):
+    return generate_chunk(*args)
+
+class LevelBank:
+    """
+    Bank of pre-generated levels of an environment, from which reset() can
+    load episodes instead of generating them (see MiniGridEnv.level_bank).
+    Level i is the first episode of the environment seeded with seeds[i],
+    and loading it restores the RNG state as well, so that episodes are
+    the same as with live generation.
+
+    Levels are stored as arrays: encoded grids, agent positions and
+    directions, mission indices and RNG states, along with the pickled
+    objects and state_attrs which can't be decoded from the grids. Banks
+    are saved as a directory of .npy files, which load() maps into memory.
+    """
+
+    def __init__(
+        self,
+        env_id,
+        seeds,
+        grids,
+        agents,
+        missions,
+        mission_idx,
+        rng_states,
+        extras,
+        extras_offsets
+    ):
+        self.env_id = env_id
+        self.seeds = seeds
+        self.grids = grids
+        self.agents = agents
+        self.missions = missions
+        self.mission_idx = mission_idx
+        self.rng_states = rng_states
+        self.extras = extras
+        self.extras_offsets = extras_offsets
+
+        # Seeds are usually contiguous, in which case indexing by seed
+        # doesn't need a search
+        self._contiguous = bool(np.all(np.diff(seeds) == 1))
+        self._seed_order = None if self._contiguous else np.argsort(seeds, kind='stable')
+
+    @classmethod
+    def from_states(cls, env_id, seeds, states):
+        """
+        Create a bank from snapshots of environments (see
+        MiniGridEnv.get_state), taken at the start of their episodes
+        """
+
+        missions = sorted(set(state.mission for state in states))
+        mission_to_idx = {mission: i for i, mission in enumerate(missions)}
+
+        pickles = [
+            pickle.dumps((state.objects, state.carrying, state.extras), pickle.HIGHEST_PROTOCOL)
+            for state in states
+        ]
+        extras_offsets = np.zeros(len(states) + 1, dtype=np.int64)
+        extras_offsets[1:] = np.cumsum([len(p) for p in pickles])
+
+        if len(states) > 0:
+            grids = np.stack([state.grid for state in states])
+        else:
+            grids = np.zeros((0, 0, 0, 3), dtype='uint8')
+
+        return cls(
+            env_id,
+            np.array(seeds, dtype=np.int64),
+            grids,
+            np.array([
+                (state.agent_pos[0], state.agent_pos[1], state.agent_dir)
+                for state in states
+            ], dtype=np.int64).reshape(-1, 3),
+            missions,
+            np.array([mission_to_idx[state.mission] for state in states], dtype=np.int32),
+            np.array([
+                _pack_rng_state(state.rng_state) for state in states
+            ], dtype=np.uint64).reshape(-1, 6),
+            np.frombuffer(b''.join(pickles), dtype='uint8'),
+            extras_offsets
+        )
+
+    @classmethod
+    def concatenate(cls, banks):
+        """
+        Concatenate banks of levels of the same environment
+        """
+
+        banks = [bank for bank in banks if len(bank) > 0]
+        assert len(banks) > 0
+        env_id = banks[0].env_id
+        assert all(bank.env_id == env_id for bank in banks)
+
+        missions = sorted(set(m for bank in banks for m in bank.missions))
+        mission_to_idx = {mission: i for i, mission in enumerate(missions)}
+
+        offsets = [0]
+        for bank in banks:
+            offsets.append(offsets[-1] + bank.extras_offsets[-1])
+        extras_offsets = np.concatenate([[0]] + [
+            bank.extras_offsets[1:] + offset for bank, offset in zip(banks, offsets)
+        ])
+
+        return cls(
+            env_id,
+            np.concatenate([bank.seeds for bank in banks]),
+            np.concatenate([bank.grids for bank in banks]),
+            np.concatenate([bank.agents for bank in banks]),
+            missions,
+            np.concatenate([
+                np.array([mission_to_idx[m] for m in bank.missions], dtype=np.int32)[bank.mission_idx]
+                for bank in banks
+            ]),
+            np.concatenate([bank.rng_states for bank in banks]),
+            np.concatenate([bank.extras for bank in banks]),
+            extras_offsets
+        )
+
+    @classmethod
+    def generate(cls, env_id, seeds, num_workers=None, chunk_size=1000):
+        """
+        Generate the levels of an environment for the given seeds, in
+        parallel over num_workers processes (all CPUs by default). Seeds
+        which fail to generate are left out.
+        """
+
+        seeds = np.asarray(seeds, dtype=np.int64)
+        chunks = [
+            (env_id, seeds[i:i+chunk_size])
+            for i in range(0, len(seeds), chunk_size)
+        ]
+
+        if num_workers == 1:
+            results = map(_generate_chunk, chunks)
+            banks = [bank for bank, _ in results]
+        else:
+            with mp.Pool(num_workers) as pool:
+                banks = [bank for bank, _ in pool.imap(_generate_chunk, chunks)]
+
+        return cls.concatenate(banks)
+
+    def save(self, path):
+        """
+        Save the bank into a directory
+        """
+
+        os.makedirs(path, exist_ok=True)
+        for name in ['seeds', 'grids', 'agents', 'mission_idx', 'rng_states', 'extras', 'extras_offsets']:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+        meta = {
+            'format': LEVEL_BANK_FORMAT,
+            'env_id': self.env_id,
+            'num_levels': len(self),
+            'missions': self.missions
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a bank saved by save(), mapping its arrays into memory unless
+        mmap is False
+        """
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        assert meta['format'] == LEVEL_BANK_FORMAT, 'unsupported level bank format'
+
+        mmap_mode = 'r' if mmap else None
+        arrays = {
+            name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+            for name in ['seeds', 'grids', 'agents', 'mission_idx', 'rng_states', 'extras', 'extras_offsets']
+        }
+
+        return cls(meta['env_id'], missions=meta['missions'], **arrays)
+
+    def __len__(self):
+        return len(self.seeds)
+
+    def __getitem__(self, i):
+        """
+        Get level i, as a snapshot which MiniGridEnv.set_state restores
+        """
+
+        start, end = self.extras_offsets[i], self.extras_offsets[i + 1]
+        objects, carrying, extras = pickle.loads(self.extras[start:end].tobytes())
+        x, y, agent_dir = self.agents[i].tolist()
+
+        return MiniGridState(
+            grid=self.grids[i],
+            objects=objects,
+            agent_pos=np.array((x, y)),
+            agent_dir=agent_dir,
+            carrying=carrying,
+            step_count=0,
+            mission=self.missions[self.mission_idx[i]],
+            rng_state=_unpack_rng_state(self.rng_states[i]),
+            extras=extras
+        )
+
+    def index(self, seed):
+        """
+        Get the index of the level generated from a seed
+        """
+
+        if self._contiguous:
+            i = seed - int(self.seeds[0]) if len(self.seeds) > 0 else -1
+            if 0 <= i < len(self.seeds):
+                return i
+        else:
+            sorted_seeds = self.seeds[self._seed_order]
+            j = int(np.searchsorted(sorted_seeds, seed))
+            if j < len(self.seeds) and sorted_seeds[j] == seed:
+                return int(self._seed_order[j])
+
+        raise KeyError('no level for seed %d' % seed)
+
+    def level(self, seed):
+        """
+        Get the level generated from a seed
+        """
+
+        return self[self.index(seed)]
+
+    def sample(self, np_random):
+        """
+        Sample a level with a random number generator
+        """
+
+        return self[np_random.randint(0, len(self))]
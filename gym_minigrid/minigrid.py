@@ -1,11 +1,17 @@
+import os
+import re
 import math
 import hashlib
+from collections import OrderedDict, namedtuple
+from itertools import chain
+from copy import copy, deepcopy
 import gym
 from enum import IntEnum
 import numpy as np
 from gym import error, spaces, utils
 from gym.utils import seeding
 from .rendering import *
+from .register import env_list
 
 # Size in pixels of a tile in the full-scale human view
 TILE_PIXELS = 32
@@ -61,6 +67,22 @@ STATE_TO_IDX = {
     'locked': 2,
 }
 
+# Encoding of an empty cell, as produced by Grid.encode
+EMPTY_CODE = (OBJECT_TO_IDX['empty'], 0, 0)
+
+# Encoding of the grey walls surrounding partially observable views
+WALL_CODE = (OBJECT_TO_IDX['wall'], COLOR_TO_IDX['grey'], 0)
+
+def encode_cells(cells):
+    """
+    Encode a list of cells (objects or None) into a read-only array of
+    shape (len(cells), 3), going through bytes which numpy converts much
+    faster than a list of tuples
+    """
+
+    codes = chain.from_iterable(EMPTY_CODE if v is None else v.encode() for v in cells)
+    return np.frombuffer(bytes(codes), dtype='uint8').reshape(-1, 3)
+
 # Map of agent direction indices to vectors
 DIR_TO_VEC = [
     # Pointing right (positive X)
@@ -73,11 +95,42 @@ DIR_TO_VEC = [
     np.array((0, -1)),
 ]
 
+# Same, as tuples of ints
+DIR_TO_TUPLE = [tuple(int(x) for x in vec) for vec in DIR_TO_VEC]
+
+# Instances shared by all grids, see WorldObj.shared()
+_shared_objs = {}
+
+def _shared_obj(cls, *args):
+    return cls.shared(*args)
+
+_slot_names_cache = {}
+
+def _slot_names(cls):
+    """Names of the slots of a class and of its bases"""
+
+    names = _slot_names_cache.get(cls)
+    if names is None:
+        names = tuple(
+            name for c in cls.__mro__ for name in c.__dict__.get('__slots__', ())
+        )
+        _slot_names_cache[cls] = names
+    return names
+
 class WorldObj:
     """
     Base class for grid world objects
+
+    The type and color of an object are fixed at construction, and its
+    encoding is computed once then, and again only when its state changes.
     """
 
+    __slots__ = ('type', 'color', 'contains', 'init_pos', 'cur_pos', '_code', '_shared_args')
+
+    # Whether instances are never modified once placed in a grid, so that a
+    # single instance can be shared by many cells (see shared())
+    flyweight = False
+
     def __init__(self, type, color):
         assert type in OBJECT_TO_IDX, type
         assert color in COLOR_TO_IDX, color
@@ -91,6 +144,50 @@ class WorldObj:
         # Current position of the object
         self.cur_pos = None
 
+        self._code = (OBJECT_TO_IDX[type], COLOR_TO_IDX[color], 0)
+        self._shared_args = None
+
+    @classmethod
+    def shared(cls, *args):
+        """
+        Get the instance of a flyweight class built from the given arguments
+        which is shared by all grids. Shared objects don't track positions.
+        """
+
+        assert cls.flyweight, cls
+        key = (cls,) + args
+        obj = _shared_objs.get(key)
+        if obj is None:
+            obj = cls(*args)
+            obj._shared_args = args
+            _shared_objs[key] = obj
+        return obj
+
+    @property
+    def is_shared(self):
+        return self._shared_args is not None
+
+    def __reduce_ex__(self, protocol):
+        # Shared objects stay shared through copies and pickling
+        if self._shared_args is not None:
+            return (_shared_obj, (type(self),) + self._shared_args)
+        return super().__reduce_ex__(protocol)
+
+    def __deepcopy__(self, memo):
+        if self._shared_args is not None:
+            return self
+
+        # Attributes other than the contents are immutable values
+        cls = type(self)
+        obj = cls.__new__(cls)
+        memo[id(self)] = obj
+        for name in _slot_names(cls):
+            setattr(obj, name, getattr(self, name))
+        if hasattr(self, '__dict__'):
+            obj.__dict__.update(deepcopy(self.__dict__, memo))
+        obj.contains = deepcopy(self.contains, memo)
+        return obj
+
     def can_overlap(self):
         """Can the agent overlap with this?"""
         return False
@@ -113,7 +210,11 @@ class WorldObj:
 
     def encode(self):
         """Encode the a description of this object as a 3-tuple of integers"""
-        return (OBJECT_TO_IDX[self.type], COLOR_TO_IDX[self.color], 0)
+        return self._code
+
+    def render_key(self):
+        """Tuple identifying how this object is drawn, used to cache tiles"""
+        return self.encode()
 
     @staticmethod
     def decode(type_idx, color_idx, state):
@@ -130,7 +231,7 @@ class WorldObj:
         is_locked = state == 2
 
         if obj_type == 'wall':
-            v = Wall(color)
+            v = Wall.shared(color)
         elif obj_type == 'floor':
             v = Floor(color)
         elif obj_type == 'ball':
@@ -142,9 +243,9 @@ class WorldObj:
         elif obj_type == 'door':
             v = Door(color, is_open, is_locked)
         elif obj_type == 'goal':
-            v = Goal()
+            v = Goal.shared()
         elif obj_type == 'lava':
-            v = Lava()
+            v = Lava.shared()
         else:
             assert False, "unknown object type in decode '%s'" % obj_type
 
@@ -155,6 +256,10 @@ class WorldObj:
         raise NotImplementedError
 
 class Goal(WorldObj):
+    __slots__ = ()
+
+    flyweight = True
+
     def __init__(self):
         super().__init__('goal', 'green')
 
@@ -169,6 +274,8 @@ class Floor(WorldObj):
     Colored floor tile the agent can walk over
     """
 
+    __slots__ = ()
+
     def __init__(self, color='blue'):
         super().__init__('floor', color)
 
@@ -181,6 +288,10 @@ class Floor(WorldObj):
         fill_coords(img, point_in_rect(0.031, 1, 0.031, 1), color)
 
 class Lava(WorldObj):
+    __slots__ = ()
+
+    flyweight = True
+
     def __init__(self):
         super().__init__('lava', 'red')
 
@@ -203,6 +314,10 @@ class Lava(WorldObj):
             fill_coords(img, point_in_line(0.7, yhi, 0.9, ylo, r=0.03), (0,0,0))
 
 class Wall(WorldObj):
+    __slots__ = ()
+
+    flyweight = True
+
     def __init__(self, color='grey'):
         super().__init__('wall', color)
 
@@ -213,10 +328,42 @@ class Wall(WorldObj):
         fill_coords(img, point_in_rect(0, 1, 0, 1), COLORS[self.color])
 
 class Door(WorldObj):
+    __slots__ = ('_is_open', '_is_locked')
+
     def __init__(self, color, is_open=False, is_locked=False):
         super().__init__('door', color)
-        self.is_open = is_open
-        self.is_locked = is_locked
+        self._is_open = is_open
+        self._is_locked = is_locked
+        self._update_code()
+
+    @property
+    def is_open(self):
+        return self._is_open
+
+    @is_open.setter
+    def is_open(self, value):
+        self._is_open = value
+        self._update_code()
+
+    @property
+    def is_locked(self):
+        return self._is_locked
+
+    @is_locked.setter
+    def is_locked(self, value):
+        self._is_locked = value
+        self._update_code()
+
+    def _update_code(self):
+        # State, 0: open, 1: closed, 2: locked
+        if self._is_open:
+            state = 0
+        elif self._is_locked:
+            state = 2
+        else:
+            state = 1
+
+        self._code = self._code[:2] + (state,)
 
     def can_overlap(self):
         """The agent can only walk over this cell when the door is open"""
@@ -231,25 +378,14 @@ class Door(WorldObj):
             if isinstance(env.carrying, Key) and env.carrying.color == self.color:
                 self.is_locked = False
                 self.is_open = True
+                env.grid.refresh(*pos)
                 return True
             return False
 
         self.is_open = not self.is_open
+        env.grid.refresh(*pos)
         return True
 
-    def encode(self):
-        """Encode the a description of this object as a 3-tuple of integers"""
-
-        # State, 0: open, 1: closed, 2: locked
-        if self.is_open:
-            state = 0
-        elif self.is_locked:
-            state = 2
-        elif not self.is_open:
-            state = 1
-
-        return (OBJECT_TO_IDX[self.type], COLOR_TO_IDX[self.color], state)
-
     def render(self, img):
         c = COLORS[self.color]
 
@@ -275,6 +411,8 @@ class Door(WorldObj):
             fill_coords(img, point_in_circle(cx=0.75, cy=0.50, r=0.08), c)
 
 class Key(WorldObj):
+    __slots__ = ()
+
     def __init__(self, color='blue'):
         super(Key, self).__init__('key', color)
 
@@ -296,6 +434,8 @@ class Key(WorldObj):
         fill_coords(img, point_in_circle(cx=0.56, cy=0.28, r=0.064), (0,0,0))
 
 class Ball(WorldObj):
+    __slots__ = ()
+
     def __init__(self, color='blue'):
         super(Ball, self).__init__('ball', color)
 
@@ -306,6 +446,8 @@ class Ball(WorldObj):
         fill_coords(img, point_in_circle(0.5, 0.5, 0.31), COLORS[self.color])
 
 class Box(WorldObj):
+    __slots__ = ()
+
     def __init__(self, color, contains=None):
         super(Box, self).__init__('box', color)
         self.contains = contains
@@ -328,15 +470,309 @@ class Box(WorldObj):
         env.grid.set(*pos, self.contains)
         return True
 
+# Transparency of encoded cells, indexed by (type, state). Walls and closed
+# or locked doors block the agent's view, as per WorldObj.see_behind()
+TRANSPARENT = np.ones((256, 256), dtype=bool)
+TRANSPARENT[OBJECT_TO_IDX['wall'], :] = False
+TRANSPARENT[OBJECT_TO_IDX['door'], 1:] = False
+
+# Types of the objects which decoding an encoded cell doesn't give back, as
+# opposed to empty cells and flyweight objects (see MiniGridEnv.get_state)
+STATEFUL_TYPES = np.ones(256, dtype=bool)
+for obj_type in ['unseen', 'empty', 'wall', 'goal', 'lava']:
+    STATEFUL_TYPES[OBJECT_TO_IDX[obj_type]] = False
+
+_zobrist_keys_cache = {}
+
+def zobrist_keys(num_cells):
+    """
+    Get the random 64-bit keys used to hash grids of num_cells cells (see
+    Grid.zobrist_hash), as an array of shape (num_cells + 1, 100). Row k
+    holds the keys of the k-th cell in (i, j) order: columns 0 to 31 for
+    the type of the object in the cell, 32 to 63 for its color, 64 to 95
+    for its state, and 96 to 99 for the direction of an agent standing
+    there. The last row holds the keys of the object carried by the agent.
+    The keys are the same in every process.
+    """
+
+    keys = _zobrist_keys_cache.get(num_cells)
+    if keys is None:
+        rng = np.random.RandomState(0)
+        data = rng.bytes((num_cells + 1) * 100 * 8)
+        keys = np.frombuffer(data, dtype=np.uint64).reshape(num_cells + 1, 100)
+        _zobrist_keys_cache[num_cells] = keys
+    return keys
+
+def zobrist_code(keys, k, code):
+    """Hash of the encoding of the k-th cell, as a Python int"""
+    return keys.item(k, code[0]) ^ keys.item(k, 32 + code[1]) ^ keys.item(k, 64 + code[2])
+
+def zobrist_array(array):
+    """
+    Zobrist hash of a grid encoding, which is the XOR of the hashes of its
+    cells (see zobrist_code)
+    """
+
+    width, height, _ = array.shape
+    keys = zobrist_keys(width * height)
+    codes = array.reshape(-1, 3).astype(np.intp) + (0, 32, 64)
+    cells = np.arange(width * height)[:, None]
+    return int(np.bitwise_xor.reduce(keys[cells, codes].ravel()))
+
+_view_offsets_cache = {}
+
+def view_offsets(agent_view_size):
+    """
+    Get the offsets, relative to the agent position, of the world cells seen
+    in each cell of the agent's view. Returns two read-only (4, view, view)
+    arrays of x and y offsets indexed by agent direction and view coordinates.
+    """
+
+    if agent_view_size in _view_offsets_cache:
+        return _view_offsets_cache[agent_view_size]
+
+    sz = agent_view_size
+    vi, vj = np.meshgrid(np.arange(sz), np.arange(sz), indexing='ij')
+
+    dx = np.zeros((4, sz, sz), dtype=np.int64)
+    dy = np.zeros((4, sz, sz), dtype=np.int64)
+
+    for agent_dir in range(4):
+        fx, fy = DIR_TO_VEC[agent_dir]
+        rx, ry = -fy, fx
+        fwd = sz - 1 - vj
+        right = vi - sz // 2
+        dx[agent_dir] = fx * fwd + rx * right
+        dy[agent_dir] = fy * fwd + ry * right
+
+    dx.setflags(write=False)
+    dy.setflags(write=False)
+    _view_offsets_cache[agent_view_size] = (dx, dy)
+
+    return dx, dy
+
+def _fill_shifts(width):
+    shifts = []
+    shift = 1
+    while shift < width:
+        shifts.append(shift)
+        shift *= 2
+    return shifts
+
+def _vis_sweep(rows, width, agent_pos):
+    """
+    Visibility sweep over rows of cells packed as bit masks (bit i of a row
+    is cell i). Rows can be Python ints, or int64 arrays to process a batch
+    of grids at once. Returns the visible cells of each row.
+    """
+
+    full = (1 << width) - 1
+    not_first = full ^ 1
+    not_last = full ^ (1 << (width - 1))
+    shifts = _fill_shifts(width)
+
+    seeds = [0] * len(rows)
+    seeds[agent_pos[1]] = 1 << agent_pos[0]
+    mask = [0] * len(rows)
+
+    for j in reversed(range(len(rows))):
+        transparent = rows[j]
+
+        # Visibility flows to the right from visible transparent cells
+        gen = seeds[j]
+        pro = (transparent << 1) & full
+        for shift in shifts:
+            gen |= pro & (gen << shift)
+            pro &= pro << shift
+        right = gen
+
+        # And then to the left
+        pro = transparent >> 1
+        for shift in shifts:
+            gen |= pro & (gen >> shift)
+            pro &= pro >> shift
+        mask[j] = gen
+
+        # Visible transparent cells reveal the row above
+        if j > 0:
+            a = right & transparent & not_last
+            b = gen & transparent & not_first
+            seeds[j-1] |= (a | (a << 1) | b | (b >> 1))
+
+    return mask
+
+def _pack_rows(transparent):
+    # Rows are Python ints, so that maps can be of any width
+    bits = np.ascontiguousarray(np.packbits(transparent, axis=0, bitorder='little').T)
+    return [int.from_bytes(row.tobytes(), 'little') for row in bits]
+
+def _unpack_rows(rows, width):
+    num_bytes = (width + 7) // 8
+    data = b''.join(row.to_bytes(num_bytes, 'little') for row in rows)
+    bits = np.frombuffer(data, dtype='uint8').reshape(len(rows), num_bytes)
+    bits = np.unpackbits(bits, axis=1, bitorder='little')
+    return bits[:, :width].T.astype(bool)
+
+def compute_vis_mask(transparent, agent_pos):
+    """
+    Compute which cells are visible from agent_pos, given a boolean
+    (width, height) map of the cells the agent can see through. This
+    produces the same mask as Grid.process_vis. A batch of maps of shape
+    (N, width, height) is also accepted, in which case the width must be
+    less than 63.
+    """
+
+    width = transparent.shape[-2]
+
+    if transparent.ndim == 2:
+        rows = _pack_rows(transparent)
+        return _unpack_rows(_vis_sweep(rows, width, agent_pos), width)
+
+    # Pack the rows of each map into the bytes of 64-bit integers
+    assert width < 63
+    num, _, height = transparent.shape
+    packed = np.zeros((height, num, 8), dtype='uint8')
+    bits = np.packbits(transparent, axis=1, bitorder='little')
+    packed[:, :, :bits.shape[1]] = bits.transpose(2, 0, 1)
+    rows = packed.view('<i8')[:, :, 0]
+
+    mask = np.stack(_vis_sweep(list(rows), width, agent_pos), axis=-1)
+    bits = np.unpackbits(mask.astype('<i8').view('uint8'), axis=-1, bitorder='little')
+    return bits.reshape(num, height, 64)[:, :, :width].swapaxes(1, 2).view(bool)
+
+# Cache of visibility masks of agent views, keyed by the transparency
+# of the cells in view
+_view_vis_cache = {}
+
+# Cache of indices of agent views into padded grid arrays
+_view_index_cache = {}
+
+# Cache of indices of agent views into the cell lists of grids
+_view_cell_cache = {}
+
+_VIEW_CACHE_SIZE = 1 << 16
+
+def view_vis_mask(transparent):
+    """
+    Compute the visibility mask of a square agent view, with the agent at
+    the bottom-center of the view. Returns a read-only boolean mask, along
+    with a uint8 mask of shape (view, view, 3) which is 255 for visible
+    cells and 0 elsewhere.
+    """
+
+    key = transparent.tobytes()
+
+    masks = _view_vis_cache.get(key)
+    if masks is None:
+        sz = transparent.shape[0]
+        vis_mask = compute_vis_mask(transparent, (sz // 2, sz - 1))
+        keep = np.repeat(vis_mask[:, :, None], 3, axis=2).astype('uint8') * 255
+        masks = (vis_mask, keep)
+        for mask in masks:
+            mask.setflags(write=False)
+
+        if len(_view_vis_cache) >= _VIEW_CACHE_SIZE:
+            _view_vis_cache.clear()
+        _view_vis_cache[key] = masks
+
+    return masks
+
+_all_visible_cache = {}
+
+def _all_visible(agent_view_size):
+    if agent_view_size not in _all_visible_cache:
+        vis_mask = np.ones(shape=(agent_view_size, agent_view_size), dtype=bool)
+        vis_mask.setflags(write=False)
+        _all_visible_cache[agent_view_size] = vis_mask
+    return _all_visible_cache[agent_view_size]
+
+def view_indices(agent_view_size, padded_height, agent_dir, agent_idx):
+    """
+    Get the flat indices of the cells in the agent's view, and of their
+    encoding bytes, into a padded grid array (see Grid.padded_arrays).
+    agent_idx is the flat index of the agent cell into that array.
+    """
+
+    key = (agent_view_size, padded_height, agent_dir, agent_idx)
+
+    indices = _view_index_cache.get(key)
+    if indices is None:
+        dx, dy = view_offsets(agent_view_size)
+        cell_idx = dx[agent_dir] * padded_height + dy[agent_dir] + agent_idx
+        byte_idx = cell_idx[:, :, None] * 3 + np.arange(3)
+        indices = (cell_idx, byte_idx)
+
+        if len(_view_index_cache) >= _VIEW_CACHE_SIZE:
+            _view_index_cache.clear()
+        _view_index_cache[key] = indices
+
+    return indices
+
+def view_cell_indices(agent_view_size, width, height, agent_dir, agent_pos):
+    """
+    Get the indices of the cells in the agent's view into the cell list of
+    a grid (see Grid.grid), stored row by row as in that list, with -1 for
+    the cells outside of the grid. agent_pos is a tuple of ints.
+    """
+
+    key = (agent_view_size, width, height, agent_dir, agent_pos)
+
+    indices = _view_cell_cache.get(key)
+    if indices is None:
+        dx, dy = view_offsets(agent_view_size)
+        x = dx[agent_dir].T.ravel() + agent_pos[0]
+        y = dy[agent_dir].T.ravel() + agent_pos[1]
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        indices = np.where(inside, y * width + x, -1).tolist()
+
+        if len(_view_cell_cache) >= _VIEW_CACHE_SIZE:
+            _view_cell_cache.clear()
+        _view_cell_cache[key] = indices
+
+    return indices
+
+class _Unmaterialized:
+    """
+    Placeholder for a cell of an array-backed grid whose object has not
+    been decoded yet. It survives copies and pickling as a singleton.
+    """
+
+    def __repr__(self):
+        return '_UNMATERIALIZED'
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return '_UNMATERIALIZED'
+
+_UNMATERIALIZED = _Unmaterialized()
+
+# Contents of the cells of a grid built from an encoding, indexed by
+# whether the cell holds an object
+_LAZY_CELLS = np.array([None, _UNMATERIALIZED], dtype=object)
+
 class Grid:
     """
     Represent a grid and operations on it
+
+    By default, the grid stores one WorldObj (or None) per cell. An
+    array-backed grid additionally keeps the state of every cell in a single
+    (width, height, 3) uint8 array, with the same layout as Grid.encode().
+    Encoding is then a copy of that array and slicing/rotating are array
+    operations. Objects of array-backed grids built from an encoding are only
+    decoded when first accessed through get().
     """
 
-    # Static cache of pre-renderer tiles
-    tile_cache = {}
+    # Static cache of pre-rendered tiles of objects which are not in the
+    # tile atlas (see TileAtlas), holding at most tile_cache_size tiles
+    tile_cache = OrderedDict()
+    tile_cache_size = 4096
 
-    def __init__(self, width, height):
+    def __init__(self, width, height, array_backed=False):
         assert width >= 3
         assert height >= 3
 
@@ -345,15 +781,123 @@ class Grid:
 
         self.grid = [None] * width * height
 
+        # Encoded cell states, only for array-backed grids. The array can
+        # be a view into a larger array padded with walls (see padded_arrays)
+        self.array = None
+        self._padded = None
+        self._transparent = None
+        self._pad = 0
+        if array_backed:
+            self.array = np.empty((width, height, 3), dtype='uint8')
+            self.array[:, :] = EMPTY_CODE
+
+        # Sets of changed cells, one per renderer tracking changes
+        self._dirty_sets = []
+
+        # Zobrist hash of the grid, once computed (see zobrist_hash), and
+        # for grids which are not array-backed, the encoding of the cells
+        # it was last updated with
+        self._zobrist = None
+        self._zobrist_codes = None
+
+        # Map of the empty cells, once built (see free_cells)
+        self._free = None
+
+    @classmethod
+    def from_array(cls, array):
+        """
+        Create an array-backed grid from an encoding (see Grid.encode).
+        Objects are decoded lazily, when get() accesses their cell.
+        """
+
+        width, height, channels = array.shape
+        assert channels == 3
+
+        grid = cls(width, height)
+        grid.array = np.array(array, dtype='uint8')
+
+        lazy = grid.array[:, :, 0].T.ravel() > OBJECT_TO_IDX['empty']
+        grid.grid = _LAZY_CELLS[lazy.view(np.uint8)].tolist()
+
+        return grid
+
+    @property
+    def array_backed(self):
+        return self.array is not None
+
+    def make_array_backed(self):
+        """
+        Switch this grid to array-backed storage
+        """
+
+        if self.array is None:
+            self.array = self.encode()
+            self._zobrist_codes = None
+            self._padded = None
+            self._transparent = None
+            self._pad = 0
+
+    def padded_arrays(self, pad):
+        """
+        Get the encoding of an array-backed grid surrounded by at least
+        pad cells of grey walls on every side, the matching map of
+        transparent cells, and the actual padding size. Both arrays are
+        kept in sync with the grid.
+        """
+
+        if self._padded is None or self._pad < pad:
+            padded = np.empty(
+                (self.width + 2 * pad, self.height + 2 * pad, 3),
+                dtype='uint8'
+            )
+            padded[:, :] = WALL_CODE
+            padded[pad:pad+self.width, pad:pad+self.height] = self.array
+            self._padded = padded
+            self._transparent = TRANSPARENT[padded[:, :, 0], padded[:, :, 2]]
+            self._pad = pad
+            self.array = padded[pad:pad+self.width, pad:pad+self.height]
+
+        return self._padded, self._transparent, self._pad
+
+    def track_changes(self):
+        """
+        Get a set which receives the (i, j) coordinates of every cell
+        modified from now on, through set() or refresh()
+        """
+
+        dirty = set()
+        self._dirty_sets.append(dirty)
+        return dirty
+
+    def untrack_changes(self, dirty):
+        self._dirty_sets = [d for d in self._dirty_sets if d is not dirty]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+
+        # Copies are not tracked
+        state['_dirty_sets'] = []
+
+        # Copies hold their own unpadded array
+        if self._padded is not None:
+            state['array'] = self.array.copy()
+            state['_padded'] = None
+            state['_transparent'] = None
+            state['_pad'] = 0
+
+        return state
+
     def __contains__(self, key):
         if isinstance(key, WorldObj):
             for e in self.grid:
                 if e is key:
                     return True
         elif isinstance(key, tuple):
-            for e in self.grid:
+            for idx, e in enumerate(self.grid):
                 if e is None:
                     continue
+                if e is _UNMATERIALIZED:
+                    e = self.get(idx % self.width, idx // self.width)
                 if (e.color, e.type) == key:
                     return True
                 if key[0] is None and key[1] == e.type:
@@ -375,24 +919,97 @@ class Grid:
     def set(self, i, j, v):
         assert i >= 0 and i < self.width
         assert j >= 0 and j < self.height
+
+        if self._zobrist is not None:
+            # The object of the cell may have been modified in place, so
+            # its previous encoding is read from the stored one
+            codes = self.array if self.array is not None else self._zobrist_codes
+            old = codes[i, j].tolist()
+            new = EMPTY_CODE if v is None else v.encode()
+            keys = zobrist_keys(self.width * self.height)
+            k = i * self.height + j
+            self._zobrist ^= zobrist_code(keys, k, old) ^ zobrist_code(keys, k, new)
+            if self.array is None:
+                codes[i, j] = new
+
         self.grid[j * self.width + i] = v
 
+        if self._free is not None:
+            self._free[i, j] = v is None
+
+        for dirty in self._dirty_sets:
+            dirty.add((i, j))
+
+        if self.array is not None:
+            code = EMPTY_CODE if v is None else v.encode()
+            self.array[i, j] = code
+            if self._padded is not None:
+                pad = self._pad
+                self._transparent[i + pad, j + pad] = TRANSPARENT[code[0], code[2]]
+
     def get(self, i, j):
         assert i >= 0 and i < self.width
         assert j >= 0 and j < self.height
-        return self.grid[j * self.width + i]
+        v = self.grid[j * self.width + i]
+
+        if v is _UNMATERIALIZED:
+            v = WorldObj.decode(*self.array[i, j])
+            if not v.is_shared:
+                v.init_pos = (i, j)
+                v.cur_pos = (i, j)
+            self.grid[j * self.width + i] = v
+
+        return v
+
+    def refresh(self, i, j):
+        """
+        Update the stored state of a cell after its object was modified
+        in place (e.g. a door being opened)
+        """
+
+        self.set(i, j, self.get(i, j))
+
+    def zobrist_hash(self):
+        """
+        Get the 64-bit Zobrist hash of the contents of the grid, as an int.
+        The hash is computed by the first call, then kept up to date by
+        set() and refresh(), at a constant cost per change.
+        """
+
+        if self._zobrist is None:
+            array = self.encode()
+            self._zobrist = zobrist_array(array)
+            if self.array is None:
+                self._zobrist_codes = array
+        return self._zobrist
+
+    def free_cells(self):
+        """
+        Get the boolean map of the empty cells of the grid, of shape
+        (width, height). The map is built by the first call, then kept
+        up to date by set(), so that empty cells can be sampled directly
+        instead of by rejection (see MiniGridEnv.place_obj).
+        """
+
+        if self._free is None:
+            if self.array is not None:
+                self._free = self.array[:, :, 0] == OBJECT_TO_IDX['empty']
+            else:
+                free = np.array([v is None for v in self.grid], dtype=bool)
+                self._free = free.reshape(self.height, self.width).T.copy()
+        return self._free
 
     def horz_wall(self, x, y, length=None, obj_type=Wall):
         if length is None:
             length = self.width - x
         for i in range(0, length):
-            self.set(x + i, y, obj_type())
+            self.set(x + i, y, obj_type.shared() if obj_type.flyweight else obj_type())
 
     def vert_wall(self, x, y, length=None, obj_type=Wall):
         if length is None:
             length = self.height - y
         for j in range(0, length):
-            self.set(x, y + j, obj_type())
+            self.set(x, y + j, obj_type.shared() if obj_type.flyweight else obj_type())
 
     def wall_rect(self, x, y, w, h):
         self.horz_wall(x, y, w)
@@ -405,6 +1022,9 @@ class Grid:
         Rotate the grid to the left (counter-clockwise)
         """
 
+        if self.array is not None:
+            return Grid.from_array(np.rot90(self.array, k=-1))
+
         grid = Grid(self.height, self.width)
 
         for i in range(self.width):
@@ -419,6 +1039,9 @@ class Grid:
         Get a subset of the grid
         """
 
+        if self.array is not None:
+            return Grid.from_array(self.slice_array(topX, topY, width, height))
+
         grid = Grid(width, height)
 
         for j in range(0, height):
@@ -436,6 +1059,39 @@ class Grid:
 
         return grid
 
+    def view_cells(self, agent_pos, agent_dir, agent_view_size):
+        """
+        Get the objects in the agent's view of a grid which is not
+        array-backed, rotated so that the agent faces up, as a list of
+        cells stored row by row (see Grid.grid). Cells outside of the grid
+        are grey walls, as done by slice().
+        """
+
+        agent_pos = (int(agent_pos[0]), int(agent_pos[1]))
+        indices = view_cell_indices(agent_view_size, self.width, self.height, agent_dir, agent_pos)
+        cells = self.grid
+        wall = Wall.shared()
+        return [cells[k] if k >= 0 else wall for k in indices]
+
+    def slice_array(self, topX, topY, width, height):
+        """
+        Get the encoding of a subset of an array-backed grid. Cells outside
+        of the grid are encoded as grey walls, as done by slice().
+        """
+
+        out = np.empty((width, height, 3), dtype='uint8')
+        out[:, :] = WALL_CODE
+
+        x0 = max(topX, 0)
+        y0 = max(topY, 0)
+        x1 = min(topX + width, self.width)
+        y1 = min(topY + height, self.height)
+
+        if x0 < x1 and y0 < y1:
+            out[x0-topX:x1-topX, y0-topY:y1-topY] = self.array[x0:x1, y0:y1]
+
+        return out
+
     @classmethod
     def render_tile(
         cls,
@@ -449,12 +1105,39 @@ class Grid:
         Render a tile and cache the result
         """
 
+        # Tiles of standard objects come from the tile atlas
+        if subdivs == TileAtlas.subdivs and TileAtlas.covers(obj):
+            return TileAtlas.get(tile_size).tile(obj, agent_dir, highlight)
+
         # Hash map lookup key for the cache
-        key = (agent_dir, highlight, tile_size)
-        key = obj.encode() + key if obj else key
+        key = (agent_dir, highlight, tile_size, subdivs)
+        key = (type(obj),) + obj.render_key() + key if obj else key
+
+        img = cls.tile_cache.get(key)
+        if img is not None:
+            cls.tile_cache.move_to_end(key)
+            return img
 
-        if key in cls.tile_cache:
-            return cls.tile_cache[key]
+        img = cls.rasterize_tile(obj, agent_dir, highlight, tile_size, subdivs)
+
+        # Cache the rendered tile, evicting the least recently used ones
+        cls.tile_cache[key] = img
+        while len(cls.tile_cache) > cls.tile_cache_size:
+            cls.tile_cache.popitem(last=False)
+
+        return img
+
+    @staticmethod
+    def rasterize_tile(
+        obj,
+        agent_dir=None,
+        highlight=False,
+        tile_size=TILE_PIXELS,
+        subdivs=3
+    ):
+        """
+        Render a tile, without caching
+        """
 
         img = np.zeros(shape=(tile_size * subdivs, tile_size * subdivs, 3), dtype=np.uint8)
 
@@ -482,10 +1165,7 @@ class Grid:
             highlight_img(img)
 
         # Downsample the image to perform supersampling/anti-aliasing
-        img = downsample(img, subdivs)
-
-        # Cache the rendered tile
-        cls.tile_cache[key] = img
+        img = downsample(img, subdivs).astype(np.uint8)
 
         return img
 
@@ -502,33 +1182,34 @@ class Grid:
         :param tile_size: tile size in pixels
         """
 
-        if highlight_mask is None:
-            highlight_mask = np.zeros(shape=(self.width, self.height), dtype=np.bool)
-
-        # Compute the total grid size
-        width_px = self.width * tile_size
-        height_px = self.height * tile_size
-
-        img = np.zeros(shape=(height_px, width_px, 3), dtype=np.uint8)
-
-        # Render the grid
-        for j in range(0, self.height):
-            for i in range(0, self.width):
-                cell = self.get(i, j)
-
-                agent_here = np.array_equal(agent_pos, (i, j))
-                tile_img = Grid.render_tile(
-                    cell,
-                    agent_dir=agent_dir if agent_here else None,
-                    highlight=highlight_mask[i, j],
-                    tile_size=tile_size
-                )
+        atlas = TileAtlas.get(tile_size)
+
+        # Gather the tiles of the whole grid from the tile atlas
+        idx = atlas.indices(self.encode(), agent_pos, agent_dir, highlight_mask)
+        missing = idx < 0
+        img = atlas.compose(np.where(missing, 0, idx))
+
+        # Objects not in the atlas are rendered separately
+        covered = TileAtlas.cell_types
+        others = set(k for k, cell in enumerate(self.grid) if type(cell) not in covered)
+        others.update((j * self.width + i for i, j in np.argwhere(missing).tolist()))
+
+        for k in sorted(others):
+            i, j = k % self.width, k // self.width
+            cell = self.get(i, j)
+            agent_here = np.array_equal(agent_pos, (i, j))
+            tile_img = Grid.render_tile(
+                cell,
+                agent_dir=agent_dir if agent_here else None,
+                highlight=highlight_mask is not None and highlight_mask[i, j],
+                tile_size=tile_size
+            )
 
-                ymin = j * tile_size
-                ymax = (j+1) * tile_size
-                xmin = i * tile_size
-                xmax = (i+1) * tile_size
-                img[ymin:ymax, xmin:xmax, :] = tile_img
+            ymin = j * tile_size
+            ymax = (j+1) * tile_size
+            xmin = i * tile_size
+            xmax = (i+1) * tile_size
+            img[ymin:ymax, xmin:xmax, :] = tile_img
 
         return img
 
@@ -537,23 +1218,18 @@ class Grid:
         Produce a compact numpy encoding of the grid
         """
 
-        if vis_mask is None:
-            vis_mask = np.ones((self.width, self.height), dtype=bool)
+        if self.array is not None:
+            array = self.array.copy()
+            if vis_mask is not None:
+                array[~vis_mask] = 0
+            return array
 
-        array = np.zeros((self.width, self.height, 3), dtype='uint8')
+        # Cells are stored row by row, encode them all in one pass
+        array = encode_cells(self.grid).reshape(self.height, self.width, 3)
+        array = np.ascontiguousarray(array.swapaxes(0, 1))
 
-        for i in range(self.width):
-            for j in range(self.height):
-                if vis_mask[i, j]:
-                    v = self.get(i, j)
-
-                    if v is None:
-                        array[i, j, 0] = OBJECT_TO_IDX['empty']
-                        array[i, j, 1] = 0
-                        array[i, j, 2] = 0
-
-                    else:
-                        array[i, j, :] = v.encode()
+        if vis_mask is not None:
+            array[~vis_mask] = 0
 
         return array
 
@@ -579,43 +1255,441 @@ class Grid:
         return grid, vis_mask
 
     def process_vis(grid, agent_pos):
-        mask = np.zeros(shape=(grid.width, grid.height), dtype=np.bool)
+        # Cells are see-through as per the encodings of their objects
+        array = grid.array if grid.array is not None else grid.encode()
+        transparent = TRANSPARENT[array[:, :, 0], array[:, :, 2]]
 
-        mask[agent_pos[0], agent_pos[1]] = True
+        sz = grid.width
+        if grid.height == sz and tuple(agent_pos) == (sz // 2, sz - 1):
+            mask = np.array(view_vis_mask(transparent)[0])
+        else:
+            mask = compute_vis_mask(transparent, agent_pos)
 
-        for j in reversed(range(0, grid.height)):
-            for i in range(0, grid.width-1):
-                if not mask[i, j]:
-                    continue
+        for i, j in np.argwhere(~mask).tolist():
+            grid.set(i, j, None)
 
-                cell = grid.get(i, j)
-                if cell and not cell.see_behind():
-                    continue
+        return mask
 
-                mask[i+1, j] = True
-                if j > 0:
-                    mask[i+1, j-1] = True
-                    mask[i, j-1] = True
+def _tile_atlas_index(codes):
+    index = np.full(
+        (len(OBJECT_TO_IDX), len(COLOR_TO_IDX), len(STATE_TO_IDX), 5, 2),
+        -1,
+        dtype=np.int64
+    )
 
-            for i in reversed(range(1, grid.width)):
-                if not mask[i, j]:
-                    continue
+    for i, (type_idx, color_idx, state) in enumerate(codes):
+        tiles = np.arange(i * 10, (i + 1) * 10).reshape(5, 2)
 
-                cell = grid.get(i, j)
-                if cell and not cell.see_behind():
-                    continue
+        # Only doors are drawn differently depending on their state
+        if type_idx == OBJECT_TO_IDX['door']:
+            index[type_idx, color_idx, state] = tiles
+        else:
+            index[type_idx, color_idx] = tiles
 
-                mask[i-1, j] = True
-                if j > 0:
-                    mask[i-1, j-1] = True
-                    mask[i, j-1] = True
+    # Unseen cells are drawn as empty cells
+    index[OBJECT_TO_IDX['unseen']] = index[OBJECT_TO_IDX['empty']]
 
-        for j in range(0, grid.height):
-            for i in range(0, grid.width):
-                if not mask[i, j]:
-                    grid.set(i, j, None)
+    return index
 
-        return mask
+class TileAtlas:
+    """
+    Tiles of every encodable object (see WorldObj.decode),
+    for every agent direction and highlighting, stored for one tile size
+    in a single (num_tiles, tile_size, tile_size, 3) uint8 array. Tiles are
+    looked up by encoding, so that rendering a grid is a gather from the
+    atlas.
+
+    When TileAtlas.directory is set, atlases are saved there as .npy files
+    and memory-mapped by every process using them, so that tiles are only
+    rendered once. It defaults to the MINIGRID_TILE_ATLAS_DIR environment
+    variable.
+    """
+
+    directory = os.environ.get('MINIGRID_TILE_ATLAS_DIR')
+
+    # Supersampling used to render the tiles
+    subdivs = 3
+
+    # Classes of the objects rendered in the atlas
+    classes = (Wall, Floor, Door, Key, Ball, Box, Goal, Lava)
+
+    # Types of grid cells drawn from the atlas, including empty cells and
+    # cells of array-backed grids which are only decoded when accessed
+    cell_types = frozenset(classes + (type(None), _Unmaterialized))
+
+    # Loaded atlases, indexed by tile size
+    atlases = {}
+
+    # Version of the tile drawings, part of the atlas file names
+    version = 1
+
+    # Encodings of the tiles, the first one being an empty cell
+    codes = [EMPTY_CODE] + [
+        (OBJECT_TO_IDX[obj_type], color, state)
+        for obj_type in ['wall', 'floor', 'door', 'key', 'ball', 'box', 'goal', 'lava']
+        for color in range(len(COLOR_TO_IDX))
+        for state in (range(len(STATE_TO_IDX)) if obj_type == 'door' else [0])
+    ]
+
+    # Index of the tiles, by type, color, state, agent direction + 1
+    # (0 when the agent is not there) and highlighting
+    index = _tile_atlas_index(codes)
+
+    def __init__(self, tiles, rendered=None):
+        assert tiles.shape[0] == len(self.codes) * 10
+        self.tiles = tiles
+        self.tile_size = tiles.shape[1]
+
+        # Which tiles have been rendered, atlases are filled on demand
+        if rendered is None:
+            rendered = np.ones(tiles.shape[0], dtype=bool)
+        self.rendered = rendered
+
+    @classmethod
+    def empty(cls, tile_size):
+        """
+        Create an atlas for a given tile size, whose tiles are rendered
+        when first used
+        """
+
+        tiles = np.zeros((len(cls.codes) * 10, tile_size, tile_size, 3), dtype=np.uint8)
+        return cls(tiles, rendered=np.zeros(tiles.shape[0], dtype=bool))
+
+    @classmethod
+    def build(cls, tile_size):
+        """
+        Render a complete atlas for a given tile size
+        """
+
+        atlas = cls.empty(tile_size)
+        atlas.fill()
+        return atlas
+
+    def fill(self, indices=None):
+        """
+        Render the missing tiles among the given tile indices (all by default)
+        """
+
+        if indices is None:
+            indices = np.arange(self.tiles.shape[0])
+
+        for i in np.unique(indices[~self.rendered[indices]]):
+            obj = WorldObj.decode(*self.codes[i // 10])
+            agent_dir = (i % 10) // 2 - 1
+            self.tiles[i] = Grid.rasterize_tile(
+                obj,
+                agent_dir=None if agent_dir < 0 else agent_dir,
+                highlight=bool(i % 2),
+                tile_size=self.tile_size,
+                subdivs=self.subdivs
+            )
+            self.rendered[i] = True
+
+    @classmethod
+    def path(cls, tile_size, directory=None):
+        directory = directory or cls.directory
+        return os.path.join(directory, 'tiles_v%d_%d.npy' % (cls.version, tile_size))
+
+    def save(self, path):
+        self.fill()
+
+        # Write to a temporary file first, as other processes may be
+        # loading the atlas at the same time
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.asarray(self.tiles))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        tiles = np.load(path, mmap_mode='r' if mmap else None)
+        return cls(tiles)
+
+    @classmethod
+    def get(cls, tile_size):
+        """
+        Get the atlas for a given tile size. It is memory-mapped from
+        TileAtlas.directory when set, otherwise its tiles are rendered as
+        they get used.
+        """
+
+        atlas = cls.atlases.get(tile_size)
+
+        if atlas is None:
+            path = cls.path(tile_size) if cls.directory else None
+
+            if path and os.path.exists(path):
+                atlas = cls.load(path)
+            elif path:
+                atlas = cls.build(tile_size)
+                os.makedirs(cls.directory, exist_ok=True)
+                atlas.save(path)
+            else:
+                atlas = cls.empty(tile_size)
+
+            cls.atlases[tile_size] = atlas
+
+        return atlas
+
+    @classmethod
+    def prebuild(cls, tile_sizes, directory=None):
+        """
+        Render and save the atlases of several tile sizes, so that worker
+        processes can memory-map them
+        """
+
+        directory = directory or cls.directory
+        os.makedirs(directory, exist_ok=True)
+
+        for tile_size in tile_sizes:
+            atlas = cls.atlases.get(tile_size) or cls.empty(tile_size)
+            atlas.save(cls.path(tile_size, directory))
+
+    @classmethod
+    def covers(cls, obj):
+        """
+        Check whether an object (or None) has its tiles in the atlas
+        """
+
+        return obj is None or type(obj) in cls.classes
+
+    def indices(self, array, agent_pos=None, agent_dir=None, highlight_mask=None):
+        """
+        Get the indices of the tiles of a grid, given its encoding, as a
+        (width, height) array. Cells whose encoding is not in the atlas
+        get index -1.
+        """
+
+        dirs = np.zeros(array.shape[:2], dtype=np.int64)
+        if agent_pos is not None and agent_dir is not None:
+            i, j = agent_pos
+            if 0 <= i < array.shape[0] and 0 <= j < array.shape[1]:
+                dirs[i, j] = agent_dir + 1
+
+        highlight = 0 if highlight_mask is None else highlight_mask.astype(np.int64)
+
+        return self.index[array[:, :, 0], array[:, :, 1], array[:, :, 2], dirs, highlight]
+
+    def compose(self, idx, out=None):
+        """
+        Assemble the image of a grid from the indices of its tiles,
+        writing it into out if given. Cells without a tile in the atlas
+        (index -1) must be drawn separately, and given any valid index.
+        """
+
+        assert idx.min() >= 0, 'encoding without a tile in the atlas'
+        self.fill(idx.reshape(-1))
+
+        ts = self.tile_size
+        width, height = idx.shape
+
+        if out is None:
+            tiles = self.tiles[idx.T]
+            return tiles.transpose(0, 2, 1, 3, 4).reshape(height * ts, width * ts, 3)
+
+        # Gather the pixel rows of the tiles straight into the output
+        assert out.shape == (height * ts, width * ts, 3) and out.flags.c_contiguous
+        rows = self.tiles.reshape(-1, ts * 3)
+        row_idx = idx.T[:, None, :] * ts + np.arange(ts)[None, :, None]
+        np.take(rows, row_idx, axis=0, out=out.reshape(height, ts, width, ts * 3))
+        return out
+
+    def tile_index(self, code, agent_dir=None, highlight=False):
+        agent_dir = -1 if agent_dir is None else agent_dir
+        return self.index[code[0], code[1], code[2], agent_dir + 1, int(highlight)]
+
+    def tile(self, obj, agent_dir=None, highlight=False):
+        code = obj.encode() if obj else EMPTY_CODE
+        i = self.tile_index(code, agent_dir, highlight)
+        if not self.rendered[i]:
+            self.fill(np.array([i]))
+        return self.tiles[i]
+
+class GridRenderer:
+    """
+    Renderer which keeps the last frame of a grid at a given tile size,
+    and only redraws the tiles of the cells which changed since then.
+    Changed cells are those modified through Grid.set() or Grid.refresh(),
+    the cells the agent left or entered, and cells whose highlighting
+    changed. The grid is fully redrawn when a new grid is rendered.
+    """
+
+    def __init__(self, tile_size):
+        self.tile_size = tile_size
+        self.grid = None
+        self.dirty = None
+        self.img = None
+        self.agent = None
+        self.highlight_mask = None
+
+    def __reduce__(self):
+        # Copies start over with a full redraw
+        return (GridRenderer, (self.tile_size,))
+
+    def render(self, grid, agent_pos=None, agent_dir=None, highlight_mask=None):
+        """
+        Render a grid, returning the frame buffer of the renderer, which
+        is updated in place by the next calls
+        """
+
+        if agent_pos is not None:
+            agent_pos = (int(agent_pos[0]), int(agent_pos[1]))
+        agent = (agent_pos, agent_dir)
+
+        if highlight_mask is None:
+            highlight_mask = np.zeros(shape=(grid.width, grid.height), dtype=bool)
+
+        if grid is not self.grid:
+            if self.grid is not None:
+                self.grid.untrack_changes(self.dirty)
+            self.grid = grid
+            self.dirty = grid.track_changes()
+            cells = None
+        else:
+            cells = set(self.dirty)
+
+            if agent != self.agent:
+                cells.add(self.agent[0])
+                cells.add(agent_pos)
+
+            changed = np.argwhere(highlight_mask != self.highlight_mask)
+            cells.update(map(tuple, changed.tolist()))
+            cells.discard(None)
+
+        self.dirty.clear()
+        self.agent = agent
+        self.highlight_mask = np.array(highlight_mask, dtype=bool)
+
+        # Redraw the whole grid when many cells changed
+        if cells is None or len(cells) > grid.width * grid.height // 4:
+            self.img = grid.render(self.tile_size, agent_pos, agent_dir, self.highlight_mask)
+            return self.img
+
+        ts = self.tile_size
+        for i, j in cells:
+            tile_img = Grid.render_tile(
+                grid.get(i, j),
+                agent_dir=agent_dir if (i, j) == agent_pos else None,
+                highlight=self.highlight_mask[i, j],
+                tile_size=ts
+            )
+            self.img[j*ts:(j+1)*ts, i*ts:(i+1)*ts, :] = tile_img
+
+        return self.img
+
+class MissionVocabulary:
+    """
+    Closed vocabulary of the words of mission strings, used to encode
+    missions as fixed-length arrays of word indices. Index 0 is padding,
+    and index 1 stands for words outside of the vocabulary.
+
+    The vocabulary is built from mission templates (see
+    MiniGridEnv.mission_templates), in which each %s stands for a color
+    or an object type.
+    """
+
+    # Maximum number of encoded missions kept
+    cache_size = 4096
+
+    # Vocabulary of the registered environments, and the number of
+    # environments it was built from
+    _registered = (0, None)
+
+    def __init__(self, templates):
+        words = set()
+        self.max_len = 0
+        for template in templates:
+            template_words = re.findall(r'[a-z]+|%s', template.lower())
+            words.update(template_words)
+            self.max_len = max(self.max_len, len(template_words))
+
+        if '%s' in words:
+            words.remove('%s')
+            words.update(COLOR_NAMES)
+            words.update(OBJECT_TO_IDX)
+
+        self.words = ['<pad>', '<unk>'] + sorted(words)
+        self.index = {word: i for i, word in enumerate(self.words)}
+        self.cache = {}
+
+    @classmethod
+    def registered(cls):
+        """
+        Get the vocabulary of the missions of all registered environments
+        """
+
+        num_envs, vocab = cls._registered
+        if num_envs != len(env_list):
+            templates = []
+            for env_id in env_list:
+                entry_point = gym.envs.registry.spec(env_id).entry_point
+                env_type = gym.envs.registration.load(entry_point)
+                templates.extend(env_type.mission_templates)
+            vocab = cls(templates)
+            cls._registered = (len(env_list), vocab)
+
+        return vocab
+
+    def __len__(self):
+        return len(self.words)
+
+    def space(self):
+        """
+        Get the observation space of encoded missions
+        """
+
+        return spaces.Box(
+            low=0,
+            high=len(self.words) - 1,
+            shape=(self.max_len,),
+            dtype='int64'
+        )
+
+    def encode(self, mission):
+        """
+        Encode a mission string as a read-only array of max_len word
+        indices, ignoring case and punctuation
+        """
+
+        tokens = self.cache.get(mission)
+        if tokens is not None:
+            return tokens
+
+        words = re.findall(r'[a-z]+', mission.lower())
+        assert len(words) <= self.max_len, 'mission string too long ({} words)'.format(len(words))
+
+        tokens = np.zeros(self.max_len, dtype=np.int64)
+        tokens[:len(words)] = [self.index.get(word, 1) for word in words]
+        tokens.setflags(write=False)
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[mission] = tokens
+
+        return tokens
+
+    def decode(self, tokens):
+        """
+        Decode an array of word indices into a mission string, without
+        punctuation
+        """
+
+        return ' '.join(self.words[t] for t in tokens if t != 0)
+
+class MiniGridState(namedtuple('MiniGridState', [
+    'grid', 'objects', 'agent_pos', 'agent_dir', 'carrying',
+    'step_count', 'mission', 'rng_state', 'extras'
+])):
+    """
+    Snapshot of the state of an environment (see MiniGridEnv.get_state)
+
+    grid is the read-only encoding of the grid, and objects holds copies of
+    the objects of its cells which can't be decoded from that encoding, as
+    (flat cell index, object) pairs. extras holds copies of the values of
+    the state_attrs of the environment.
+    """
+
+    __slots__ = ()
 
 class MiniGridEnv(gym.Env):
     """
@@ -644,6 +1718,55 @@ class MiniGridEnv(gym.Env):
         # Done completing task
         done = 6
 
+    # Store the grid of each episode in array-backed form (see Grid), which
+    # lets observations be computed with array operations only. This can be
+    # overridden by subclasses, or set on an instance before calling reset().
+    # Objects modified in place must then be followed by grid.refresh(),
+    # which the built-in objects do, for the array to stay in sync. Both
+    # forms gather the cells in view without building sub-grids (see
+    # gen_obs_image), the array-backed one being about twice as fast.
+    array_backed = False
+
+    # Write observations into buffers owned by the environment, instead of
+    # allocating new arrays at every step. The observation returned by
+    # step() and reset(), and the frame returned by render(), are then
+    # overwritten by the next call, and must be copied to be kept. The agent
+    # position is kept as a tuple of ints in this mode.
+    reuse_obs_buffers = False
+
+    # Array into which the image observations of step() and reset() are
+    # written, if set. Being an attribute rather than an argument, it also
+    # applies to environments overriding step() or reset(), and to
+    # environments inside wrappers (set it on env.unwrapped).
+    obs_out = None
+
+    # Attributes, other than the grid and the agent, holding the state of an
+    # episode, which get_state() saves. Objects they refer to are copied
+    # along with the objects of the grid.
+    state_attrs = ()
+
+    # Version of the random stream from which episodes are generated.
+    # Version 1 places objects by rejection sampling, and reproduces the
+    # episodes published for a given seed. Version 2 samples positions
+    # directly among the valid cells (see place_obj), which is faster on
+    # crowded grids but consumes different random numbers, so that every
+    # seed generates a different episode. It can be set by subclasses, or
+    # on an instance before calling reset().
+    rng_version = 1
+
+    # Bank of pre-generated levels from which reset() loads episodes
+    # instead of generating them, if set (see LevelBank)
+    level_bank = None
+
+    # Templates of the mission strings of the environment, from which the
+    # vocabulary of missions is built (see MissionVocabulary)
+    mission_templates = ()
+
+    # Add the mission, encoded with the vocabulary of all registered
+    # environments, to observations as a 'mission_tokens' array. The
+    # mission is encoded once per episode, when the environment is reset.
+    tokenize_missions = False
+
     def __init__(
         self,
         grid_size=None,
@@ -689,6 +1812,12 @@ class MiniGridEnv(gym.Env):
         # Window to use for human rendering mode
         self.window = None
 
+        # Renderers of the full grid, indexed by tile size
+        self.grid_renderers = {}
+
+        # Buffers reused for observations (see reuse_obs_buffers)
+        self.obs_buffers = None
+
         # Environment configuration
         self.width = width
         self.height = height
@@ -699,6 +1828,9 @@ class MiniGridEnv(gym.Env):
         self.agent_pos = None
         self.agent_dir = None
 
+        # Item being carried by the agent
+        self.carrying = None
+
         # Initialize the RNG
         self.seed(seed=seed)
 
@@ -713,7 +1845,13 @@ class MiniGridEnv(gym.Env):
         # Generate a new random grid at the start of each episode
         # To keep the same grid for each episode, call env.seed() with
         # the same seed before calling env.reset()
-        self._gen_grid(self.width, self.height)
+        if self.level_bank is not None:
+            self.set_state(self.level_bank.sample(self.level_random), copy_objects=False)
+        else:
+            self._gen_grid(self.width, self.height)
+
+        if self.array_backed:
+            self.grid.make_array_backed()
 
         # These fields should be defined by _gen_grid
         assert self.agent_pos is not None
@@ -723,28 +1861,186 @@ class MiniGridEnv(gym.Env):
         start_cell = self.grid.get(*self.agent_pos)
         assert start_cell is None or start_cell.can_overlap()
 
+        if self.reuse_obs_buffers:
+            self.agent_pos = (int(self.agent_pos[0]), int(self.agent_pos[1]))
+
         # Item picked up, being carried, initially nothing
         self.carrying = None
 
         # Step count since episode start
         self.step_count = 0
 
+        if self.tokenize_missions:
+            self.encode_mission()
+
         # Return first observation
         obs = self.gen_obs()
         return obs
 
+    def encode_mission(self):
+        """
+        Encode the mission of the current episode (see tokenize_missions)
+        """
+
+        vocab = MissionVocabulary.registered()
+        self.mission_tokens = vocab.encode(self.mission)
+        if 'mission_tokens' not in self.observation_space.spaces:
+            self.observation_space.spaces['mission_tokens'] = vocab.space()
+
     def seed(self, seed=1337):
         # Seed the random number generator
-        self.np_random, _ = seeding.np_random(seed)
+        self.np_random, np_seed = seeding.np_random(seed)
+
+        # Levels are sampled from the level bank with a separate generator,
+        # as loading a level restores the state of np_random. Its seed is
+        # derived from the seed of np_random, without drawing from it.
+        level_seed = np.random.SeedSequence(np_seed).spawn(1)[0].generate_state(1)[0]
+        self.level_random, _ = seeding.np_random(int(level_seed))
         return [seed]
 
+    def get_state(self):
+        """
+        Take a snapshot of the state of the environment, which set_state()
+        restores. Snapshots are immutable, and much cheaper to take and
+        restore than copies of the environment.
+        """
+
+        grid = self.grid
+        array = grid.encode()
+        array.setflags(write=False)
+
+        # Objects which decoding the grid wouldn't give back. Flyweight
+        # objects are decoded as shared ones.
+        cells = np.flatnonzero(STATEFUL_TYPES[array[:, :, 0].T])
+        objects = tuple(
+            (k, grid.grid[k]) for k in cells.tolist()
+            if grid.grid[k] is not _UNMATERIALIZED
+        )
+        extras = tuple(getattr(self, name, None) for name in self.state_attrs)
+        objects, carrying, extras = deepcopy((objects, self.carrying, extras))
+
+        agent_pos = self.agent_pos
+        if isinstance(agent_pos, np.ndarray):
+            agent_pos = agent_pos.copy()
+            agent_pos.setflags(write=False)
+
+        return MiniGridState(
+            grid=array,
+            objects=objects,
+            agent_pos=agent_pos,
+            agent_dir=self.agent_dir,
+            carrying=carrying,
+            step_count=self.step_count,
+            mission=self.mission,
+            rng_state=self.np_random.bit_generator.state,
+            extras=extras
+        )
+
+    def set_state(self, state, copy_objects=True):
+        """
+        Restore a snapshot taken by get_state(). The objects of the snapshot
+        are copied, unless copy_objects is False, for snapshots which are
+        not used again (e.g. levels decoded by LevelBank).
+        """
+
+        grid = Grid.from_array(state.grid)
+        objects, carrying, extras = state.objects, state.carrying, state.extras
+        if copy_objects:
+            objects, carrying, extras = deepcopy((objects, carrying, extras))
+        for k, v in objects:
+            grid.grid[k] = v
+
+        # Keep the storage of the grid being replaced
+        if getattr(self, 'grid', None) is not None and not self.grid.array_backed:
+            for j in range(grid.height):
+                for i in range(grid.width):
+                    grid.get(i, j)
+            grid.array = None
+
+        agent_pos = state.agent_pos
+        if isinstance(agent_pos, np.ndarray):
+            agent_pos = agent_pos.copy()
+
+        self.grid = grid
+        self.agent_pos = agent_pos
+        self.agent_dir = state.agent_dir
+        self.carrying = carrying
+        self.step_count = state.step_count
+        self.mission = state.mission
+        self.np_random.bit_generator.state = state.rng_state
+        for name, value in zip(self.state_attrs, extras):
+            setattr(self, name, value)
+
+        if self.tokenize_missions:
+            self.encode_mission()
+
+    def clone(self, n):
+        """
+        Create n copies of the environment in its current state, e.g. to
+        expand all the actions from a node of a search tree. The copies
+        share their episode state, spaces and observation arrays with
+        neither this environment nor each other, but have no window to
+        render to.
+        """
+
+        state = self.get_state()
+
+        envs = []
+        for _ in range(n):
+            env = copy(self)
+            env.window = None
+            env.grid_renderers = {}
+            env.obs_buffers = None
+            env.observation_space = deepcopy(self.observation_space)
+            env.action_space = deepcopy(self.action_space)
+            if self.obs_out is not None:
+                env.obs_out = self.obs_out.copy()
+            env.np_random = type(self.np_random)(deepcopy(self.np_random.bit_generator))
+            env.level_random = type(self.level_random)(deepcopy(self.level_random.bit_generator))
+            env.set_state(state)
+            envs.append(env)
+
+        return envs
+
+    @property
+    def state_hash(self):
+        """
+        64-bit Zobrist hash of the grid, the agent and the object it carries,
+        as an int. It is maintained incrementally, so getting it has a
+        constant cost.
+        """
+
+        grid = self.grid
+        h = grid.zobrist_hash()
+        keys = zobrist_keys(grid.width * grid.height)
+
+        if self.agent_pos is not None:
+            k = int(self.agent_pos[0]) * grid.height + int(self.agent_pos[1])
+            h ^= keys.item(k, 96 + self.agent_dir)
+
+        if self.carrying is not None:
+            h ^= zobrist_code(keys, -1, self.carrying.encode())
+
+        return h
+
     def hash(self, size=16):
         """Compute a hash that uniquely identifies the current state of the environment.
+        This is the hexadecimal form of state_hash.
+        :param size: Size of the hashing
+        """
+        return ('%016x' % self.state_hash)[:size]
+
+    def sha256_hash(self, size=16):
+        """Compute a hash of the grid and the agent, from the SHA-256 of their
+        string representation (the former form of hash()).
         :param size: Size of the hashing
         """
         sample_hash = hashlib.sha256()
 
-        to_encode = [self.grid.encode(), self.agent_pos, self.agent_dir]
+        # Positions are arrays, as the agent's moves make them, even when
+        # the environment stores them as tuples (see reuse_obs_buffers)
+        agent_pos = None if self.agent_pos is None else np.array(self.agent_pos)
+        to_encode = [self.grid.encode(), agent_pos, self.agent_dir]
         for item in to_encode:
             sample_hash.update(str(item).encode('utf8'))
 
@@ -915,6 +2211,64 @@ class MiniGridEnv(gym.Env):
         if size is None:
             size = (self.grid.width, self.grid.height)
 
+        if self.rng_version >= 2:
+            pos = self._sample_free_pos(top, size, reject_fn, max_tries)
+        else:
+            pos = self._sample_pos_by_rejection(top, size, reject_fn, max_tries)
+
+        self.grid.set(*pos, obj)
+
+        if obj is not None:
+            obj.init_pos = pos
+            obj.cur_pos = pos
+
+        return pos
+
+    def _sample_free_pos(self, top, size, reject_fn, max_tries):
+        """
+        Sample a position uniformly among the empty cells of a rectangle
+        which are not under the agent. Cells rejected by reject_fn are
+        removed from the candidates, so that at most max_tries + 1 calls
+        are made. Candidates are ordered by position only, so that the
+        result only depends on the contents of the grid and the RNG state.
+        """
+
+        grid = self.grid
+        x0, y0 = top
+        x1 = min(x0 + size[0], grid.width)
+        y1 = min(y0 + size[1], grid.height)
+        xs, ys = np.nonzero(grid.free_cells()[x0:x1, y0:y1])
+        cells = (xs + x0) * grid.height + (ys + y0)
+
+        # Don't place the object where the agent is
+        if self.agent_pos is not None:
+            cells = cells[cells != self.agent_pos[0] * grid.height + self.agent_pos[1]]
+
+        num_cells = len(cells)
+        num_tries = 0
+
+        while True:
+            if num_cells == 0 or num_tries > max_tries:
+                raise RecursionError('no valid position found in place_obj')
+
+            num_tries += 1
+
+            idx = self._rand_int(0, num_cells)
+            pos = np.array(divmod(int(cells[idx]), grid.height))
+
+            # Check if there is a filtering criterion
+            if reject_fn and reject_fn(self, pos):
+                num_cells -= 1
+                cells[idx] = cells[num_cells]
+                continue
+
+            return pos
+
+    def _sample_pos_by_rejection(self, top, size, reject_fn, max_tries):
+        """
+        Sample a position as done by version 1 of the random stream
+        """
+
         num_tries = 0
 
         while True:
@@ -942,15 +2296,7 @@ class MiniGridEnv(gym.Env):
             if reject_fn and reject_fn(self, pos):
                 continue
 
-            break
-
-        self.grid.set(*pos, obj)
-
-        if obj is not None:
-            obj.init_pos = pos
-            obj.cur_pos = pos
-
-        return pos
+            return pos
 
     def put_obj(self, obj, i, j):
         """
@@ -1108,7 +2454,11 @@ class MiniGridEnv(gym.Env):
         done = False
 
         # Get the position in front of the agent
-        fwd_pos = self.front_pos
+        if self.reuse_obs_buffers:
+            dx, dy = DIR_TO_TUPLE[self.agent_dir]
+            fwd_pos = (self.agent_pos[0] + dx, self.agent_pos[1] + dy)
+        else:
+            fwd_pos = self.front_pos
 
         # Get the contents of the cell in front of the agent
         fwd_cell = self.grid.get(*fwd_pos)
@@ -1174,12 +2524,15 @@ class MiniGridEnv(gym.Env):
         cells the agent can actually see.
         """
 
-        topX, topY, botX, botY = self.get_view_exts()
+        if self.grid.array_backed:
+            image, vis_mask = self.gen_obs_image()
+            grid = Grid.from_array(image)
+            grid.set(grid.width // 2, grid.height - 1, self.carrying)
+            return grid, vis_mask
 
-        grid = self.grid.slice(topX, topY, self.agent_view_size, self.agent_view_size)
-
-        for i in range(self.agent_dir + 1):
-            grid = grid.rotate_left()
+        # Gather the cells in view, rotated so the agent faces up
+        grid = Grid(self.agent_view_size, self.agent_view_size)
+        grid.grid = self.grid.view_cells(self.agent_pos, self.agent_dir, self.agent_view_size)
 
         # Process occluders and visibility
         # Note that this incurs some performance cost
@@ -1199,18 +2552,77 @@ class MiniGridEnv(gym.Env):
 
         return grid, vis_mask
 
-    def gen_obs(self):
+    def gen_obs_image(self, out=None):
         """
-        Generate the agent's view (partially observable, low-resolution encoding)
+        Generate the encoding of the agent's view along with its visibility
+        mask, without building sub-grids. The cells in view are gathered
+        with precomputed view indices, directly from the grid array with an
+        array-backed grid, which is fastest, or from the objects of the grid
+        otherwise. The encoding is written into out if given.
         """
 
-        grid, vis_mask = self.gen_obs_grid()
+        sz = self.agent_view_size
+
+        view_transparent = None
+        if self.reuse_obs_buffers:
+            buffers = self.get_obs_buffers()
+            view_transparent = buffers['transparent']
+            if out is None:
+                out = buffers['image']
+
+        # Gather the cells in view, rotated so the agent faces up
+        if self.grid.array_backed:
+            padded, transparent, pad = self.grid.padded_arrays(sz - 1)
+            ax, ay = self.agent_pos
+            agent_idx = (int(ax) + pad) * padded.shape[1] + int(ay) + pad
+            cell_idx, byte_idx = view_indices(sz, padded.shape[1], self.agent_dir, agent_idx)
+            image = np.take(padded.reshape(-1), byte_idx, out=out)
+        else:
+            cells = self.grid.view_cells(self.agent_pos, self.agent_dir, sz)
+            image = encode_cells(cells).reshape(sz, sz, 3).swapaxes(0, 1)
+            if out is None:
+                image = np.ascontiguousarray(image)
+            else:
+                out[...] = image
+                image = out
+
+        # Process occluders and visibility
+        if not self.see_through_walls:
+            if self.grid.array_backed:
+                view_transparent = np.take(transparent.reshape(-1), cell_idx, out=view_transparent)
+            else:
+                view_transparent = TRANSPARENT[image[:, :, 0], image[:, :, 2]]
+            vis_mask, keep = view_vis_mask(view_transparent)
+            np.bitwise_and(image, keep, out=image)
+        else:
+            vis_mask = _all_visible(sz)
+
+        # Make it so the agent sees what it's carrying
+        image[sz // 2, sz - 1] = self.carrying.encode() if self.carrying else EMPTY_CODE
+
+        return image, vis_mask
 
-        # Encode the partially observable view into a numpy array
-        image = grid.encode(vis_mask)
+    def gen_obs(self, out=None):
+        """
+        Generate the agent's view (partially observable, low-resolution encoding).
+        The image is written into out if given, or into obs_out if set.
+        """
+
+        if out is None:
+            out = self.obs_out
+        image, _ = self.gen_obs_image(out=out)
 
         assert hasattr(self, 'mission'), "environments must define a textual mission string"
 
+        if self.reuse_obs_buffers:
+            obs = self.get_obs_buffers()['obs']
+            obs['image'] = image
+            obs['direction'] = self.agent_dir
+            obs['mission'] = self.mission
+            if self.tokenize_missions:
+                obs['mission_tokens'] = self.mission_tokens
+            return obs
+
         # Observations are dictionaries containing:
         # - an image (partially observable view of the environment)
         # - the agent's direction/orientation (acting as a compass)
@@ -1221,28 +2633,61 @@ class MiniGridEnv(gym.Env):
             'mission': self.mission
         }
 
+        if self.tokenize_missions:
+            obs['mission_tokens'] = self.mission_tokens
+
         return obs
 
-    def get_obs_render(self, obs, tile_size=TILE_PIXELS//2):
+    def get_obs_buffers(self):
+        """
+        Get the buffers reused for observations (see reuse_obs_buffers),
+        allocating them for the current view size if needed
+        """
+
+        sz = self.agent_view_size
+        if self.obs_buffers is None or self.obs_buffers['image'].shape[0] != sz:
+            self.obs_buffers = {
+                'image': np.zeros((sz, sz, 3), dtype='uint8'),
+                'transparent': np.zeros((sz, sz), dtype=bool),
+                'obs': {}
+            }
+        return self.obs_buffers
+
+    def get_obs_render(self, obs, tile_size=TILE_PIXELS//2, out=None):
         """
         Render an agent observation for visualization
         """
 
-        grid, vis_mask = Grid.decode(obs)
+        # Cells which are not unseen are highlighted, as with Grid.decode()
+        vis_mask = obs[:, :, 0] != OBJECT_TO_IDX['unseen']
 
         # Render the whole grid
-        img = grid.render(
-            tile_size,
-            agent_pos=(self.agent_view_size // 2, self.agent_view_size - 1),
+        atlas = TileAtlas.get(tile_size)
+        agent_pos = (self.agent_view_size // 2, self.agent_view_size - 1)
+        idx = atlas.indices(
+            obs,
+            agent_pos=agent_pos,
             agent_dir=3,
             highlight_mask=vis_mask
         )
+        missing = idx < 0
+        img = atlas.compose(np.where(missing, 0, idx), out=out)
+
+        # Objects not in the atlas are decoded and rendered separately
+        for i, j in np.argwhere(missing).tolist():
+            img[j*tile_size:(j+1)*tile_size, i*tile_size:(i+1)*tile_size] = Grid.render_tile(
+                WorldObj.decode(*obs[i, j]),
+                agent_dir=3 if (i, j) == agent_pos else None,
+                highlight=vis_mask[i, j],
+                tile_size=tile_size
+            )
 
         return img
 
-    def render(self, mode='human', close=False, highlight=True, tile_size=TILE_PIXELS):
+    def render(self, mode='human', close=False, highlight=True, tile_size=TILE_PIXELS, out=None):
         """
-        Render the whole-grid human view
+        Render the whole-grid human view. The frame is copied into out if
+        given.
         """
 
         if close:
@@ -1255,50 +2700,52 @@ class MiniGridEnv(gym.Env):
             self.window = gym_minigrid.window.Window('gym_minigrid')
             self.window.show(block=False)
 
-        # Compute which cells are visible to the agent
-        _, vis_mask = self.gen_obs_grid()
-
-        # Compute the world coordinates of the bottom-left corner
-        # of the agent's view area
-        f_vec = self.dir_vec
-        r_vec = self.right_vec
-        top_left = self.agent_pos + f_vec * (self.agent_view_size-1) - r_vec * (self.agent_view_size // 2)
-
         # Mask of which cells to highlight
-        highlight_mask = np.zeros(shape=(self.width, self.height), dtype=np.bool)
+        highlight_mask = None
 
-        # For each cell in the visibility mask
-        for vis_j in range(0, self.agent_view_size):
-            for vis_i in range(0, self.agent_view_size):
-                # If this cell is not visible, don't highlight it
-                if not vis_mask[vis_i, vis_j]:
-                    continue
-
-                # Compute the world coordinates of this cell
-                abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
+        if highlight:
+            # Compute which cells are visible to the agent
+            _, vis_mask = self.gen_obs_image()
 
-                if abs_i < 0 or abs_i >= self.width:
-                    continue
-                if abs_j < 0 or abs_j >= self.height:
-                    continue
+            # Compute the world coordinates of the visible cells
+            dx, dy = view_offsets(self.agent_view_size)
+            abs_i = self.agent_pos[0] + dx[self.agent_dir][vis_mask]
+            abs_j = self.agent_pos[1] + dy[self.agent_dir][vis_mask]
+            inside = (abs_i >= 0) & (abs_i < self.width) & (abs_j >= 0) & (abs_j < self.height)
 
-                # Mark this cell to be highlighted
-                highlight_mask[abs_i, abs_j] = True
+            highlight_mask = np.zeros(shape=(self.width, self.height), dtype=bool)
+            highlight_mask[abs_i[inside], abs_j[inside]] = True
 
-        # Render the whole grid
-        img = self.grid.render(
-            tile_size,
+        # Render the whole grid, redrawing only the cells which changed
+        img = self.grid_renderer(tile_size).render(
+            self.grid,
             self.agent_pos,
             self.agent_dir,
-            highlight_mask=highlight_mask if highlight else None
+            highlight_mask=highlight_mask
         )
 
+        # The renderer keeps drawing into the same frame
+        if out is not None:
+            np.copyto(out, img)
+            img = out
+        elif not self.reuse_obs_buffers:
+            img = img.copy()
+
         if mode == 'human':
             self.window.show_img(img)
             self.window.set_caption(self.mission)
 
         return img
 
+    def grid_renderer(self, tile_size):
+        """
+        Get the renderer keeping the last frame of the grid for a tile size
+        """
+
+        if tile_size not in self.grid_renderers:
+            self.grid_renderers[tile_size] = GridRenderer(tile_size)
+        return self.grid_renderers[tile_size]
+
     def close(self):
         if self.window:
             self.window.close()
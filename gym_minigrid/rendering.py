@@ -15,17 +15,51 @@ def downsample(img, factor):
 
     return img
 
+# Cache of pixel center coordinates, indexed by image height and width
+_pixel_coords_cache = {}
+
+def pixel_coords(height, width):
+    """
+    Get the x and y coordinates of the pixel centers of an image, as
+    (height, width) meshes of values in [0, 1]
+    """
+
+    key = (height, width)
+
+    if key not in _pixel_coords_cache:
+        yf = (np.arange(height) + 0.5) / height
+        xf = (np.arange(width) + 0.5) / width
+        xf, yf = np.meshgrid(xf, yf)
+        xf.setflags(write=False)
+        yf.setflags(write=False)
+        _pixel_coords_cache[key] = (xf, yf)
+
+    return _pixel_coords_cache[key]
+
 def fill_coords(img, fn, color):
     """
-    Fill pixels of an image with coordinates matching a filter function
+    Fill pixels of an image with coordinates matching a filter function.
+    The filter function is evaluated over the coordinate meshes of all
+    pixels at once, with a per-pixel fallback for functions which only
+    accept scalar coordinates.
     """
 
-    for y in range(img.shape[0]):
-        for x in range(img.shape[1]):
-            yf = (y + 0.5) / img.shape[0]
-            xf = (x + 0.5) / img.shape[1]
-            if fn(xf, yf):
-                img[y, x] = color
+    xf, yf = pixel_coords(img.shape[0], img.shape[1])
+
+    # Functions using scalar operations (e.g. math.sqrt) on the meshes raise
+    # a TypeError, and ones using them in conditions a ValueError
+    try:
+        mask = fn(xf, yf)
+    except (ValueError, TypeError):
+        mask = None
+
+    if np.shape(mask) != xf.shape:
+        mask = np.zeros(xf.shape, dtype=bool)
+        for y in range(img.shape[0]):
+            for x in range(img.shape[1]):
+                mask[y, x] = fn(xf[y, x], yf[y, x])
+
+    img[mask] = color
 
     return img
 
@@ -46,7 +80,7 @@ def point_in_line(x0, y0, x1, y1, r):
     p1 = np.array([x1, y1])
     dir = p1 - p0
     dist = np.linalg.norm(dir)
-    dir = dir / dist
+    dx, dy = dir / dist
 
     xmin = min(x0, x1) - r
     xmax = max(x0, x1) + r
@@ -54,20 +88,19 @@ def point_in_line(x0, y0, x1, y1, r):
     ymax = max(y0, y1) + r
 
     def fn(x, y):
-        # Fast, early escape test
-        if x < xmin or x > xmax or y < ymin or y > ymax:
-            return False
-
-        q = np.array([x, y])
-        pq = q - p0
-
         # Closest point on line
-        a = np.dot(pq, dir)
+        a = (x - x0) * dx + (y - y0) * dy
         a = np.clip(a, 0, dist)
-        p = p0 + a * dir
+        px = x0 + a * dx
+        py = y0 + a * dy
 
-        dist_to_line = np.linalg.norm(q - p)
-        return dist_to_line <= r
+        dist_to_line = np.sqrt((x - px) * (x - px) + (y - py) * (y - py))
+
+        return (
+            (x >= xmin) & (x <= xmax) &
+            (y >= ymin) & (y <= ymax) &
+            (dist_to_line <= r)
+        )
 
     return fn
 
@@ -78,7 +111,7 @@ def point_in_circle(cx, cy, r):
 
 def point_in_rect(xmin, xmax, ymin, ymax):
     def fn(x, y):
-        return x >= xmin and x <= xmax and y >= ymin and y <= ymax
+        return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
     return fn
 
 def point_in_triangle(a, b, c):
@@ -86,25 +119,28 @@ def point_in_triangle(a, b, c):
     b = np.array(b)
     c = np.array(c)
 
+    v0 = c - a
+    v1 = b - a
+
+    # Compute the dot products which don't depend on the point
+    dot00 = np.dot(v0, v0)
+    dot01 = np.dot(v0, v1)
+    dot11 = np.dot(v1, v1)
+    inv_denom = 1 / (dot00 * dot11 - dot01 * dot01)
+
     def fn(x, y):
-        v0 = c - a
-        v1 = b - a
-        v2 = np.array((x, y)) - a
+        v2x = x - a[0]
+        v2y = y - a[1]
 
-        # Compute dot products
-        dot00 = np.dot(v0, v0)
-        dot01 = np.dot(v0, v1)
-        dot02 = np.dot(v0, v2)
-        dot11 = np.dot(v1, v1)
-        dot12 = np.dot(v1, v2)
+        dot02 = v0[0] * v2x + v0[1] * v2y
+        dot12 = v1[0] * v2x + v1[1] * v2y
 
         # Compute barycentric coordinates
-        inv_denom = 1 / (dot00 * dot11 - dot01 * dot01)
         u = (dot11 * dot02 - dot01 * dot12) * inv_denom
         v = (dot00 * dot12 - dot01 * dot02) * inv_denom
 
         # Check if point is in triangle
-        return (u >= 0) and (v >= 0) and (u + v) < 1
+        return (u >= 0) & (v >= 0) & ((u + v) < 1)
 
     return fn
 
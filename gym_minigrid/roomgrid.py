@@ -36,6 +36,16 @@ class Room:
         # List of objects contained
         self.objs = []
 
+    def __deepcopy__(self, memo):
+        # Only the doors, neighbors and objects need copying
+        room = copy(self)
+        memo[id(self)] = room
+        room.doors = deepcopy(self.doors, memo)
+        room.door_pos = list(self.door_pos)
+        room.neighbors = deepcopy(self.neighbors, memo)
+        room.objs = deepcopy(self.objs, memo)
+        return room
+
     def rand_pos(self, env):
         topX, topY = self.top
         sizeX, sizeY = self.size
@@ -66,6 +76,8 @@ class RoomGrid(MiniGridEnv):
     This is meant to serve as a base class for other environments.
     """
 
+    state_attrs = ('room_grid',)
+
     def __init__(
         self,
         room_size=7,
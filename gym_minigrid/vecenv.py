@@ -0,0 +1,581 @@
+import os
+import weakref
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import gym
+import numpy as np
+from .minigrid import *
+
+# Cells the agent can walk onto, indexed by (type, state)
+CAN_OVERLAP = np.zeros((256, 256), dtype=bool)
+for name in ['empty', 'floor', 'goal', 'lava']:
+    CAN_OVERLAP[OBJECT_TO_IDX[name], :] = True
+CAN_OVERLAP[OBJECT_TO_IDX['door'], STATE_TO_IDX['open']] = True
+
+# Objects the agent can pick up, indexed by type
+CAN_PICKUP = np.zeros(256, dtype=bool)
+for name in ['key', 'ball', 'box']:
+    CAN_PICKUP[OBJECT_TO_IDX[name]] = True
+
+DIR_VEC = np.array(DIR_TO_VEC)
+
+def is_vectorizable(env):
+    """
+    Check whether an environment follows the default MiniGridEnv dynamics,
+    so that it can be stepped by VecMiniGrid.
+    """
+
+    env_type = type(env.unwrapped)
+    return (
+        env_type.reset is MiniGridEnv.reset and
+        env_type.step is MiniGridEnv.step and
+        env_type._reward is MiniGridEnv._reward and
+        env_type.gen_obs is MiniGridEnv.gen_obs
+    )
+
+class VecMiniGrid:
+    """
+    Batch of environments of the same registered id, stepped together.
+    The state of all environments is kept in stacked arrays, and actions
+    are applied to every environment at once with array operations.
+    Environments are reset by their own MiniGridEnv instance, which
+    generates the grid of the next episode (see MiniGridEnv._gen_grid).
+
+    With tokenize_missions, observations hold the encoded missions of all
+    environments as a (num_envs, max_len) 'mission_tokens' array (see
+    MiniGridEnv.tokenize_missions).
+    """
+
+    def __init__(self, env_id, num_envs, seed=None, auto_reset=True, tokenize_missions=False):
+        self.envs = [gym.make(env_id).unwrapped for _ in range(num_envs)]
+        self.num_envs = num_envs
+        self.auto_reset = auto_reset
+        self.tokenize_missions = tokenize_missions
+
+        env = self.envs[0]
+        assert is_vectorizable(env), "%s overrides the default dynamics" % env_id
+
+        self.actions = MiniGridEnv.Actions
+        self.action_space = env.action_space
+        self.observation_space = env.observation_space
+        if tokenize_missions:
+            self.vocab = MissionVocabulary.registered()
+            self.observation_space = spaces.Dict(dict(
+                self.observation_space.spaces,
+                mission_tokens=self.vocab.space()
+            ))
+        self.width = env.width
+        self.height = env.height
+        self.agent_view_size = env.agent_view_size
+        self.see_through_walls = env.see_through_walls
+
+        # Grids are padded with walls so that views never go out of bounds
+        sz = self.agent_view_size
+        self.pad = sz - 1
+        shape = (num_envs, self.width + 2 * self.pad, self.height + 2 * self.pad)
+        num_cells = shape[0] * shape[1] * shape[2]
+
+        # Cells of all grids, followed by an extra unseen cell (all zeros)
+        # which views gather in place of the cells the agents can't see
+        self._cells = np.zeros((num_cells + 1, 3), dtype='uint8')
+        self._unseen = num_cells
+        self.grids = self._cells[:num_cells].reshape(shape + (3,))
+        self.grids[:] = WALL_CODE
+
+        # Map of the cells agents can see through, kept in sync with grids
+        self._transparent = np.zeros(num_cells + 1, dtype=bool)
+        self.transparent = self._transparent[:num_cells].reshape(shape)
+
+        # Encoded contents of the boxes in each cell, zero if there are none
+        self._contents = np.zeros((num_cells, 3), dtype='uint8')
+        self.contents = self._contents.reshape(shape + (3,))
+
+        padded_height = shape[2]
+        self._grid_offsets = np.arange(num_envs) * shape[1] * padded_height
+
+        # Flat offsets of the cells in view for each agent direction
+        dx, dy = view_offsets(sz)
+        self._view_offsets = (dx * padded_height + dy).reshape(4, sz * sz)
+
+        self.agent_pos = np.zeros((num_envs, 2), dtype=np.int64)
+        self.agent_dir = np.zeros(num_envs, dtype=np.int64)
+        self.carrying = np.zeros((num_envs, 3), dtype='uint8')
+        self.carrying_contents = np.zeros((num_envs, 3), dtype='uint8')
+        self.step_count = np.zeros(num_envs, dtype=np.int64)
+        self.max_steps = np.array([env.max_steps for env in self.envs])
+        self.missions = [None] * num_envs
+        if tokenize_missions:
+            self.mission_tokens = np.zeros((num_envs, self.vocab.max_len), dtype=np.int64)
+
+        if seed is not None:
+            self.seed(seed)
+
+        self.reset()
+
+    def seed(self, seed=1337):
+        """
+        Seed environment i with seed + i
+        """
+
+        for i, env in enumerate(self.envs):
+            env.seed(seed + i)
+        return [seed + i for i in range(self.num_envs)]
+
+    def reset(self):
+        for i in range(self.num_envs):
+            self.reset_env(i)
+        return self.gen_obs()
+
+    def reset_env(self, i):
+        """
+        Start a new episode in environment i
+        """
+
+        # Only the grid generation of MiniGridEnv.reset() is needed here,
+        # the rest of the episode state is kept in arrays
+        env = self.envs[i]
+        env.agent_pos = None
+        env.agent_dir = None
+        env._gen_grid(env.width, env.height)
+        assert env.agent_pos is not None
+        assert env.agent_dir is not None
+
+        grid = env.grid
+        pad = self.pad
+        array = grid.encode()
+        self.grids[i, pad:pad+self.width, pad:pad+self.height] = array
+        self.transparent[i] = TRANSPARENT[self.grids[i, :, :, 0], self.grids[i, :, :, 2]]
+
+        self.contents[i] = 0
+        for x, y in np.argwhere(array[:, :, 0] == OBJECT_TO_IDX['box']):
+            box = grid.get(x, y)
+            if box.contains is not None:
+                self.contents[i, x + pad, y + pad] = box.contains.encode()
+
+        self.agent_pos[i] = env.agent_pos
+        self.agent_dir[i] = env.agent_dir
+        self.carrying[i] = EMPTY_CODE
+        self.carrying_contents[i] = 0
+        self.step_count[i] = 0
+        self.missions[i] = env.mission
+        if self.tokenize_missions:
+            self.mission_tokens[i] = self.vocab.encode(env.mission)
+
+    def _cell_index(self, pos):
+        padded_height = self.grids.shape[2]
+        return (
+            self._grid_offsets +
+            (pos[:, 0] + self.pad) * padded_height +
+            pos[:, 1] + self.pad
+        )
+
+    def _set_cells(self, idx, codes):
+        self._cells[idx] = codes
+        codes = self._cells[idx]
+        self._transparent[idx] = TRANSPARENT[codes[:, 0], codes[:, 2]]
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        self.step_count += 1
+
+        reward = np.zeros(self.num_envs, dtype=np.float64)
+        done = np.zeros(self.num_envs, dtype=bool)
+
+        # Get the contents of the cell in front of each agent
+        fwd_pos = self.agent_pos + DIR_VEC[self.agent_dir]
+        fwd_idx = self._cell_index(fwd_pos)
+        fwd_cell = self._cells[fwd_idx]
+        fwd_type = fwd_cell[:, 0]
+
+        # Rotate left or right
+        turn = (actions == self.actions.right).astype(np.int64)
+        turn -= (actions == self.actions.left)
+        self.agent_dir = (self.agent_dir + turn) % 4
+
+        # Move forward
+        forward = actions == self.actions.forward
+        move = forward & CAN_OVERLAP[fwd_type, fwd_cell[:, 2]]
+        self.agent_pos = np.where(move[:, None], fwd_pos, self.agent_pos)
+        goal = forward & (fwd_type == OBJECT_TO_IDX['goal'])
+        reward[goal] = 1 - 0.9 * (self.step_count[goal] / self.max_steps[goal])
+        done |= goal | (forward & (fwd_type == OBJECT_TO_IDX['lava']))
+
+        not_carrying = self.carrying[:, 0] == OBJECT_TO_IDX['empty']
+
+        # Pick up an object
+        pickup = (actions == self.actions.pickup) & CAN_PICKUP[fwd_type] & not_carrying
+        if pickup.any():
+            idx = fwd_idx[pickup]
+            self.carrying[pickup] = fwd_cell[pickup]
+            self.carrying_contents[pickup] = self._contents[idx]
+            self._set_cells(idx, EMPTY_CODE)
+            self._contents[idx] = 0
+
+        # Drop an object
+        drop = (actions == self.actions.drop) & (fwd_type == OBJECT_TO_IDX['empty']) & ~not_carrying
+        if drop.any():
+            idx = fwd_idx[drop]
+            self._set_cells(idx, self.carrying[drop])
+            self._contents[idx] = self.carrying_contents[drop]
+            self.carrying[drop] = EMPTY_CODE
+            self.carrying_contents[drop] = 0
+
+        toggle = actions == self.actions.toggle
+        if toggle.any():
+            # Open and close doors, locked doors need a key of the same color
+            door = toggle & (fwd_type == OBJECT_TO_IDX['door'])
+            if door.any():
+                state = fwd_cell[door, 2]
+                has_key = (
+                    (self.carrying[door, 0] == OBJECT_TO_IDX['key']) &
+                    (self.carrying[door, 1] == fwd_cell[door, 1])
+                )
+                state = np.where(
+                    state == STATE_TO_IDX['locked'],
+                    np.where(has_key, STATE_TO_IDX['open'], STATE_TO_IDX['locked']),
+                    np.where(state == STATE_TO_IDX['open'], STATE_TO_IDX['closed'], STATE_TO_IDX['open'])
+                )
+                cells = fwd_cell[door]
+                cells[:, 2] = state
+                self._set_cells(fwd_idx[door], cells)
+
+            # Boxes are replaced by their contents
+            box = toggle & (fwd_type == OBJECT_TO_IDX['box'])
+            if box.any():
+                idx = fwd_idx[box]
+                contents = self._contents[idx]
+                empty = contents[:, 0] == 0
+                contents[empty] = EMPTY_CODE
+                self._set_cells(idx, contents)
+                self._contents[idx] = 0
+
+        done |= self.step_count >= self.max_steps
+
+        if self.auto_reset:
+            for i in np.flatnonzero(done):
+                self.reset_env(i)
+
+        obs = self.gen_obs()
+
+        return obs, reward, done, {}
+
+    def gen_obs_image(self):
+        """
+        Generate the encoded views of all agents, of shape
+        (num_envs, view, view, 3), along with their visibility masks
+        """
+
+        sz = self.agent_view_size
+
+        # Indices of the cells in view, rotated so the agents face up
+        agent_idx = self._cell_index(self.agent_pos)
+        cell_idx = self._view_offsets.take(self.agent_dir, axis=0)
+        cell_idx += agent_idx[:, None]
+
+        # Process occluders and visibility, cells the agents can't see
+        # are read from the unseen cell
+        if not self.see_through_walls:
+            transparent = self._transparent.take(cell_idx).reshape(-1, sz, sz)
+            vis_mask = compute_vis_mask(transparent, (sz // 2, sz - 1))
+            np.putmask(cell_idx, ~vis_mask.reshape(cell_idx.shape), self._unseen)
+        else:
+            vis_mask = np.ones((self.num_envs, sz, sz), dtype=bool)
+
+        image = self._cells.take(cell_idx, axis=0).reshape(-1, sz, sz, 3)
+
+        # Make it so the agents see what they're carrying
+        image[:, sz // 2, sz - 1] = self.carrying
+
+        return image, vis_mask
+
+    def gen_obs(self):
+        image, _ = self.gen_obs_image()
+
+        obs = {
+            'image': image,
+            'direction': self.agent_dir.copy(),
+            'mission': list(self.missions)
+        }
+
+        if self.tokenize_missions:
+            obs['mission_tokens'] = self.mission_tokens.copy()
+
+        return obs
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+def _shared_layout(num_envs, agent_view_size, ring_size, mission_len=0):
+    """
+    Layout of the shared memory buffers of SubprocVecMiniGrid, as a list
+    of (name, dtype, shape, offset) tuples, along with the total size.
+    Encoded missions of mission_len words are included if it isn't zero.
+    """
+
+    sz = agent_view_size
+    fields = [
+        ('actions', 'int64', (num_envs,)),
+        ('image', 'uint8', (ring_size, num_envs, sz, sz, 3)),
+        ('direction', 'int64', (ring_size, num_envs)),
+        ('reward', 'float64', (ring_size, num_envs)),
+        ('done', 'bool', (ring_size, num_envs)),
+    ]
+    if mission_len:
+        fields.append(('mission_tokens', 'int64', (ring_size, num_envs, mission_len)))
+
+    layout = []
+    offset = 0
+    for name, dtype, shape in fields:
+        layout.append((name, dtype, shape, offset))
+        size = np.dtype(dtype).itemsize * int(np.prod(shape))
+        offset += (size + 63) // 64 * 64
+
+    return layout, offset
+
+def _map_buffers(buf, layout):
+    return {
+        name: np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        for name, dtype, shape, offset in layout
+    }
+
+def _worker(remote, env_id, env_indices, seed, shm_name, layout, cpu, tokenize_missions):
+    """
+    Host the environments env_indices of a SubprocVecMiniGrid, writing
+    their observations into the shared memory ring
+    """
+
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    buffers = _map_buffers(shm.buf, layout)
+    actions = buffers['actions']
+
+    def write(slot, i, obs):
+        buffers['image'][slot, i] = obs['image']
+        buffers['direction'][slot, i] = obs['direction']
+        if tokenize_missions:
+            buffers['mission_tokens'][slot, i] = obs['mission_tokens']
+
+    # Commands are answered with None, or with the traceback of the
+    # exception they raised, which the parent raises again
+    envs = []
+    try:
+        for i in env_indices:
+            env = gym.make(env_id)
+            envs.append(env)
+            if seed is not None:
+                env.seed(seed + i)
+            if tokenize_missions:
+                env.unwrapped.tokenize_missions = True
+                env.unwrapped.encode_mission()
+
+        while True:
+            cmd, slot = remote.recv()
+
+            if cmd == 'close':
+                break
+
+            try:
+                if cmd == 'step':
+                    for env, i in zip(envs, env_indices):
+                        obs, reward, done, _ = env.step(actions[i])
+                        if done:
+                            obs = env.reset()
+                        write(slot, i, obs)
+                        buffers['reward'][slot, i] = reward
+                        buffers['done'][slot, i] = done
+
+                elif cmd == 'reset':
+                    for env, i in zip(envs, env_indices):
+                        write(slot, i, env.reset())
+                        buffers['reward'][slot, i] = 0
+                        buffers['done'][slot, i] = False
+
+            except Exception:
+                remote.send(traceback.format_exc())
+                continue
+
+            remote.send(None)
+
+    except KeyboardInterrupt:
+        pass
+
+    except Exception:
+        # Creating the environments failed, report it to the next command
+        error = traceback.format_exc()
+        try:
+            remote.recv()
+            remote.send(error)
+        except (EOFError, OSError):
+            pass
+
+    finally:
+        for env in envs:
+            env.close()
+        del actions, buffers
+        shm.close()
+
+def _release(shm, remotes, processes):
+    """
+    Stop the workers of a SubprocVecMiniGrid and free its shared memory
+    """
+
+    for remote in remotes:
+        try:
+            remote.send(('close', None))
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+    try:
+        shm.close()
+    except BufferError:
+        # Observations still referenced by the caller keep the buffer mapped
+        pass
+    shm.unlink()
+
+class SubprocVecMiniGrid:
+    """
+    Environments of the same registered id, stepped in parallel by worker
+    processes which each host several MiniGridEnv instances. Workers write
+    observations, rewards and dones into a ring of slots in shared memory,
+    so that pipes only carry small control messages.
+
+    The arrays returned by reset() and step() are views into the ring,
+    which remain valid until ring_size more steps have been taken.
+    Encoded missions are included as for VecMiniGrid.
+    """
+
+    def __init__(
+        self,
+        env_id,
+        num_envs,
+        num_workers=None,
+        seed=None,
+        ring_size=2,
+        pin_workers=True,
+        tokenize_missions=False
+    ):
+        env = gym.make(env_id)
+        self.action_space = env.action_space
+        self.observation_space = env.observation_space
+        self.agent_view_size = env.agent_view_size
+        env.close()
+
+        self.tokenize_missions = tokenize_missions
+        mission_len = 0
+        if tokenize_missions:
+            vocab = MissionVocabulary.registered()
+            mission_len = vocab.max_len
+            self.observation_space = spaces.Dict(dict(
+                self.observation_space.spaces,
+                mission_tokens=vocab.space()
+            ))
+
+        self.num_envs = num_envs
+        self.ring_size = ring_size
+        self._slot = -1
+        self._waiting = False
+        self.closed = False
+
+        layout, size = _shared_layout(num_envs, self.agent_view_size, ring_size, mission_len)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self.buffers = _map_buffers(self._shm.buf, layout)
+
+        # Spread the workers over the CPUs available to this process
+        if hasattr(os, 'sched_getaffinity'):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = list(range(os.cpu_count()))
+            pin_workers = False
+        if num_workers is None:
+            num_workers = len(cpus)
+        num_workers = min(num_workers, num_envs)
+
+        ctx = mp.get_context()
+        self.remotes = []
+        self.processes = []
+        splits = np.array_split(np.arange(num_envs), num_workers)
+        for w, env_indices in enumerate(splits):
+            remote, work_remote = ctx.Pipe()
+            cpu = cpus[w % len(cpus)] if pin_workers else None
+            process = ctx.Process(
+                target=_worker,
+                args=(work_remote, env_id, env_indices.tolist(), seed, self._shm.name, layout, cpu, tokenize_missions),
+                daemon=True
+            )
+            process.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+        # Stop the workers and free the shared memory even if close() is
+        # never called
+        self._finalizer = weakref.finalize(self, _release, self._shm, self.remotes, self.processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _send(self, cmd):
+        self._slot = (self._slot + 1) % self.ring_size
+        for remote in self.remotes:
+            remote.send((cmd, self._slot))
+
+    def _wait(self):
+        # Wait for every worker before raising, so that none is left with
+        # an unread answer
+        errors = [remote.recv() for remote in self.remotes]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            raise RuntimeError('SubprocVecMiniGrid worker failed:\n' + errors[0])
+
+    def _obs(self, slot):
+        obs = {
+            'image': self.buffers['image'][slot],
+            'direction': self.buffers['direction'][slot]
+        }
+        if self.tokenize_missions:
+            obs['mission_tokens'] = self.buffers['mission_tokens'][slot]
+        return obs
+
+    def reset(self):
+        self._send('reset')
+        self._wait()
+        return self._obs(self._slot)
+
+    def step_async(self, actions):
+        self.buffers['actions'][:] = actions
+        self._send('step')
+        self._waiting = True
+
+    def step_wait(self):
+        self._waiting = False
+        self._wait()
+        slot = self._slot
+        return self._obs(slot), self.buffers['reward'][slot], self.buffers['done'][slot], {}
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._waiting:
+                self._waiting = False
+                self._wait()
+        finally:
+            self.buffers = None
+            self._finalizer()
@@ -1,11 +1,13 @@
 import math
 import operator
+from collections import OrderedDict
 from functools import reduce
 
 import numpy as np
 import gym
 from gym import error, spaces, utils
 from .minigrid import OBJECT_TO_IDX, COLOR_TO_IDX, STATE_TO_IDX
+from .counts import VisitCounts, HashedCounts, count_bonus
 
 class ReseedWrapper(gym.core.Wrapper):
     """
@@ -29,33 +31,45 @@ class ReseedWrapper(gym.core.Wrapper):
         obs, reward, done, info = self.env.step(action)
         return obs, reward, done, info
 
+def _action_key(state_hash, action):
+    """Key of a (state, action) pair in HashedCounts"""
+    return (state_hash ^ (action + 1) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+
 class ActionBonus(gym.core.Wrapper):
     """
     Wrapper which adds an exploration bonus.
     This is a reward to encourage exploration of less
     visited (state,action) pairs.
+
+    By default, states are the position and direction of the agent. With
+    full_state, they are identified by their hash (see
+    MiniGridEnv.state_hash), which covers the whole grid and the carried
+    object. Counts can be passed in, e.g. to share them between
+    environments (see gym_minigrid.counts).
     """
 
-    def __init__(self, env):
+    def __init__(self, env, decay=1.0, full_state=False, counts=None):
         super().__init__(env)
-        self.counts = {}
+        self.full_state = full_state
+        if counts is None:
+            if full_state:
+                counts = HashedCounts(capacity=2**16, decay=decay)
+            else:
+                counts = VisitCounts.for_env(env, decay=decay)
+        self.counts = counts
 
     def step(self, action):
         obs, reward, done, info = self.env.step(action)
 
-        env = self.unwrapped
-        tup = (tuple(env.agent_pos), env.agent_dir, action)
-
-        # Get the count for this (s,a) pair
-        pre_count = 0
-        if tup in self.counts:
-            pre_count = self.counts[tup]
-
         # Update the count for this (s,a) pair
-        new_count = pre_count + 1
-        self.counts[tup] = new_count
+        env = self.unwrapped
+        if self.full_state:
+            new_count = self.counts.update(_action_key(env.state_hash, int(action)))
+        else:
+            x, y = env.agent_pos
+            new_count = self.counts.update(x, y, env.agent_dir, action)
 
-        bonus = 1 / math.sqrt(new_count)
+        bonus = float(count_bonus(new_count))
         reward += bonus
 
         return obs, reward, done, info
@@ -67,30 +81,35 @@ class StateBonus(gym.core.Wrapper):
     """
     Adds an exploration bonus based on which positions
     are visited on the grid.
+
+    With full_state, whole states are counted instead of positions (see
+    ActionBonus).
     """
 
-    def __init__(self, env):
+    def __init__(self, env, decay=1.0, full_state=False, counts=None):
         super().__init__(env)
-        self.counts = {}
+        self.full_state = full_state
+        if counts is None:
+            if full_state:
+                counts = HashedCounts(capacity=2**16, decay=decay)
+            else:
+                env = self.unwrapped
+                counts = VisitCounts((env.width, env.height), decay=decay)
+        self.counts = counts
 
     def step(self, action):
         obs, reward, done, info = self.env.step(action)
 
-        # Tuple based on which we index the counts
+        # Update the count for this key
         # We use the position after an update
         env = self.unwrapped
-        tup = (tuple(env.agent_pos))
-
-        # Get the count for this key
-        pre_count = 0
-        if tup in self.counts:
-            pre_count = self.counts[tup]
+        if self.full_state:
+            new_count = self.counts.update(env.state_hash)
+        else:
+            x, y = env.agent_pos
+            new_count = self.counts.update(x, y)
 
-        # Update the count for this key
-        new_count = pre_count + 1
-        self.counts[tup] = new_count
-
-        bonus = 1 / math.sqrt(new_count)
+        bonus = float(count_bonus(new_count))
         reward += bonus
 
         return obs, reward, done, info
@@ -110,21 +129,52 @@ class ImgObsWrapper(gym.core.ObservationWrapper):
     def observation(self, obs):
         return obs['image']
 
+# Number of bits of the one-hot encoding of a cell, and offsets of the
+# bits of the type, color and state of the cell
+ONE_HOT_BITS = len(OBJECT_TO_IDX) + len(COLOR_TO_IDX) + len(STATE_TO_IDX)
+ONE_HOT_OFFSETS = np.array([0, len(OBJECT_TO_IDX), len(OBJECT_TO_IDX) + len(COLOR_TO_IDX)])
+
+# One-hot encodings of each bit, and the same packed into bytes as with
+# np.packbits. Encodings of cells are the union of those of their bits.
+ONE_HOT_TABLE = np.eye(ONE_HOT_BITS, dtype='uint8')
+ONE_HOT_PACKED = np.packbits(ONE_HOT_TABLE, axis=-1)
+
+def one_hot(image, out=None, packed=False):
+    """
+    One-hot encode the cells of an image of encoded cells, of shape
+    (..., 3), e.g. a batch of observations from vectorized environments.
+    The result has ONE_HOT_BITS values per cell, or these bits packed into
+    bytes as with np.packbits if packed is set, and is written into out
+    if given.
+    """
+
+    table = ONE_HOT_PACKED if packed else ONE_HOT_TABLE
+    bits = image + ONE_HOT_OFFSETS.astype(image.dtype)
+
+    out = np.take(table, bits[..., 0], axis=0, out=out)
+    np.bitwise_or(out, table[bits[..., 1]], out=out)
+    np.bitwise_or(out, table[bits[..., 2]], out=out)
+    return out
+
 class OneHotPartialObsWrapper(gym.core.ObservationWrapper):
     """
     Wrapper to get a one-hot encoding of a partially observable
-    agent view as observation.
+    agent view as observation. With packed, the bits of each cell
+    are packed into bytes (see one_hot).
     """
 
-    def __init__(self, env, tile_size=8):
+    def __init__(self, env, tile_size=8, packed=False):
         super().__init__(env)
 
         self.tile_size = tile_size
+        self.packed = packed
 
         obs_shape = env.observation_space['image'].shape
 
         # Number of bits per cell
-        num_bits = len(OBJECT_TO_IDX) + len(COLOR_TO_IDX) + len(STATE_TO_IDX)
+        num_bits = ONE_HOT_BITS
+        if packed:
+            num_bits = ONE_HOT_PACKED.shape[1]
 
         self.observation_space.spaces["image"] = spaces.Box(
             low=0,
@@ -133,23 +183,22 @@ class OneHotPartialObsWrapper(gym.core.ObservationWrapper):
             dtype='uint8'
         )
 
+        # Image buffer, used if the environment reuses its observation buffers
+        self.buffer = None
+
     def observation(self, obs):
         img = obs['image']
-        out = np.zeros(self.observation_space.spaces['image'].shape, dtype='uint8')
-
-        for i in range(img.shape[0]):
-            for j in range(img.shape[1]):
-                type = img[i, j, 0]
-                color = img[i, j, 1]
-                state = img[i, j, 2]
 
-                out[i, j, type] = 1
-                out[i, j, len(OBJECT_TO_IDX) + color] = 1
-                out[i, j, len(OBJECT_TO_IDX) + len(COLOR_TO_IDX) + state] = 1
+        out = None
+        if self.unwrapped.reuse_obs_buffers:
+            shape = img.shape[:-1] + self.observation_space.spaces['image'].shape[-1:]
+            if self.buffer is None or self.buffer.shape != shape:
+                self.buffer = np.zeros(shape, dtype='uint8')
+            out = self.buffer
 
         return {
             'mission': obs['mission'],
-            'image': out
+            'image': one_hot(img, out=out, packed=self.packed)
         }
 
 class RGBImgObsWrapper(gym.core.ObservationWrapper):
@@ -205,12 +254,23 @@ class RGBImgPartialObsWrapper(gym.core.ObservationWrapper):
             dtype='uint8'
         )
 
+        # Image buffer, used if the environment reuses its observation buffers
+        self.buffer = None
+
     def observation(self, obs):
         env = self.unwrapped
 
+        out = None
+        if env.reuse_obs_buffers:
+            shape = tuple(self.tile_size * n for n in obs['image'].shape[:2]) + (3,)
+            if self.buffer is None or self.buffer.shape != shape:
+                self.buffer = np.zeros(shape, dtype='uint8')
+            out = self.buffer
+
         rgb_img_partial = env.get_obs_render(
             obs['image'],
-            tile_size=self.tile_size
+            tile_size=self.tile_size,
+            out=out
         )
 
         return {
@@ -247,56 +307,103 @@ class FullyObsWrapper(gym.core.ObservationWrapper):
             'image': full_grid
         }
 
+# Codes of the characters of mission strings, -1 for other characters
+CHAR_CODES = np.full(256, -1, dtype=np.int64)
+CHAR_CODES[ord('a'):ord('z') + 1] = np.arange(26)
+CHAR_CODES[ord(' ')] = 26
+
+# One-hot encodings of character codes, followed by the all-zero encoding
+# of padding (code -1)
+CHAR_ONE_HOT = np.concatenate([np.eye(27, dtype='uint8'), np.zeros((1, 27), dtype='uint8')])
+
+# Cache of encoded mission strings shared by all wrappers, holding at most
+# mission_cache_size encodings (see encode_mission)
+mission_cache = OrderedDict()
+mission_cache_size = 1024
+
+def encode_mission(mission, max_len):
+    """
+    Encode a mission string as a read-only array of max_len character
+    codes: 0 to 25 for letters, 26 for spaces and -1 for padding. Other
+    characters, such as commas, repeat the code of the previous character.
+    """
+
+    key = (mission, max_len)
+    codes = mission_cache.get(key)
+    if codes is not None:
+        mission_cache.move_to_end(key)
+        return codes
+
+    assert len(mission) <= max_len, 'mission string too long ({} chars)'.format(len(mission))
+    chars = np.frombuffer(mission.lower().encode('ascii', 'replace'), dtype='uint8')
+    chars = CHAR_CODES[chars]
+
+    # Index of the last letter or space up to each character
+    known = np.where(chars >= 0, np.arange(len(chars)), -1)
+    known = np.maximum.accumulate(known) if len(chars) else known
+    assert len(chars) == 0 or known[0] >= 0, 'mission string must start with a letter or space'
+
+    codes = np.full(max_len, -1, dtype=np.int64)
+    codes[:len(chars)] = chars[known]
+    codes.setflags(write=False)
+
+    mission_cache[key] = codes
+    if len(mission_cache) > mission_cache_size:
+        mission_cache.popitem(last=False)
+
+    return codes
+
 class FlatObsWrapper(gym.core.ObservationWrapper):
     """
     Encode mission strings using a one-hot scheme,
-    and combine these with observed images into one flat array
+    and combine these with observed images into one flat array.
+    With tokens, the mission is instead encoded as one character code
+    per character (see encode_mission), plus one so that 0 is padding,
+    e.g. for policies embedding the characters.
     """
 
-    def __init__(self, env, maxStrLen=96):
+    def __init__(self, env, maxStrLen=96, tokens=False):
         super().__init__(env)
 
         self.maxStrLen = maxStrLen
         self.numCharCodes = 27
+        self.tokens = tokens
 
         imgSpace = env.observation_space.spaces['image']
         imgSize = reduce(operator.mul, imgSpace.shape, 1)
 
+        strSize = self.maxStrLen if tokens else self.numCharCodes * self.maxStrLen
+
         self.observation_space = spaces.Box(
             low=0,
             high=255,
-            shape=(imgSize + self.numCharCodes * self.maxStrLen,),
+            shape=(imgSize + strSize,),
             dtype='uint8'
         )
 
-        self.cachedStr = None
-        self.cachedArray = None
+        # Output buffer, used if the environment reuses its observation buffers
+        self.buffer = None
 
     def observation(self, obs):
         image = obs['image']
-        mission = obs['mission']
-
-        # Cache the last-encoded mission string
-        if mission != self.cachedStr:
-            assert len(mission) <= self.maxStrLen, 'mission string too long ({} chars)'.format(len(mission))
-            mission = mission.lower()
-
-            strArray = np.zeros(shape=(self.maxStrLen, self.numCharCodes), dtype='float32')
-
-            for idx, ch in enumerate(mission):
-                if ch >= 'a' and ch <= 'z':
-                    chNo = ord(ch) - ord('a')
-                elif ch == ' ':
-                    chNo = ord('z') - ord('a') + 1
-                assert chNo < self.numCharCodes, '%s : %d' % (ch, chNo)
-                strArray[idx, chNo] = 1
-
-            self.cachedStr = mission
-            self.cachedArray = strArray
-
-        obs = np.concatenate((image.flatten(), self.cachedArray.flatten()))
-
-        return obs
+        codes = encode_mission(obs['mission'], self.maxStrLen)
+
+        if self.unwrapped.reuse_obs_buffers:
+            if self.buffer is None:
+                self.buffer = np.empty(self.observation_space.shape, dtype='uint8')
+            out = self.buffer
+        else:
+            out = np.empty(self.observation_space.shape, dtype='uint8')
+
+        imgSize = image.size
+        out[:imgSize] = image.reshape(-1)
+        if self.tokens:
+            np.add(codes, 1, out=out[imgSize:], casting='unsafe')
+        else:
+            strArray = out[imgSize:].reshape(self.maxStrLen, self.numCharCodes)
+            np.take(CHAR_ONE_HOT, codes, axis=0, out=strArray)
+
+        return out
 
 class ViewSizeWrapper(gym.core.Wrapper):
     """
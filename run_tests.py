@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 
 import random
+from copy import deepcopy
 import numpy as np
 import gym
 from gym_minigrid.register import env_list
-from gym_minigrid.minigrid import Grid, OBJECT_TO_IDX
+from gym_minigrid.minigrid import Grid, OBJECT_TO_IDX, Door
 
 # Test specifically importing a specific environment
 from gym_minigrid.envs import DoorKeyEnv
+from gym_minigrid.envs.delayedmatching import DelayedMatchingEnv
 
 # Test importing wrappers
 from gym_minigrid.wrappers import *
@@ -21,6 +23,12 @@ for env_idx, env_name in enumerate(env_list):
 
     # Load the gym environment
     env = gym.make(env_name)
+
+    # DelayedMatching environments don't take actions and observe RGB
+    # frames, they are tested separately below
+    if isinstance(env.unwrapped, DelayedMatchingEnv):
+        env.close()
+        continue
     env.max_steps = min(env.max_steps, 200)
     env.reset()
     env.render('rgb_array')
@@ -154,3 +162,624 @@ for i in range(0, 500):
     assert agent_sees_goal == goal_visible
     if done:
         env.reset()
+
+##############################################################################
+
+print('testing array-backed grids')
+for env_name in ['MiniGrid-DoorKey-8x8-v0', 'MiniGrid-KeyCorridorS3R3-v0']:
+    env = gym.make(env_name)
+    env.reset()
+    grid = env.grid
+    array_grid = Grid.from_array(grid.encode())
+    assert array_grid == grid
+    assert np.array_equal(array_grid.rotate_left().encode(), grid.rotate_left().encode())
+    for topX, topY in [(-3, -2), (1, 2), (grid.width - 2, 0)]:
+        slice1 = grid.slice(topX, topY, 7, 7)
+        slice2 = array_grid.slice(topX, topY, 7, 7)
+        assert slice1 == slice2
+
+    # Stepping with an array-backed grid produces the same observations
+    env1 = gym.make(env_name)
+    env2 = gym.make(env_name)
+    env1.unwrapped.array_backed = False
+    env2.unwrapped.array_backed = True
+    env1.seed(7)
+    env2.seed(7)
+    env1.reset()
+    env2.reset()
+    assert not env1.grid.array_backed
+    assert env2.grid.array_backed
+    for i in range(0, 200):
+        action = random.randint(0, env1.action_space.n - 1)
+        obs1, _, done, _ = env1.step(action)
+        obs2, _, _, _ = env2.step(action)
+        assert np.array_equal(obs1['image'], obs2['image'])
+        grid1, vis_mask1 = env1.gen_obs_grid()
+        grid2, vis_mask2 = env2.gen_obs_grid()
+        assert np.array_equal(vis_mask1, vis_mask2)
+        assert np.array_equal(grid1.encode(vis_mask1), grid2.encode(vis_mask2))
+        assert np.array_equal(grid1.encode(vis_mask1), obs1['image'])
+        assert env1.grid == env2.grid
+        if done:
+            env1.reset()
+            env2.reset()
+
+# Grids are not array-backed by default, so that objects modified in place
+# without grid.refresh() are seen as they are
+env = gym.make('MiniGrid-DoorKey-8x8-v0')
+env.reset()
+assert not env.grid.array_backed
+door_pos = next((i, j) for i in range(env.width) for j in range(env.height)
+                if isinstance(env.grid.get(i, j), Door))
+env.grid.get(*door_pos).is_open = True
+assert env.grid.encode()[door_pos][2] == 0
+
+# Visibility is computed for grids of any width
+grid = Grid(100, 5)
+grid.vert_wall(80, 0)
+mask = grid.process_vis(agent_pos=(10, 4))
+assert mask[:81].all() and not mask[81:].any()
+
+##############################################################################
+
+print('testing batched environments')
+from gym_minigrid.vecenv import VecMiniGrid
+for env_name in ['MiniGrid-DoorKey-6x6-v0', 'MiniGrid-LavaCrossingS9N1-v0']:
+    num_envs = 4
+    venv = VecMiniGrid(env_name, num_envs, seed=10)
+    envs = [gym.make(env_name) for i in range(num_envs)]
+    for i, env in enumerate(envs):
+        env.seed(10 + i)
+    obs = [env.reset() for env in envs]
+    vobs = venv.gen_obs()
+
+    # The batch steps like separate environments, with automatic resets
+    for step in range(0, 300):
+        for i in range(num_envs):
+            assert np.array_equal(vobs['image'][i], obs[i]['image'])
+            assert vobs['direction'][i] == obs[i]['direction']
+        actions = [random.randint(0, 5) for i in range(num_envs)]
+        vobs, vreward, vdone, _ = venv.step(actions)
+        for i, env in enumerate(envs):
+            obs[i], reward, done, _ = env.step(actions[i])
+            assert reward == vreward[i] and done == vdone[i]
+            if done:
+                obs[i] = env.reset()
+
+print('testing subprocess environments')
+from gym_minigrid.vecenv import SubprocVecMiniGrid
+env_name = 'MiniGrid-DoorKey-6x6-v0'
+num_envs = 4
+venv = SubprocVecMiniGrid(env_name, num_envs, num_workers=2, seed=10)
+vobs = venv.reset()
+envs = [gym.make(env_name) for i in range(num_envs)]
+for i, env in enumerate(envs):
+    env.seed(10 + i)
+obs = [env.reset() for env in envs]
+for step in range(0, 100):
+    for i in range(num_envs):
+        assert np.array_equal(vobs['image'][i], obs[i]['image'])
+    actions = [random.randint(0, 5) for i in range(num_envs)]
+    vobs, vreward, vdone, _ = venv.step(actions)
+    for i, env in enumerate(envs):
+        obs[i], reward, done, _ = env.step(actions[i])
+        assert reward == vreward[i] and done == vdone[i]
+        if done:
+            obs[i] = env.reset()
+venv.close()
+
+# Exceptions raised in workers are raised again in the parent
+with SubprocVecMiniGrid(env_name, 2, num_workers=2, seed=10) as venv:
+    venv.reset()
+    try:
+        venv.step([0, 100])
+        assert False, 'invalid action accepted'
+    except RuntimeError as e:
+        assert 'unknown action' in str(e)
+    venv.step([0, 1])
+assert venv.closed
+
+##############################################################################
+
+print('testing vectorized shape primitives')
+from gym_minigrid.rendering import *
+shapes = [
+    point_in_rect(0.12, 0.88, 0.31, 0.53),
+    point_in_circle(0.56, 0.28, 0.19),
+    point_in_line(0.1, 0.2, 0.7, 0.9, r=0.03),
+    rotate_fn(point_in_triangle((0.12, 0.19), (0.87, 0.50), (0.12, 0.81)), 0.5, 0.5, 0.5 * math.pi),
+]
+for fn in shapes:
+    img1 = fill_coords(np.zeros((96, 96, 3), dtype=np.uint8), fn, (255, 0, 0))
+
+    # Evaluate the same shape one pixel at a time
+    scalar_fn = lambda x, y: bool(fn(float(x), float(y)))
+    img2 = np.zeros((96, 96, 3), dtype=np.uint8)
+    for y in range(96):
+        for x in range(96):
+            if scalar_fn((x + 0.5) / 96, (y + 0.5) / 96):
+                img2[y, x] = (255, 0, 0)
+    assert np.array_equal(img1, img2)
+    assert img1.any()
+
+# Functions which only accept scalars are evaluated pixel by pixel
+scalar_circle = lambda x, y: math.sqrt((x - 0.5) ** 2 + (y - 0.5) ** 2) <= 0.3
+img1 = fill_coords(np.zeros((32, 32, 3), dtype=np.uint8), scalar_circle, (255, 0, 0))
+img2 = fill_coords(np.zeros((32, 32, 3), dtype=np.uint8), point_in_circle(0.5, 0.5, 0.3), (255, 0, 0))
+assert np.array_equal(img1, img2)
+
+##############################################################################
+
+print('testing tile atlas')
+import tempfile
+from gym_minigrid.minigrid import TileAtlas, Door
+from gym_minigrid.envs.delayedmatching import Circle
+for obj in [None, Door('red', is_locked=True), Door('blue', is_open=True)]:
+    tile1 = Grid.render_tile(obj, agent_dir=1, highlight=True, tile_size=8)
+    tile2 = Grid.rasterize_tile(obj, agent_dir=1, highlight=True, tile_size=8)
+    assert np.array_equal(tile1, tile2)
+
+# Atlases saved to disk are memory-mapped back
+atlas_dir = tempfile.mkdtemp()
+TileAtlas.prebuild([8], atlas_dir)
+atlas = TileAtlas.load(TileAtlas.path(8, atlas_dir))
+assert atlas.rendered.all()
+assert np.array_equal(atlas.tiles, TileAtlas.build(8).tiles)
+
+# Randomized shapes are cached by their geometry
+circle1 = Circle(lambda low, high: low, 'red')
+circle2 = Circle(lambda low, high: high, 'red')
+tile1 = Grid.render_tile(circle1, tile_size=8)
+tile2 = Grid.render_tile(circle2, tile_size=8)
+assert not np.array_equal(tile1, tile2)
+assert np.array_equal(tile2, Grid.rasterize_tile(circle2, tile_size=8))
+
+# Encodings without a tile are drawn separately, never from another tile
+grid = Grid(3, 3)
+grid.set(1, 1, circle2)
+img = grid.render(8)
+assert np.array_equal(img[8:16, 8:16], tile2)
+idx = TileAtlas.get(8).indices(grid.encode())
+assert idx[1, 1] == -1
+try:
+    TileAtlas.get(8).compose(idx)
+    assert False, 'missing tile drawn'
+except AssertionError as e:
+    assert 'atlas' in str(e)
+
+print('testing grid rendering')
+env = gym.make('MiniGrid-DoorKey-6x6-v0')
+env.reset()
+img = env.render('rgb_array', highlight=False, tile_size=8)
+for j in range(0, env.height):
+    for i in range(0, env.width):
+        agent_here = np.array_equal(env.agent_pos, (i, j))
+        tile = Grid.rasterize_tile(
+            env.grid.get(i, j),
+            agent_dir=env.agent_dir if agent_here else None,
+            tile_size=8
+        )
+        assert np.array_equal(img[j*8:(j+1)*8, i*8:(i+1)*8], tile)
+
+# Frames redrawn incrementally match full renders
+env = gym.make('MiniGrid-DoorKey-6x6-v0')
+env.reset()
+for i in range(0, 100):
+    obs, reward, done, info = env.step(random.randint(0, 5))
+    img = env.render('rgb_array', highlight=i % 2 == 0, tile_size=8)
+    env2 = deepcopy(env.unwrapped)
+    assert np.array_equal(img, env2.render('rgb_array', highlight=i % 2 == 0, tile_size=8))
+    if done:
+        env.reset()
+
+##############################################################################
+
+print('testing reused observation buffers')
+env = gym.make('MiniGrid-LavaCrossingS9N1-v0')
+env2 = gym.make('MiniGrid-LavaCrossingS9N1-v0')
+env2.unwrapped.reuse_obs_buffers = True
+env.seed(5)
+env2.seed(5)
+obs = env.reset()
+obs2 = env2.reset()
+out = np.zeros_like(obs['image'])
+for i in range(0, 200):
+    action = random.randint(0, 6)
+    obs, reward, done, info = env.step(action)
+    obs2, reward2, done2, info2 = env2.step(action)
+    assert np.array_equal(obs['image'], obs2['image'])
+    assert obs2['image'] is env2.unwrapped.get_obs_buffers()['image']
+    assert reward == reward2 and done == done2
+    assert env2.unwrapped.gen_obs(out=out)['image'] is out
+    assert np.array_equal(out, obs['image'])
+    if done:
+        env.reset()
+        env2.reset()
+
+# Environments overriding step() and reset(), made through gym.make(), write
+# their observations into obs_out as well
+for env_name in ['MiniGrid-Unlock-v0', 'MiniGrid-Fetch-8x8-N3-v0']:
+    env = gym.make(env_name)
+    out = np.zeros((7, 7, 3), dtype='uint8')
+    env.unwrapped.obs_out = out
+    assert env.reset()['image'] is out
+    for i in range(0, 20):
+        obs, _, done, _ = env.step(random.randint(0, 6))
+        assert obs['image'] is out
+        if done:
+            env.reset()
+
+img = env.render('rgb_array', tile_size=8)
+out = np.zeros_like(img)
+assert env.render('rgb_array', tile_size=8, out=out) is out
+assert np.array_equal(img, out)
+
+##############################################################################
+
+print('testing object encodings')
+import pickle
+from gym_minigrid.minigrid import COLOR_TO_IDX, Wall
+door = Door('red', is_locked=True)
+assert door.encode() == (OBJECT_TO_IDX['door'], COLOR_TO_IDX['red'], 2)
+door.is_locked = False
+assert door.encode()[2] == 1
+door.is_open = True
+assert door.encode()[2] == 0
+
+# Immutable objects are shared, and stay shared through copies
+wall = Wall.shared()
+assert Wall.shared() is wall and Wall().encode() == wall.encode()
+assert deepcopy(wall) is wall and pickle.loads(pickle.dumps(wall)) is wall
+assert deepcopy(door) is not door and deepcopy(door).encode() == door.encode()
+grid = Grid(5, 5)
+grid.wall_rect(0, 0, 5, 5)
+assert grid.get(0, 0) is grid.get(4, 4) is wall
+
+##############################################################################
+
+print('testing state snapshots')
+for env_name in ['MiniGrid-DoorKey-8x8-v0', 'MiniGrid-Dynamic-Obstacles-6x6-v0', 'MiniGrid-KeyCorridorS3R3-v0']:
+    env = gym.make(env_name)
+    env.reset()
+    state = env.get_state()
+    actions = [random.randint(0, 6) for i in range(0, 50)]
+
+    def rollout(env):
+        results = []
+        for action in actions:
+            obs, reward, done, info = env.step(action)
+            results.append((obs['image'].tobytes(), reward, done, env.hash()))
+            if done:
+                break
+        return results
+
+    expected = rollout(env)
+    env.set_state(state)
+    assert rollout(env) == expected
+    env.set_state(state)
+    for child in env.unwrapped.clone(3):
+        assert rollout(child) == expected
+    assert rollout(env) == expected
+
+# Clones write observations into their own arrays
+env = gym.make('MiniGrid-DoorKey-8x8-v0').unwrapped
+env.reset()
+env.obs_out = np.zeros_like(env.gen_obs()['image'])
+image = env.gen_obs()['image'].copy()
+child = env.clone(1)[0]
+assert child.obs_out is not env.obs_out
+assert child.observation_space is not env.observation_space
+child.step(env.actions.left)
+assert np.array_equal(env.obs_out, image)
+
+##############################################################################
+
+print('testing incremental state hashes')
+env = gym.make('MiniGrid-KeyCorridorS3R3-v0')
+env.reset()
+hashes = {}
+for i in range(0, 500):
+    obs, reward, done, info = env.step(random.randint(0, 5))
+    grid = env.grid
+    assert grid.zobrist_hash() == Grid.from_array(grid.encode()).zobrist_hash()
+    state = (grid.encode().tobytes(), tuple(env.agent_pos), env.agent_dir, env.carrying)
+    assert hashes.setdefault(env.state_hash, state) == state
+    assert env.hash() == '%016x' % env.state_hash
+    if done:
+        env.reset()
+
+# Doors modified in place update the hash of list-backed grids incrementally
+env = gym.make('MiniGrid-DoorKey-8x8-v0').unwrapped
+env.reset()
+assert not env.grid.array_backed
+door_pos = next((i, j) for i in range(env.width) for j in range(env.height)
+                if isinstance(env.grid.get(i, j), Door))
+h = env.grid.zobrist_hash()
+env.grid.get(*door_pos).is_open = True
+env.grid.refresh(*door_pos)
+assert env.grid._zobrist is not None
+assert env.grid.zobrist_hash() == Grid.from_array(env.grid.encode()).zobrist_hash() != h
+
+# SHA-256 hashes don't depend on how the agent position is stored
+env1 = gym.make('MiniGrid-DoorKey-8x8-v0').unwrapped
+env2 = gym.make('MiniGrid-DoorKey-8x8-v0').unwrapped
+env2.reuse_obs_buffers = True
+env1.seed(3)
+env2.seed(3)
+env1.reset()
+env2.reset()
+for i in range(0, 50):
+    action = random.randint(0, 2)
+    env1.step(action)
+    env2.step(action)
+    assert env1.sha256_hash() == env2.sha256_hash()
+
+##############################################################################
+
+print('testing visit counts')
+from gym_minigrid.counts import VisitCounts, HashedCounts
+
+# Exploration bonuses count visits of the agent's position
+env = StateBonus(gym.make('MiniGrid-Empty-8x8-v0'))
+env.reset()
+visits = {}
+for i in range(0, 200):
+    obs, reward, done, info = env.step(random.randint(0, 2))
+    pos = tuple(env.agent_pos)
+    visits[pos] = visits.get(pos, 0) + 1
+    assert done or abs(reward - 1 / np.sqrt(visits[pos])) < 1e-9
+    if done:
+        env.reset()
+
+# Batched updates count duplicate tuples, and decay all counts
+counts = VisitCounts((4, 4), decay=0.5)
+assert np.array_equal(counts.update(np.array([1, 1, 2]), np.array([0, 0, 3])), [2, 2, 1])
+assert counts.update(1, 0) == 2
+assert counts.get(2, 3) == 0.5
+
+# Hashed counts stay within their capacity
+counts = HashedCounts(capacity=64, max_probes=4)
+keys = np.arange(1000, dtype=np.uint64) * np.uint64(2654435761)
+assert np.all(counts.update(keys) == 1)
+assert len(counts) <= 64
+assert np.all(counts.values[counts.keys != 0] == 1)
+assert counts.get(keys).sum() == len(counts)
+
+# Keys of the same batch competing for the same slots never share one
+counts = HashedCounts(capacity=4, max_probes=2)
+assert np.all(counts.update([1, 2, 3, 4, 5]) == 1)
+assert len(counts) == 4
+stored = counts.get([1, 2, 3, 4, 5])
+assert set(stored.tolist()) <= {0, 1} and stored.sum() == 4
+assert counts.update(12345) == 1
+assert counts.update(12345) == 2
+
+##############################################################################
+
+print('testing one-hot encodings')
+env = gym.make('MiniGrid-KeyCorridorS3R3-v0')
+obs = env.reset()
+image = obs['image']
+bits = OneHotPartialObsWrapper(env).observation(obs)['image']
+for i in range(0, image.shape[0]):
+    for j in range(0, image.shape[1]):
+        on = np.flatnonzero(bits[i, j])
+        assert np.array_equal(on, image[i, j] + ONE_HOT_OFFSETS)
+
+# Batches of observations, and bits packed into bytes
+batch = np.stack([image, image[::-1]])
+assert np.array_equal(one_hot(batch)[1], bits[::-1])
+packed = OneHotPartialObsWrapper(env, packed=True).observation(obs)['image']
+assert np.array_equal(packed, np.packbits(bits, axis=-1))
+
+##############################################################################
+
+print('testing flat observations')
+env = gym.make('MiniGrid-LockedRoom-v0')
+obs = env.reset()
+flat = FlatObsWrapper(env).observation(obs)
+assert flat.dtype == np.uint8 and flat.shape == (7 * 7 * 3 + 27 * 96,)
+assert np.array_equal(flat[:7 * 7 * 3], obs['image'].flatten())
+
+# Characters other than letters and spaces repeat the previous character
+codes = encode_mission('go, now', 10)
+assert np.array_equal(codes, [6, 14, 14, 26, 13, 14, 22, -1, -1, -1])
+chars = flat[7 * 7 * 3:].reshape(96, 27)
+assert np.array_equal(chars.argmax(axis=1)[:len(obs['mission'])], encode_mission(obs['mission'], 96)[:len(obs['mission'])])
+assert chars[len(obs['mission']):].sum() == 0
+
+# Integer tokens, with 0 for padding
+tokens = FlatObsWrapper(env, tokens=True).observation(obs)
+assert tokens.shape == (7 * 7 * 3 + 96,)
+assert np.array_equal(tokens[7 * 7 * 3:], encode_mission(obs['mission'], 96) + 1)
+
+##############################################################################
+
+print('testing mission tokens')
+from gym_minigrid.minigrid import MissionVocabulary
+vocab = MissionVocabulary.registered()
+for env_name in ['MiniGrid-Fetch-8x8-N3-v0', 'MiniGrid-LockedRoom-v0', 'MiniGrid-PutNear-8x8-N3-v0']:
+    env = gym.make(env_name)
+    env.unwrapped.tokenize_missions = True
+    obs = env.reset()
+    tokens = obs['mission_tokens']
+    assert env.observation_space['mission_tokens'].contains(tokens)
+    assert 1 not in tokens
+    assert vocab.decode(tokens) == obs['mission'].lower().replace(',', '')
+
+    # Missions are encoded once per episode
+    obs, _, _, _ = env.step(env.actions.left)
+    assert obs['mission_tokens'] is tokens
+
+# Batched missions of vector environments
+venv = VecMiniGrid('MiniGrid-DoorKey-5x5-v0', 3, seed=0, tokenize_missions=True)
+obs = venv.reset()
+assert obs['mission_tokens'].shape == (3, vocab.max_len)
+assert vocab.decode(obs['mission_tokens'][2]) == obs['mission'][2]
+
+##############################################################################
+
+print('testing free cell sampling')
+import hashlib
+from gym_minigrid.minigrid import Ball
+env = gym.make('MiniGrid-Empty-8x8-v0').unwrapped
+env.rng_version = 2
+env.seed(0)
+env.reset()
+
+# Fill the room, the map of empty cells must stay in sync with the grid
+num_empty = sum(env.grid.get(i, j) is None for i in range(8) for j in range(8)) - 1
+for _ in range(num_empty):
+    env.place_obj(Ball())
+    empty = [[env.grid.get(i, j) is None for j in range(8)] for i in range(8)]
+    assert np.array_equal(env.grid.free_cells(), empty)
+try:
+    env.place_obj(Ball())
+    assert False
+except RecursionError:
+    pass
+
+# Rejected cells are never returned
+env.reset()
+for _ in range(100):
+    pos = env.place_obj(None, top=(1, 1), size=(3, 3), reject_fn=lambda env, pos: pos[0] == 2)
+    assert pos[0] != 2 and 1 <= pos[1] <= 3
+
+# The default random stream reproduces earlier episodes
+env = gym.make('MiniGrid-Fetch-8x8-N3-v0').unwrapped
+env.seed(3)
+env.reset()
+assert hashlib.sha256(env.grid.encode().tobytes()).hexdigest()[:16] == '9b6ba4457fa2b3cb'
+assert tuple(env.agent_pos) == (4, 3) and env.mission == 'go fetch a blue ball'
+
+##############################################################################
+
+print('testing level banks')
+from gym_minigrid.levelbank import LevelBank
+env_name = 'MiniGrid-KeyCorridorS3R1-v0'
+bank = LevelBank.generate(env_name, range(20, 40), num_workers=2, chunk_size=8)
+assert len(bank) == 20
+with tempfile.TemporaryDirectory() as path:
+    bank.save(path)
+    bank = LevelBank.load(path)
+
+    # Levels are the first episodes of the environment seeded with their seed
+    env1 = gym.make(env_name).unwrapped
+    env2 = gym.make(env_name).unwrapped
+    env1.seed(33)
+    env1.reset()
+    env2.set_state(bank.level(33))
+    for action in [0, 2, 2, 1, 2, 3, 2, 5]:
+        obs1, reward1, done1, _ = env1.step(action)
+        obs2, reward2, done2, _ = env2.step(action)
+        assert np.array_equal(obs1['image'], obs2['image'])
+        assert (reward1, done1) == (reward2, done2)
+
+    # Episodes loaded from the bank are reproducible
+    env2.level_bank = bank
+    episodes = []
+    for _ in range(2):
+        env2.seed(0)
+        episodes.append([env2.reset()['image'].tobytes() for _ in range(5)])
+    assert episodes[0] == episodes[1]
+
+    # Loading a level doesn't make the levels sampled next cycle
+    sampled = set()
+    for _ in range(60):
+        env2.reset()
+        sampled.add(env2.grid.encode().tobytes())
+    assert len(sampled) >= 15
+    del bank, env2
+
+##############################################################################
+
+print('testing symbolic frames')
+from gym_minigrid.envs.delayedmatching import render_symbolic_frames
+env1 = gym.make('MiniGrid-DelayedMatchingS7-v0').unwrapped
+env2 = gym.make('MiniGrid-DelayedMatchingS7-v0').unwrapped
+env2.symbolic = True
+for seed in range(4):
+    env1.seed(seed)
+    env2.seed(seed)
+    frames = [env1.reset()]
+    symbolic_frames = [env2.reset()]
+    done = False
+    while not done:
+        obs, label, done, _ = env1.step()
+        frames.append(obs)
+        symbolic_frames.append(env2.step()[0])
+
+    # Symbolic frames render to the same images
+    imgs = render_symbolic_frames(
+        np.stack([grid for grid, _ in symbolic_frames]),
+        np.stack([params for _, params in symbolic_frames]),
+        env1.tile_size
+    )
+    assert np.array_equal(imgs, np.stack(frames))
+
+##############################################################################
+
+print('testing run-length frames')
+env1 = gym.make('MiniGrid-DelayedMatchingS7-v0').unwrapped
+env2 = gym.make('MiniGrid-DelayedMatchingS7-v0').unwrapped
+env2.run_length = True
+for seed in range(4):
+    env1.seed(seed)
+    env2.seed(seed)
+    frames = [env1.reset()]
+    done = False
+    while not done:
+        obs, label1, done, _ = env1.step()
+        frames.append(obs)
+    runs = [env2.reset()]
+    done = False
+    while not done:
+        obs, label2, done, _ = env2.step()
+        runs.append(obs)
+
+    # Cue, delay and test frames, which expand to the full episode
+    assert len(runs) == 3 and runs[1][1] == env2.nb_delay_frames
+    expanded = np.concatenate([np.repeat(frame[None], repeat, axis=0) for frame, repeat in runs])
+    assert np.array_equal(expanded, np.stack(frames))
+    assert label1 == label2
+
+##############################################################################
+
+print('testing episode datasets')
+import os
+from episode_dataset import write_shard, EpisodeDataset
+env_name = 'MiniGrid-DelayedMatchingS7-v0'
+env = gym.make(env_name).unwrapped
+frames = []
+labels = []
+for seed in range(6):
+    env.seed(seed)
+    episode = [env.reset()]
+    done = False
+    while not done:
+        obs, label, done, _ = env.step()
+        episode.append(obs)
+    frames.append(np.stack(episode))
+    labels.append(label)
+
+# Raw and symbolic shards load back as the frames of the live episodes
+for symbolic in [False, True]:
+    with tempfile.TemporaryDirectory() as path:
+        write_shard(os.path.join(path, 'shard-0'), env_name, [0, 1, 2], symbolic=symbolic)
+        write_shard(os.path.join(path, 'shard-1'), env_name, [3, 4, 5], symbolic=symbolic)
+        dataset = EpisodeDataset(path)
+        assert len(dataset) == 6 and dataset.symbolic == symbolic
+        for i in range(6):
+            batch_frames, batch_labels, seq_lens = dataset.batch(np.array([i]))
+            assert np.array_equal(batch_frames, frames[i])
+            assert batch_labels.tolist() == [labels[i]] and seq_lens == [len(frames[i])]
+
+        # An epoch goes through each episode once
+        indices = np.array([5, 0, 3])
+        batch_frames, batch_labels, seq_lens = dataset.batch(indices)
+        assert np.array_equal(batch_frames, np.concatenate([frames[i] for i in indices]))
+        epoch = list(dataset.batches(2, np.random.RandomState(0), nb_epochs=1))
+        assert len(epoch) == 3
+        epoch_labels = np.concatenate([batch_labels for _, batch_labels, _ in epoch])
+        assert sorted(epoch_labels.tolist()) == sorted(labels)
+        del dataset
@@ -7,8 +7,9 @@ setup(
     url='https://github.com/maximecb/gym-minigrid',
     description='Minimalistic gridworld package for OpenAI Gym',
     packages=['gym_minigrid', 'gym_minigrid.envs'],
+    python_requires='>=3.8',
     install_requires=[
-        'gym>=0.9.6',
-        'numpy>=1.15.0'
+        'gym>=0.22.0',
+        'numpy>=1.17.0'
     ]
 )
@@ -31,10 +31,13 @@ class CNN_LSTM(nn.Module):
 
         self.linear = nn.Linear(lstm_hidden_size, nb_class)
 
-    def forward(self, x, seq_lens):
+    def forward(self, x, seq_lens, repeats=None):
         x = self.cnn(x)
 
         x = torch.flatten(x, start_dim=1) # (batch_size * nb_total_images, nb_channel_output * ouput_heigh * output_width)
+        if repeats is not None:
+            # Run-length encoded frames, repeat the features of each distinct frame
+            x = torch.repeat_interleave(x, repeats, dim=0)
         x = torch.split(x, seq_lens) # list of tensors which is of length batch_size and each tensor (seq_len, input_size)
 
         x = torch.nn.utils.rnn.pad_sequence(x, batch_first=True)
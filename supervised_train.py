@@ -9,6 +9,7 @@ import sys
 
 import utils
 from train_mgmt import training_management
+from episode_dataset import EpisodeDataset
 from supervised_model import CNN_LSTM
 
 
@@ -33,6 +34,16 @@ parser.add_argument("--batch_size", type=int, default=256,
                     help="batch size (default: 256)")
 parser.add_argument("--lr", type=float, default=0.001,
                     help="learning rate (default: 0.001)")
+parser.add_argument("--workers", type=int, default=0,
+                    help="number of processes collecting episodes in parallel (default: 0, collect in the main process)")
+parser.add_argument("--prefetch", type=int, default=0,
+                    help="number of batches generated in advance in the background (default: 0, no prefetching)")
+parser.add_argument("--producers", type=int, default=1,
+                    help="number of processes generating batches in the background when prefetching (default: 1)")
+parser.add_argument("--run_length", action="store_true", default=False,
+                    help="collect episodes as runs of identical frames, each frame going through the cnn once")
+parser.add_argument("--dataset", default=None,
+                    help="directory of pre-generated episodes to train on instead of live episodes (see generate_dataset.py)")
 
 args = parser.parse_args()
 
@@ -60,6 +71,15 @@ txt_logger.info(f"Device: {device}\n")
 utils.seed(args.seed)
 env = gym.make(args.env)
 env.seed(args.seed)
+if args.run_length:
+    env.unwrapped.run_length = True
+
+# Load dataset
+dataset = None
+if args.dataset is not None:
+    dataset = EpisodeDataset(args.dataset)
+    assert dataset.env_id == args.env, "dataset of {} episodes".format(dataset.env_id)
+    txt_logger.info("Dataset loaded: {} episodes\n".format(len(dataset)))
 
 # Load training status
 try:
@@ -76,7 +96,8 @@ model.to(device)
 txt_logger.info("Model loaded\n")
 txt_logger.info("{}\n".format(model))
 
-mgmt = training_management(env, model, device, args.lr, args.batch_size)
+mgmt = training_management(env, model, device, args.lr, args.batch_size, args.workers, args.seed,
+                           args.prefetch, args.producers, dataset)
 
 if "optimizer_state" in status:
     mgmt.optimizer.load_state_dict(status["optimizer_state"])
@@ -92,8 +113,8 @@ while update < args.updates and not over:
 
     # Train
     update_start_time = time.time()
-    images, label, seq_lens = mgmt.collect_episode()
-    loss, correct = mgmt.update_parameters(images, label, seq_lens)
+    images, label, seq_lens, repeats = mgmt.collect_episode()
+    loss, correct = mgmt.update_parameters(images, label, seq_lens, repeats)
 
     # Log
     losses.append(loss)
@@ -123,8 +144,14 @@ while update < args.updates and not over:
         over = (acc >= 0.9999)
         accuracy = torch.tensor([]).to(device)
 
+        # Time waiting for prefetched batches, i.e. while data generation was
+        # the bottleneck
+        if mgmt.prefetcher is not None:
+            header += ["Wait"]
+            data += [mgmt.prefetcher.stats()["wait_time"]]
+
         txt_logger.info(
-            "U {} | T {} | L {:.3f} | A {:.4f}"
+            ("U {} | T {} | L {:.3f} | A {:.4f}" + (" | W {:.1f}s" if len(data) > 4 else ""))
             .format(*data))
 
         if status["update"] == 0:
@@ -141,3 +168,5 @@ while update < args.updates and not over:
                   "model_state": model.state_dict(), "optimizer_state": mgmt.optimizer.state_dict()}
         utils.save_status(status, model_dir)
         txt_logger.info("Status saved")
+
+mgmt.close()
@@ -1,10 +1,169 @@
+import time
+import multiprocessing as mp
 import numpy as np
 import torch
+import gym
+import gym_minigrid
+
+
+def run_episodes(env, nb_episodes):
+    """
+    Run episodes of an environment, returning their frames concatenated in
+    one array of shape (nb_total_frames, y, x, channel), their labels,
+    their number of frames and the repeat count of each frame. In
+    run-length mode (see DelayedMatchingEnv.step_run_length), only the
+    distinct frames of runs of identical frames are returned, along with
+    their repeat counts. Repeat counts are None otherwise.
+    """
+    run_length = getattr(env.unwrapped, 'run_length', False)
+    frames = []
+    repeats = []
+    labels = []
+    seq_lens = []
+    for i in range(nb_episodes):
+        obs = env.reset()
+        done = False
+        seq_len = 0
+        while True: # complete an episode
+            if run_length:
+                obs, repeat = obs
+                repeats.append(repeat)
+                seq_len += repeat
+            else:
+                seq_len += 1
+            frames.append(obs)
+            if done:
+                break
+            # The action is ignored, but gym.make's wrappers require one
+            obs, label, done, _ = env.step(0)
+        labels.append(label)
+        seq_lens.append(seq_len)
+    repeats = np.array(repeats, dtype=np.int64) if run_length else None
+    return np.stack(frames, axis=0), np.array(labels), seq_lens, repeats
+
+
+def worker_seeds(seed, n):
+    """
+    Seeds of the environments of n processes, spawned from seed so that
+    they differ from each other and from seed itself. Without a seed, they
+    differ from one run to the next.
+    """
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(n)]
+
+
+def make_env(env_id, seed, run_length=False):
+    env = gym.make(env_id)
+    env.seed(seed)
+    if run_length:
+        env.unwrapped.run_length = True
+    return env
+
+
+def episode_worker(remote, env_id, seed, run_length=False):
+    """
+    Run the episodes requested by the learner on an environment owned by
+    this process
+    """
+    env = make_env(env_id, seed, run_length)
+    try:
+        while True:
+            cmd, nb_episodes = remote.recv()
+            if cmd == 'collect':
+                remote.send(run_episodes(env, nb_episodes))
+            elif cmd == 'close':
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        env.close()
+
+
+def batch_producer(queue, env_id, seed, batch_size, run_length=False):
+    """
+    Fill a queue with batches of episodes of an environment owned by this
+    process, until the process is terminated
+    """
+    env = make_env(env_id, seed, run_length)
+    try:
+        while True:
+            queue.put(run_episodes(env, batch_size))
+    except KeyboardInterrupt:
+        pass
+
+
+class batch_prefetcher():
+    """
+    Batches of episodes produced in the background by nb_producers
+    processes, each owning its own environment seeded with a seed spawned
+    from seed (see worker_seeds). Up to depth ready batches wait in a
+    bounded queue, so that producers keep generating the next batches while
+    the model trains on the current one. The order in which the producers'
+    batches arrive is not fixed.
+    """
+
+    def __init__(self, env_id, batch_size, depth=2, nb_producers=1, seed=None, run_length=False):
+        self.queue = mp.Queue(depth)
+        self.processes = []
+        for producer_seed in worker_seeds(seed, nb_producers):
+            process = mp.Process(
+                target=batch_producer,
+                args=(self.queue, env_id, producer_seed, batch_size, run_length),
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+
+        # Time spent waiting for batches, since the last call to stats()
+        self.wait_time = 0
+        self.nb_batches = 0
+
+    def get(self):
+        """
+        Get the next ready batch, waiting if the queue is empty
+        """
+        start_time = time.time()
+        batch = self.queue.get()
+        self.wait_time += time.time() - start_time
+        self.nb_batches += 1
+        return batch
+
+    def stats(self):
+        """
+        Return the time spent waiting for batches and the number of batches
+        received since the last call. A waiting time close to the total
+        time means that data generation is the bottleneck, and a waiting
+        time close to zero that the model is.
+        """
+        stats = {"wait_time": self.wait_time, "nb_batches": self.nb_batches}
+        self.wait_time = 0
+        self.nb_batches = 0
+        return stats
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        self.queue.close()
+        self.processes = []
 
 
 class training_management():
 
-    def __init__(self, env, model, device=None, lr=0.001, batch_size=256):
+    def __init__(self, env, model, device=None, lr=0.001, batch_size=256, nb_workers=0, seed=None,
+                 prefetch=0, nb_producers=1, dataset=None):
+        """
+        With nb_workers > 0, episodes are collected in parallel by as many
+        worker processes, each owning its own environment of the same id as
+        env, seeded with a seed spawned from seed (see worker_seeds). With
+        prefetch > 0, whole batches are instead produced in the background
+        by nb_producers processes (see batch_prefetcher), with up to
+        prefetch batches ready in advance.
+        With a dataset (see episode_dataset.EpisodeDataset), batches are
+        read from its pre-generated episodes instead, reshuffled at each
+        epoch. Workers and producers run their environments in run-length
+        mode when env is in run-length mode.
+        """
         self.env = env
         self.model = model
         self.device = device
@@ -15,38 +174,84 @@ class training_management():
         self.criterion = torch.nn.CrossEntropyLoss()
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr)
 
+        run_length = getattr(env.unwrapped, 'run_length', False)
+
+        self.dataset = dataset
+        if dataset is not None:
+            self.dataset_batches = dataset.batches(batch_size, np.random.RandomState(seed))
+            prefetch = 0
+            nb_workers = 0
+
+        self.prefetcher = None
+        if prefetch > 0:
+            self.prefetcher = batch_prefetcher(env.spec.id, batch_size, prefetch, nb_producers, seed, run_length)
+            nb_workers = 0
+
+        self.remotes = []
+        self.processes = []
+        for worker_seed in worker_seeds(seed, nb_workers):
+            remote, work_remote = mp.Pipe()
+            process = mp.Process(
+                target=episode_worker,
+                args=(work_remote, env.spec.id, worker_seed, run_length),
+                daemon=True
+            )
+            process.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
     def collect_episode(self):
         """
-        Collects frames and label for a batch
-        """
-        batch = []
-        batch_label = []
-        for i in range(self.batch_size):
-            frames = [self.env.reset()]
-            done = False
-            while not done: # complete an episode
-                obs, label, done, _ = self.env.step()
-                frames.append(obs)
-            frames = np.stack(frames, axis=0) # frames of one episode, shape: (nb_frames, y, x, channel)
-            frames = torch.tensor(frames, device=self.device, dtype=torch.float)
-            frames = frames.transpose(2, 3)
-            frames = frames.transpose(1, 2)  # shape: (nb_frames, channel, y, x)
-            frames = frames / 255 # scale pixel values to [0,1]
-            batch.append(frames)
-            batch_label.append(label)
-
-        # remove timesteps dimension because feed into cnn first and cnn processes each image individually
-        seq_lens = [] # count number of frames for each sample to reassemble them later
-        for i in range(len(batch)): # get the different nb_frames (i.e. seq_len) for each sample
-            seq_lens.append(batch[i].shape[0]) # x[i] shape: (nb_frames, channel, y, x)
-        batch = torch.cat(batch, dim=0)
-        batch_label = torch.tensor(batch_label, device=self.device, dtype=torch.long)
-        return batch, batch_label, seq_lens
-
-
-    def update_parameters(self, input, label, seq_lens):
+        Collects frames and label for a batch, along with the repeat count
+        of each frame in run-length mode (see run_episodes)
+        """
+        repeats = None
+        if self.dataset is not None:
+            frames, labels, seq_lens = next(self.dataset_batches)
+        elif self.prefetcher is not None:
+            frames, labels, seq_lens, repeats = self.prefetcher.get()
+        elif self.remotes:
+            # Split the batch between the workers, whose episodes are
+            # concatenated in a fixed order
+            splits = np.array_split(np.arange(self.batch_size), len(self.remotes))
+            for remote, split in zip(self.remotes, splits):
+                remote.send(('collect', len(split)))
+            results = [remote.recv() for remote in self.remotes]
+            frames = np.concatenate([r[0] for r in results], axis=0)
+            labels = np.concatenate([r[1] for r in results], axis=0)
+            seq_lens = [seq_len for r in results for seq_len in r[2]]
+            if results[0][3] is not None:
+                repeats = np.concatenate([r[3] for r in results], axis=0)
+        else:
+            frames, labels, seq_lens, repeats = run_episodes(self.env, self.batch_size)
+
+        # frames of all the episodes, concatenated along the first dimension
+        # because the cnn processes each image individually. seq_lens counts
+        # the number of frames of each sample to reassemble them later.
+        batch = torch.from_numpy(frames).to(self.device) # shape: (nb_total_frames, y, x, channel)
+        batch = batch.permute(0, 3, 1, 2) # shape: (nb_total_frames, channel, y, x)
+        batch = batch.float() / 255 # scale pixel values to [0,1]
+        batch_label = torch.tensor(labels, device=self.device, dtype=torch.long)
+        if repeats is not None:
+            repeats = torch.from_numpy(repeats).to(self.device)
+        return batch, batch_label, seq_lens, repeats
+
+    def close(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+        self.remotes = []
+        self.processes = []
+
+
+    def update_parameters(self, input, label, seq_lens, repeats=None):
         self.optimizer.zero_grad()
-        output = self.model(input, seq_lens)
+        output = self.model(input, seq_lens, repeats)
         correct = (torch.argmax(output, dim=1) == label)
         loss = self.criterion(output, label)
         loss.backward()